@@ -0,0 +1,84 @@
+"""Size, deduplication and GC duration of the image asset store.
+
+Plays ``--users`` sessions of ``--scenes`` scenes into a temporary store.
+Images are random bytes of ``--image-kb`` KB. A ``--repeat-share`` of the
+scenes reuse an image seen before, as with preset worlds or a scene whose
+picture does not change. Then ``--reset-share`` of the users reset their
+game and one GC pass runs. The report printed afterwards is the same one
+the game logs.
+
+Run with ``python benchmarks/bench_asset_store.py [--users N]``.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from config import settings  # noqa: E402
+from images.asset_store import AssetStore  # noqa: E402
+
+
+async def run(args) -> None:
+    settings.asset_gc_grace_seconds = 0
+    settings.asset_gc_interval_seconds = float("inf")
+    random.seed(args.seed)
+    seen = []
+    with tempfile.TemporaryDirectory() as root:
+        store = AssetStore(root)
+        started = time.perf_counter()
+        for user in range(args.users):
+            for scene in range(args.scenes):
+                if seen and random.random() < args.repeat_share:
+                    data = random.choice(seen)
+                else:
+                    data = random.randbytes(args.image_kb * 1024)
+                    seen.append(data)
+                path = await store.put(data)
+                await store.add_ref(f"user-{user}", f"scene-{scene}", path)
+        write = time.perf_counter() - started
+        before = await store.size()
+
+        for user in range(int(args.users * args.reset_share)):
+            await store.drop_user(f"user-{user}")
+        await store.collect_garbage()
+        report = await store.report()
+        store.close()
+
+    puts = args.users * args.scenes
+    print(
+        f"{puts} images in {write:.2f}s ({write / puts * 1000:.2f} ms each), "
+        f"dedupe ratio {report['dedupe_ratio']:.0%}"
+    )
+    print(
+        f"store before GC: {before['assets']} assets, {before['bytes'] / 2**20:.1f} MB"
+    )
+    print(
+        f"GC removed {report['gc_removed']} assets "
+        f"({report['gc_freed_bytes'] / 2**20:.1f} MB) in "
+        f"{report['last_gc_seconds'] * 1000:.1f} ms; "
+        f"now {report['assets']} assets, {report['bytes'] / 2**20:.1f} MB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--scenes", type=int, default=20)
+    parser.add_argument("--image-kb", type=int, default=64)
+    parser.add_argument("--repeat-share", type=float, default=0.3)
+    parser.add_argument("--reset-share", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
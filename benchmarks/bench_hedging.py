@@ -0,0 +1,145 @@
+"""Tail latency of model calls with and without hedging.
+
+A local HTTP server stands in for Gemini. It answers after ``--base`` seconds
+and stalls for ``--stall`` seconds on a ``--stall-rate`` share of requests,
+the way an overloaded backend sometimes does. The same sequence of calls is
+made through the plain key pool and through ``agent.hedging.Hedger``, and
+the p50/p95/p99 latency is printed together with the extra requests the
+hedges cost.
+
+Run with ``python benchmarks/bench_hedging.py [--calls N] [--stall-rate R]``.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from config import settings  # noqa: E402
+from agent.hedging import Hedger  # noqa: E402
+from agent.key_pool import KeyPool, genai_client, set_key_pool  # noqa: E402
+
+BODY = json.dumps(
+    {"candidates": [{"content": {"role": "model", "parts": [{"text": "ok"}]}}]}
+).encode()
+
+
+class StallingGemini(BaseHTTPRequestHandler):
+    """Answers every request, some of them only after a stall."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    base = 0.05
+    stall = 1.0
+    stall_rate = 0.05
+    requests = 0
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        type(self).requests += 1
+        stalled = random.random() < self.stall_rate
+        time.sleep(self.base + (self.stall if stalled else 0.0))
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+        except BrokenPipeError:
+            pass  # the losing side of a hedge was cancelled
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+async def generate(key: str) -> str:
+    response = await genai_client(key).aio.models.generate_content(
+        model="gemini-bench", contents="hi"
+    )
+    return response.text
+
+
+def quantiles(samples):
+    cuts = statistics.quantiles(samples, n=100)
+    return statistics.median(samples), cuts[94], cuts[98]
+
+
+async def measure(call, calls: int, concurrency: int):
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with gate:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return latencies
+
+
+async def run(args) -> None:
+    # The stand-in has no quota, so the pool's rate limit is lifted.
+    pool = KeyPool([f"key-{i}" for i in range(args.keys)], requests_per_minute=1e6)
+    set_key_pool(pool)
+    hedger = Hedger(budget=args.budget, min_samples=20)
+
+    print(f"{'mode':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'extra %':>8}")
+    for mode in ("plain", "hedged"):
+        random.seed(args.seed)
+        StallingGemini.requests = 0
+        if mode == "plain":
+            call = lambda: pool.call(generate)  # noqa: E731
+        else:
+            # Warm the latency window so hedging is active from the first call.
+            for _ in range(hedger.min_samples):
+                hedger.observe("bench", StallingGemini.base * 1.5)
+            call = lambda: hedger.call("bench", generate, deadline=30)  # noqa: E731
+        latencies = await measure(call, args.calls, args.concurrency)
+        p50, p95, p99 = quantiles(latencies)
+        extra = StallingGemini.requests / args.calls - 1
+        print(
+            f"{mode:>8} {p50 * 1000:>8.0f} {p95 * 1000:>8.0f} {p99 * 1000:>8.0f}"
+            f" {extra * 100:>8.1f}"
+        )
+    set_key_pool(None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--keys", type=int, default=3)
+    parser.add_argument("--base", type=float, default=0.05)
+    parser.add_argument("--stall", type=float, default=1.0)
+    parser.add_argument("--stall-rate", type=float, default=0.05)
+    parser.add_argument("--budget", type=float, default=settings.hedge_budget)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    StallingGemini.base = args.base
+    StallingGemini.stall = args.stall
+    StallingGemini.stall_rate = args.stall_rate
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StallingGemini)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings.llm_api_endpoint = f"http://127.0.0.1:{server.server_port}"
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
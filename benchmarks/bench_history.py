@@ -0,0 +1,75 @@
+"""Scene prompt size over a long session, full history versus rolling summary.
+
+Plays a session of ``--steps`` choices against the in-memory state backend.
+After each step it builds the scene prompt twice: once with the history
+joined from every choice (the old behaviour) and once with
+``agent.history.build_history``. Summaries are produced by a stand-in that
+returns a text of ``--summary-words`` words, so the numbers reflect prompt
+size rather than model quality. Prefill latency grows with prompt tokens, so
+the rolling history keeps per-step latency flat.
+
+Run with ``python benchmarks/bench_history.py [--steps N]``.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from agent import history, redis_state  # noqa: E402
+from agent.memory_state import MemoryStateBackend  # noqa: E402
+from agent.models import UserChoice  # noqa: E402
+from agent.prompts import SCENE_PROMPT  # noqa: E402
+
+FRAME = dict(
+    lore="An underground city ruled by the guild of lamplighters. " * 4,
+    goal="Escape the undercity before the last lamp goes out.",
+    milestones="find_map,light_beacon,cross_river",
+    endings="escape,lost_in_dark",
+)
+
+
+def prompt(history_text: str, last_choice: str) -> str:
+    return SCENE_PROMPT.format(history=history_text, last_choice=last_choice, **FRAME)
+
+
+async def run(steps: int, summary_words: int) -> None:
+    redis_state.set_state_backend(MemoryStateBackend())
+
+    async def summarize(summary, choices):
+        return " ".join(["story"] * summary_words)
+
+    print(f"{'step':>5} {'full tok':>9} {'rolling tok':>12}")
+    for step in range(1, steps + 1):
+        choice = UserChoice(
+            scene_id=str(uuid.uuid4()), choice_text=f"Take the passage number {step}"
+        )
+        await redis_state.append_user_choice("u", choice)
+        state = await redis_state.get_user_state("u")
+        task = history.schedule_summary("u", state, summarize)
+        if task is not None:
+            await task
+
+        full = "; ".join(f"{c.scene_id}:{c.choice_text}" for c in state.user_choices)
+        full_tokens = history.estimate_tokens(prompt(full, choice.choice_text))
+        rolling = await history.build_history("u")
+        rolling_tokens = history.estimate_tokens(prompt(rolling, choice.choice_text))
+        if step % 10 == 0 or step == 1:
+            print(f"{step:>5} {full_tokens:>9} {rolling_tokens:>12}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=60)
+    parser.add_argument("--summary-words", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.steps, args.summary_words))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Per-call setup time and upload bytes of ``modify_image``.
+
+Plays ``--users`` edit chains of ``--edits`` scene images. The pictures are
+synthetic ``--size`` px PNGs like those the image model returns. For each
+edit, the benchmark times the setup that happens before the request is
+sent, and counts the bytes of the image in the request.
+
+- before: a new ``genai.Client``, an ``os.path.exists`` check, ``Image.open``
+  from disk, and the SDK encoding the PIL image again as PNG;
+- after: the shared client from the key pool and the prepared upload from
+  :class:`ImageMemory`, within ``image_upload_max_kb``. The time spent
+  preparing it when the image arrived is reported separately.
+
+Run with ``python benchmarks/bench_image_upload.py [--users N]``.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+from google import genai
+from google.genai import _transformers, types
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from agent.key_pool import genai_client  # noqa: E402
+from images.image_memory import ImageMemory, get_image_memory_stats  # noqa: E402
+
+
+def picture(size: int, rng: np.random.Generator) -> bytes:
+    coarse = rng.random((8, 8, 3)) * 255
+    field = Image.fromarray(coarse.astype(np.uint8)).resize(
+        (size, size), Image.BICUBIC
+    )
+    noise = rng.normal(0, 6, (size, size, 3))
+    pixels = np.clip(np.asarray(field, dtype=np.float64) + noise, 0, 255)
+    buffer = BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def before(path: str):
+    client = genai.Client(api_key="bench")
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    blob = _transformers.pil_to_blob(Image.open(path))
+    return client, blob.data
+
+
+async def after(memory: ImageMemory, user: str, path: str):
+    client = genai_client("bench")
+    data, mime_type = await memory.upload(user, path)
+    return client, types.Part.from_bytes(data=data, mime_type=mime_type).inline_data.data
+
+
+async def run(args) -> None:
+    rng = np.random.default_rng(args.seed)
+    images = [picture(args.size, rng) for _ in range(args.users * args.edits)]
+    memory = ImageMemory(users=args.users)
+    old_ms, new_ms, old_bytes, new_bytes = [], [], [], []
+    with tempfile.TemporaryDirectory() as root:
+        for user in range(args.users):
+            for edit in range(args.edits):
+                data = images[user * args.edits + edit]
+                path = os.path.join(root, f"{user}-{edit}.png")
+                with open(path, "wb") as f:
+                    f.write(data)
+                # The image arrives from the model and is stored.
+                await memory.remember(f"user-{user}", path, data)
+
+                started = time.perf_counter()
+                _, sent = before(path)
+                old_ms.append((time.perf_counter() - started) * 1000)
+                old_bytes.append(len(sent))
+
+                started = time.perf_counter()
+                _, sent = await after(memory, f"user-{user}", path)
+                new_ms.append((time.perf_counter() - started) * 1000)
+                new_bytes.append(len(sent))
+
+    stats = get_image_memory_stats()
+    edits = len(old_ms)
+    print(f"{edits} edits of {args.size}px images, {args.users} users")
+    for label, ms, sent in (
+        ("before", old_ms, old_bytes),
+        ("after", new_ms, new_bytes),
+    ):
+        print(
+            f"{label:<7} setup p50 {statistics.median(ms):7.2f} ms, "
+            f"max {max(ms):7.2f} ms; upload {sum(sent) / edits / 1024:6.0f} KB"
+        )
+    print(
+        f"memory hit rate {stats.hit_rate:.0%}; preparing uploads took "
+        f"{stats.prepare_seconds / stats.prepared * 1000:.1f} ms per image "
+        "when it arrived"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--edits", type=int, default=5)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Encode time, file size and bytes served per scene for image variants.
+
+Builds ``--images`` synthetic ``--size`` x ``--size`` pictures: smooth
+colour fields with fine noise, close to a painted background. Each is
+encoded as PNG, as the image model returns it. The benchmark compares
+three things:
+
+- the old path, which decoded the bytes and saved them again as PNG;
+- the raw passthrough, which stores the bytes as they are;
+- the variant pool with 1, 2 and 4 workers: how soon the paths are
+  returned, and how long the variants take in the background.
+
+Then ``--mobile-share`` of the scenes are served to phones and the rest to
+desktops, and the bytes served are compared against sending the PNG.
+
+Run with ``python benchmarks/bench_image_variants.py [--images N]``.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from config import settings  # noqa: E402
+from images import variants  # noqa: E402
+from images.asset_store import AssetStore, set_asset_store  # noqa: E402
+
+
+def picture(size: int, rng: np.random.Generator) -> bytes:
+    coarse = rng.random((8, 8, 3)) * 255
+    field = Image.fromarray(coarse.astype(np.uint8)).resize(
+        (size, size), Image.BICUBIC
+    )
+    noise = rng.normal(0, 6, (size, size, 3))
+    pixels = np.clip(np.asarray(field, dtype=np.float64) + noise, 0, 255)
+    buffer = BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def legacy(data: bytes) -> bytes:
+    buffer = BytesIO()
+    Image.open(BytesIO(data)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+async def store_all(images, workers: int):
+    """Seconds until every path is returned and until every variant is stored."""
+    with tempfile.TemporaryDirectory() as root:
+        store = AssetStore(root)
+        set_asset_store(store)
+        pool = variants.VariantPool(workers=workers, queue=len(images))
+        variants.set_variant_pool(pool)
+        started = time.perf_counter()
+        await asyncio.gather(*(variants.store_image(data) for data in images))
+        returned = time.perf_counter() - started
+        await pool.join()
+        elapsed = time.perf_counter() - started
+        pool.close()
+        store.close()
+    return returned, elapsed
+
+
+async def run(args) -> None:
+    settings.asset_gc_interval_seconds = float("inf")
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+    images = [picture(args.size, rng) for _ in range(args.images)]
+    raw = sum(map(len, images)) / len(images)
+
+    started = time.perf_counter()
+    reencoded = [legacy(data) for data in images]
+    legacy_ms = (time.perf_counter() - started) / len(images) * 1000
+    print(
+        f"{args.images} images {args.size}px, {raw / 1024:.0f} KB each as returned"
+    )
+    print(
+        f"old PNG re-encode: {legacy_ms:.1f} ms, "
+        f"{sum(map(len, reencoded)) / len(images) / 1024:.0f} KB; "
+        "passthrough: 0 ms, same bytes"
+    )
+
+    stats = variants.get_variant_stats()
+    for workers in (1, 2, 4):
+        returned, elapsed = await store_all(images, workers)
+        print(
+            f"variant pool, {workers} worker(s): paths after "
+            f"{returned / args.images * 1000:.1f} ms each, variants done after "
+            f"{elapsed:.2f}s ({elapsed / args.images * 1000:.0f} ms each)"
+        )
+    for name, count in stats.encoded.items():
+        print(
+            f"  {name:<9} {stats.encode_seconds[name] / count * 1000:6.1f} ms "
+            f"{stats.variant_bytes[name] / count / 1024:7.0f} KB"
+        )
+
+    # Serve every scene once, as the UI does.
+    with tempfile.TemporaryDirectory() as root:
+        store = AssetStore(root)
+        set_asset_store(store)
+        pool = variants.VariantPool(queue=len(images))
+        variants.set_variant_pool(pool)
+        paths = [await variants.store_image(data) for data in images]
+        await pool.join()
+        served = original = 0
+        for path in paths:
+            mobile = random.random() < args.mobile_share
+            width = variants.MOBILE_WIDTH if mobile else variants.DESKTOP_WIDTH
+            served += os.path.getsize(variants.pick_variant(path, width))
+            original += os.path.getsize(path)
+        pool.close()
+        store.close()
+    print(
+        f"served per scene ({args.mobile_share:.0%} mobile): "
+        f"{served / len(paths) / 1024:.0f} KB instead of "
+        f"{original / len(paths) / 1024:.0f} KB ({1 - served / original:.0%} less)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=24)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--mobile-share", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Per-call overhead of building LLM clients versus reusing cached runnables.
+
+A local HTTP server stands in for Gemini and answers every request with a
+canned structured-output response, so the timings contain only client-side
+work and connection handling. Compares constructing a client and calling
+``with_structured_output`` on every call (the old behaviour) with the runnables
+handed out by ``agent.llm.structured_llm``.
+
+The stand-in speaks REST, so calls are made with the synchronous ``invoke``;
+the async path uses a gRPC channel that is reused by the cached clients in the
+same way.
+
+Run with ``python benchmarks/bench_llm_overhead.py [--calls N] [--keys K]``.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from langchain_google_genai import ChatGoogleGenerativeAI  # noqa: E402
+
+from config import settings  # noqa: E402
+from agent import llm  # noqa: E402
+from agent.key_pool import KeyPool, get_key_pool, set_key_pool  # noqa: E402
+from agent.models import SceneLLM  # noqa: E402
+
+SCENE_ARGS = {
+    "description": "The corridor stretches out in front of me.",
+    "choices": [
+        {"text": "Open the door", "next_scene_short_desc": "Room"},
+        {"text": "Turn back", "next_scene_short_desc": "Hall"},
+    ],
+}
+
+
+class StandInGemini(BaseHTTPRequestHandler):
+    """Answers ``generateContent`` with a call of the requested tool."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections: set = set()
+
+    def do_POST(self) -> None:
+        self.connections.add(self.client_address)
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        name = request["tools"][0]["functionDeclarations"][0]["name"]
+        body = json.dumps(
+            {
+                "candidates": [
+                    {
+                        "content": {
+                            "role": "model",
+                            "parts": [{"functionCall": {"name": name, "args": SCENE_ARGS}}],
+                        },
+                        "finishReason": "STOP",
+                    }
+                ],
+                "usageMetadata": {
+                    "promptTokenCount": 1,
+                    "candidatesTokenCount": 1,
+                    "totalTokenCount": 2,
+                },
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def fresh_runnable():
+    return ChatGoogleGenerativeAI(
+        model=llm.MODEL_NAME,
+        google_api_key=get_key_pool().pick(),
+        temperature=settings.temperature,
+        top_p=settings.top_p,
+        thinking_budget=llm.THINKING_BUDGET,
+        transport=settings.llm_transport,
+        client_options={"api_endpoint": settings.llm_api_endpoint},
+    ).with_structured_output(SceneLLM)
+
+
+def cached_runnable():
+    return llm.structured_llm(SceneLLM)
+
+
+def measure(make, calls: int) -> tuple[list, list, int]:
+    StandInGemini.connections.clear()
+    build, total = [], []
+    for _ in range(calls):
+        started = time.perf_counter()
+        runnable = make()
+        built = time.perf_counter()
+        runnable.invoke("Describe the next scene.")
+        build.append(built - started)
+        total.append(time.perf_counter() - started)
+    return build, total, len(StandInGemini.connections)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--keys", type=int, default=3)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInGemini)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings.llm_transport = "rest"
+    settings.llm_api_endpoint = f"http://127.0.0.1:{server.server_port}"
+    set_key_pool(
+        KeyPool(
+            [f"key-{i}" for i in range(args.keys)],
+            requests_per_minute=1e6,
+            burst=args.calls,
+        )
+    )
+
+    print(f"{'mode':<8} {'build ms':>9} {'call ms':>9} {'p95 ms':>9} {'conns':>6}")
+    for name, make in (("fresh", fresh_runnable), ("cached", cached_runnable)):
+        build, total, connections = measure(make, args.calls)
+        print(
+            f"{name:<8} {statistics.mean(build) * 1000:>9.3f} "
+            f"{statistics.mean(total) * 1000:>9.3f} "
+            f"{statistics.quantiles(total, n=20)[-1] * 1000:>9.3f} {connections:>6}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Hit rate and time saved by the prompt cache on a replayed workload.
+
+Simulates ``--games`` games, ``--concurrency`` at a time, on ``--workers``
+workers that share one Redis (fakeredis). A ``--preset-share`` of the games start in a preset world, so
+their scene descriptions repeat, and every game ends on one of a few ending
+descriptions. The prompt agent is a stand-in that takes ``--latency``
+seconds. The numbers therefore show how often the model is skipped, not
+how good its answers are.
+
+Run with ``python benchmarks/bench_prompt_cache.py [--games N]``.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import fakeredis
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from agent.models import ChangeScene  # noqa: E402
+from agent.prompt_cache import PromptCache, cache_key  # noqa: E402
+
+PRESET = [f"Preset world scene {i}: the lighthouse keeper waits." for i in range(4)]
+ENDINGS = [f"Ending {i}: the lamps go out one by one." for i in range(3)]
+
+
+async def run(args) -> None:
+    redis = fakeredis.FakeAsyncRedis()
+    workers = [
+        PromptCache("bench", ChangeScene, shared=lambda: redis)
+        for _ in range(args.workers)
+    ]
+    random.seed(args.seed)
+
+    async def agent():
+        await asyncio.sleep(args.latency)
+        return ChangeScene(change_scene="change_completely", scene_description="x")
+
+    running = asyncio.Semaphore(args.concurrency)
+
+    async def game(number: int) -> None:
+        cache = workers[number % len(workers)]
+        preset = random.random() < args.preset_share
+        scenes = PRESET if preset else [f"Game {number} scene {i}" for i in range(4)]
+        async with running:
+            for text in scenes + [random.choice(ENDINGS)]:
+                await cache.get_or_compute(cache_key("model", "system", text), agent)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(game(n) for n in range(args.games)))
+    elapsed = time.perf_counter() - started
+
+    local = shared = coalesced = misses = 0
+    saved = 0.0
+    for cache in workers:
+        stats = cache.stats
+        local += stats.local_hits
+        shared += stats.shared_hits
+        coalesced += stats.coalesced
+        misses += stats.misses
+        saved += stats.saved_seconds
+    lookups = local + shared + coalesced + misses
+    print(
+        f"{lookups} lookups: {local} local hits, {shared} shared hits, "
+        f"{coalesced} coalesced, {misses} model calls"
+    )
+    print(
+        f"hit rate {(lookups - misses) / lookups:.0%}, "
+        f"~{saved:.1f}s of model time saved, wall {elapsed:.2f}s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--preset-share", type=float, default=0.3)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Skip rate and agreement of the local scene-change classifier.
+
+Replays a corpus of consecutive scenes through ``agent.scene_change.classify``
+and compares its decisions with the image agent's. Each JSONL record holds
+``previous``, ``choice``, ``current`` and the LLM ``decision``. The default
+corpus in ``benchmarks/data`` is hand-labelled. A corpus of real LLM
+decisions is written by running the game with ``SCENE_CHANGE_CORPUS_PATH``
+set.
+
+Run with ``python benchmarks/bench_scene_change.py [--corpus FILE]``.
+"""
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from agent.scene_change import agreement, classify  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "data", "scene_changes.jsonl")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as corpus:
+        records = [json.loads(line) for line in corpus if line.strip()]
+
+    confusion = collections.Counter()
+    started = time.perf_counter()
+    for record in records:
+        local = classify(record["previous"], record["current"], record.get("choice"))
+        confusion[(record["decision"], local.decision or "llm")] += 1
+    per_call = (time.perf_counter() - started) / len(records)
+
+    print(f"{'llm decision':>18} {'local':>18} {'count':>6}")
+    for (llm, local), count in sorted(confusion.items()):
+        print(f"{llm:>18} {local:>18} {count:>6}")
+    summary = agreement(records)
+    print(
+        f"\n{summary['records']} records, {summary['skip_rate']:.0%} skipped, "
+        f"{summary['agreement']:.0%} agreement when skipped, "
+        f"{per_call * 1e6:.0f} us per decision"
+    )
+
+
+if __name__ == "__main__":
+    main()
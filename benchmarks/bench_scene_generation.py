@@ -0,0 +1,191 @@
+"""Fused scene generation versus the multi-agent path.
+
+A local HTTP server stands in for Gemini. It answers each structured-output
+call with canned arguments for the requested schema and waits
+``--latency`` seconds plus ``--per-token`` seconds per output token, so the
+time of a step is dominated by model calls as it is in production. Tokens are
+estimated at four characters per token from the request and response bodies.
+
+The multi-agent path is the scene call followed by the image agent, with the
+music agent running next to it (the step needs both prompts). The fused path
+is a single ``FusedSceneLLM`` call.
+
+The stand-in speaks REST, so calls are made with the synchronous ``invoke``.
+
+Run with ``python benchmarks/bench_scene_generation.py [--steps N]``.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from langchain_core.messages import HumanMessage, SystemMessage  # noqa: E402
+
+from config import settings  # noqa: E402
+from agent import llm  # noqa: E402
+from agent.image_agent import IMAGE_GENERATION_SYSTEM_PROMPT  # noqa: E402
+from agent.key_pool import KeyPool, set_key_pool  # noqa: E402
+from agent.models import ChangeScene, FusedSceneLLM, SceneLLM  # noqa: E402
+from agent.music_agent import MusicPrompt, system_prompt  # noqa: E402
+from agent.prompts import FUSED_SCENE_PROMPT, SCENE_PROMPT  # noqa: E402
+
+SCENE = {
+    "description": "The corridor stretches out in front of me, lit by a single "
+    "flickering lamp. Somewhere ahead water drips onto stone.",
+    "choices": [
+        {"text": "Open the iron door", "next_scene_short_desc": "Cell block"},
+        {"text": "Follow the dripping", "next_scene_short_desc": "Cistern"},
+    ],
+}
+CHANGE_SCENE = {
+    "change_scene": "change_completely",
+    "scene_description": "FPS view. A narrow stone corridor stretches ahead, lit "
+    "by one flickering oil lamp; wet walls glisten, an iron door on the left, "
+    "darkness beyond. Dark fantasy concept art, muted greens and amber light.",
+}
+MUSIC = {
+    "prompt": "Ominous Drone, Orchestral Score, Cello, Synth Pads, subdued "
+    "melody, slow tense build, echoing water drops"
+}
+ANSWERS = {
+    "SceneLLM": SCENE,
+    "ChangeScene": CHANGE_SCENE,
+    "MusicPrompt": MUSIC,
+    "FusedSceneLLM": {**SCENE, "change_scene": CHANGE_SCENE, "music": MUSIC["prompt"]},
+}
+LORE = dict(
+    lore="An underground city ruled by the guild of lamplighters. " * 4,
+    goal="Escape the undercity before the last lamp goes out.",
+    milestones="find_map,light_beacon,cross_river",
+    endings="escape,lost_in_dark",
+    history="; ".join(f"s{i}:Walk further into the dark" for i in range(10)),
+    last_choice="Walk further into the dark",
+)
+
+
+def tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class StandInGemini(BaseHTTPRequestHandler):
+    """Answers structured-output calls after a simulated generation time."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0
+    per_token = 0.0
+    lock = threading.Lock()
+    calls = 0
+    input_tokens = 0
+    output_tokens = 0
+
+    def do_POST(self) -> None:
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        request = json.loads(raw)
+        name = request["tools"][0]["functionDeclarations"][0]["name"]
+        args = ANSWERS[name]
+        prompt = json.dumps(request.get("contents")) + json.dumps(
+            request.get("systemInstruction", "")
+        )
+        out = tokens(json.dumps(args))
+        with self.lock:
+            type(self).calls += 1
+            type(self).input_tokens += tokens(prompt)
+            type(self).output_tokens += out
+        time.sleep(self.latency + self.per_token * out)
+        body = json.dumps(
+            {
+                "candidates": [
+                    {
+                        "content": {
+                            "role": "model",
+                            "parts": [{"functionCall": {"name": name, "args": args}}],
+                        },
+                        "finishReason": "STOP",
+                    }
+                ],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def multi_agent_step(pool: ThreadPoolExecutor) -> None:
+    scene = llm.structured_llm(SceneLLM).invoke(SCENE_PROMPT.format(**LORE))
+    music = pool.submit(
+        llm.structured_light_llm(MusicPrompt, temperature=0.1).invoke,
+        [SystemMessage(content=system_prompt), HumanMessage(content=scene.description)],
+    )
+    llm.structured_light_llm(ChangeScene, temperature=0.1).invoke(
+        [
+            SystemMessage(content=IMAGE_GENERATION_SYSTEM_PROMPT),
+            HumanMessage(content=scene.description),
+        ]
+    )
+    music.result()
+
+
+def fused_step(pool: ThreadPoolExecutor) -> None:
+    llm.structured_llm(FusedSceneLLM).invoke(FUSED_SCENE_PROMPT.format(**LORE))
+
+
+def measure(step, steps: int) -> tuple:
+    StandInGemini.calls = 0
+    StandInGemini.input_tokens = StandInGemini.output_tokens = 0
+    latencies = []
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        for _ in range(steps):
+            started = time.perf_counter()
+            step(pool)
+            latencies.append(time.perf_counter() - started)
+    return (
+        StandInGemini.calls / steps,
+        StandInGemini.input_tokens / steps,
+        StandInGemini.output_tokens / steps,
+        statistics.mean(latencies),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--per-token", type=float, default=0.004)
+    args = parser.parse_args()
+
+    StandInGemini.latency = args.latency
+    StandInGemini.per_token = args.per_token
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInGemini)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings.llm_transport = "rest"
+    settings.llm_api_endpoint = f"http://127.0.0.1:{server.server_port}"
+    set_key_pool(KeyPool(["key-0"], requests_per_minute=1e6, burst=args.steps * 3))
+
+    print(f"{'mode':<12} {'calls':>6} {'in tok':>8} {'out tok':>8} {'step ms':>9}")
+    for name, step in (("multi_agent", multi_agent_step), ("fused", fused_step)):
+        calls, tokens_in, tokens_out, latency = measure(step, args.steps)
+        print(
+            f"{name:<12} {calls:>6.1f} {tokens_in:>8.0f} {tokens_out:>8.0f} "
+            f"{latency * 1000:>9.1f}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Latency of the user state stores side by side.
+
+For each store, measures a full ``get``, a single-scene ``apply`` and a whole
+step (load, record a choice and a scene, commit) for one user whose state
+grows as the run goes on. Redis runs against fakeredis unless ``--url`` is
+given; SQLite uses a temporary database file.
+
+Run with ``python benchmarks/bench_state_backends.py [--url URL] [--iterations N]``.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+import fakeredis
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from agent.memory_state import MemoryStateBackend  # noqa: E402
+from agent.models import Scene, SceneChoice, UserChoice  # noqa: E402
+from agent.redis_state import UserRepository  # noqa: E402
+from agent.sqlite_state import SQLiteStateBackend  # noqa: E402
+from agent.state_context import StateChanges, StepState, activate, deactivate  # noqa: E402
+
+
+def make_scene() -> Scene:
+    return Scene(
+        scene_id=str(uuid.uuid4()),
+        description="The corridor stretches out in front of me. " * 3,
+        choices=[
+            SceneChoice(text="Open the door", next_scene_short_desc="Room"),
+            SceneChoice(text="Turn back", next_scene_short_desc="Hall"),
+        ],
+    )
+
+
+async def step(repo, user: str, i: int) -> None:
+    step_state = StepState(user, repo)
+    token = activate(step_state)
+    try:
+        state = await step_state.load()
+        scene = make_scene()
+        await step_state.record(
+            StateChanges(
+                fields={"current_scene_id": scene.scene_id},
+                scenes={scene.scene_id: scene},
+                choices=[
+                    UserChoice(
+                        scene_id=state.current_scene_id or "start",
+                        choice_text=f"choice {i}",
+                    )
+                ],
+            )
+        )
+        await step_state.commit()
+    finally:
+        deactivate(token)
+
+
+async def measure(repo, iterations: int) -> dict:
+    user = f"bench-{uuid.uuid4()}"
+    timings = {"get": [], "apply": [], "step": []}
+    try:
+        for i in range(iterations):
+            started = time.perf_counter()
+            await repo.get(user)
+            timings["get"].append(time.perf_counter() - started)
+
+            scene = make_scene()
+            started = time.perf_counter()
+            await repo.apply(user, StateChanges(scenes={scene.scene_id: scene}))
+            timings["apply"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await step(repo, user, i)
+            timings["step"].append(time.perf_counter() - started)
+    finally:
+        await repo.reset(user)
+    return timings
+
+
+def p95(values: list) -> float:
+    return statistics.quantiles(values, n=20)[-1]
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="Redis URL; fakeredis when omitted")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    redis_repo = UserRepository(args.url)
+    if not args.url:
+        redis_repo.redis = fakeredis.FakeAsyncRedis()
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_repo = SQLiteStateBackend(os.path.join(tmp, "state.db"))
+        backends = {
+            "redis": redis_repo,
+            "memory": MemoryStateBackend(),
+            "sqlite": sqlite_repo,
+        }
+        print(f"{'backend':<8} {'op':<6} {'mean ms':>8} {'p95 ms':>8}")
+        for name, repo in backends.items():
+            timings = await measure(repo, args.iterations)
+            for op, values in timings.items():
+                print(
+                    f"{name:<8} {op:<6} {statistics.mean(values) * 1000:>8.3f} "
+                    f"{p95(values) * 1000:>8.3f}"
+                )
+        sqlite_repo.close()
+    await redis_repo.redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
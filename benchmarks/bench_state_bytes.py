@@ -0,0 +1,190 @@
+"""Bytes moved to and from Redis per "choose" step as a session grows.
+
+Compares the original whole-blob layout, where every tool reads and rewrites
+the full msgpack-encoded ``UserState``, with the per-field layout of
+``agent.redis_state.UserRepository``.
+
+Run with ``python benchmarks/bench_state_bytes.py``.
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import fakeredis
+import msgpack
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from agent.models import (  # noqa: E402
+    Ending,
+    Milestone,
+    Scene,
+    SceneChoice,
+    StoryFrame,
+    UserChoice,
+    UserState,
+)
+from agent.redis_state import UserRepository  # noqa: E402
+
+SESSION_LENGTHS = (1, 10, 50, 100, 250)
+
+
+def _size(value) -> int:
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size(k) + _size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    return 0
+
+
+class CountingRedis:
+    """Proxy that tallies payload bytes sent to and received from Redis."""
+
+    def __init__(self, client) -> None:
+        self._client = client
+        self.sent = 0
+        self.received = 0
+
+    def pipeline(self, *args, **kwargs):
+        """Pipeline whose queued and immediate commands are counted too."""
+        pipe = self._client.pipeline(*args, **kwargs)
+        execute_command, execute = pipe.execute_command, pipe.execute
+
+        async def received(result):
+            result = await result
+            self.received += _size(result)
+            return result
+
+        def counted_command(*command, **options):
+            self.sent += _size(command)
+            result = execute_command(*command, **options)
+            # Queued commands return the pipeline; watched ones run at once.
+            return result if result is pipe else received(result)
+
+        async def counted_execute(*a, **kw):
+            return await received(execute(*a, **kw))
+
+        pipe.execute_command = counted_command
+        pipe.execute = counted_execute
+        return pipe
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        async def wrapper(*args, **kwargs):
+            self.sent += _size(args) + _size(kwargs)
+            result = await attr(*args, **kwargs)
+            self.received += _size(result)
+            return result
+
+        return wrapper
+
+
+def _scene(i: int) -> Scene:
+    return Scene(
+        scene_id=f"scene-{i:036d}",
+        description="The rain hammers the neon street as a stranger waves. " * 2,
+        choices=[
+            SceneChoice(text="Follow the stranger", next_scene_short_desc="Alley"),
+            SceneChoice(text="Head back inside", next_scene_short_desc="Bar"),
+        ],
+        image=f"generated/images/gemini_{i}.png",
+    )
+
+
+def make_state(n: int) -> UserState:
+    return UserState(
+        story_frame=StoryFrame(
+            lore="A city that never sleeps. " * 10,
+            goal="Find the missing engineer",
+            milestones=[Milestone(id=f"m{i}", description="clue") for i in range(3)],
+            endings=[
+                Ending(id="good", type="good", condition="found"),
+                Ending(id="bad", type="bad", condition="lost"),
+            ],
+            setting="cyberpunk",
+            character={"name": "Marcus"},
+            genre="noir",
+        ),
+        current_scene_id=f"scene-{n - 1:036d}",
+        scenes={s.scene_id: s for s in map(_scene, range(n))},
+        user_choices=[
+            UserChoice(scene_id=f"scene-{i:036d}", choice_text="Follow the stranger")
+            for i in range(n - 1)
+        ],
+    )
+
+
+async def blob_step(client: CountingRedis, state: UserState) -> None:
+    """One step as performed before the per-field layout."""
+    key = "llmgamehub:blob"
+
+    async def get() -> UserState:
+        data = await client.hget(key, "data")
+        return UserState.parse_obj(msgpack.unpackb(data, raw=False))
+
+    async def put(s: UserState) -> None:
+        await client.hset(key, mapping={"data": msgpack.packb(json.loads(s.json()))})
+
+    await put(state)
+    client.sent = client.received = 0
+    s = await get()  # node_player_step
+    s = await get()  # update_state_with_choice
+    s.user_choices.append(UserChoice(scene_id=s.current_scene_id, choice_text="Go"))
+    await put(s)
+    s = await get()  # check_ending
+    s = await get()  # generate_scene
+    scene = _scene(len(s.scenes))
+    s.scenes[scene.scene_id] = scene
+    s.current_scene_id = scene.scene_id
+    await put(s)
+    s = await get()  # generate_scene_image
+    s.scenes[scene.scene_id].image = "new.png"
+    await put(s)
+    await get()  # runner.process_step
+
+
+async def field_step(client: CountingRedis, state: UserState) -> None:
+    """The same step using the partial read/write API."""
+    repo = UserRepository()
+    repo.redis = client
+    user = "fields"
+    await repo.set(user, state)
+    client.sent = client.received = 0
+    current = await repo.get_current_scene(user)
+    await repo.append_user_choice(
+        user, UserChoice(scene_id=current.scene_id, choice_text="Go")
+    )
+    await repo.get_story_frame(user)  # check_ending
+    await repo.get_user_choices(user)
+    await repo.get_story_frame(user)  # generate_scene
+    await repo.get_user_choices(user)
+    scene = _scene(len(state.scenes))
+    await repo.add_scene(user, scene)
+    await repo.update_scene_image(user, scene.scene_id, "new.png")
+    await repo.get_current_scene(user)  # runner.process_step
+
+
+async def main() -> None:
+    print(f"{'scenes':>7} {'blob sent':>10} {'blob recv':>10} "
+          f"{'field sent':>11} {'field recv':>11}")
+    for n in SESSION_LENGTHS:
+        state = make_state(n)
+        blob = CountingRedis(fakeredis.FakeAsyncRedis())
+        await blob_step(blob, state)
+        fields = CountingRedis(fakeredis.FakeAsyncRedis())
+        await field_step(fields, state)
+        print(f"{n:>7} {blob.sent:>10} {blob.received:>10} "
+              f"{fields.sent:>11} {fields.received:>11}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""Encode/decode time and payload size of ``agent.state_codec``.
+
+Compares the codec with the previous ``msgpack.packb(json.loads(state.json()))``
+/ ``UserState.parse_obj`` round trip for states with 10, 100 and 1000 scenes.
+
+Run with ``python benchmarks/bench_state_codec.py``.
+"""
+
+import json
+import os
+import sys
+import timeit
+import warnings
+
+import msgpack
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from agent.models import UserState  # noqa: E402
+from agent.state_codec import decode_state, encode_state  # noqa: E402
+from bench_state_bytes import make_state  # noqa: E402
+
+SCENE_COUNTS = (10, 100, 1000)
+
+
+def json_encode(state: UserState) -> bytes:
+    return msgpack.packb(json.loads(state.json()))
+
+
+def json_decode(data: bytes) -> UserState:
+    return UserState.parse_obj(msgpack.unpackb(data, raw=False))
+
+
+def _best_ms(fn, arg, number: int) -> float:
+    return min(timeit.repeat(lambda: fn(arg), number=number, repeat=5)) / number * 1e3
+
+
+def main() -> None:
+    warnings.simplefilter("ignore", DeprecationWarning)
+    print(f"{'scenes':>6} {'path':>6} {'bytes':>9} {'encode ms':>10} {'decode ms':>10}")
+    for n in SCENE_COUNTS:
+        state = make_state(n)
+        number = max(1, 2000 // n)
+        for name, enc, dec in (
+            ("json", json_encode, json_decode),
+            ("codec", encode_state, decode_state),
+        ):
+            data = enc(state)
+            assert dec(data) == state
+            print(
+                f"{n:>6} {name:>6} {len(data):>9} "
+                f"{_best_ms(enc, state, number):>10.3f} "
+                f"{_best_ms(dec, data, number):>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Throughput of ``UserRepository`` get/set under concurrent simulated users.
+
+Each user repeatedly loads its state and commits one step worth of changes
+(a recorded choice plus a new scene). Runs against fakeredis by default; pass
+``--url redis://localhost`` to measure a real server with the pool settings
+from ``config.AppSettings``.
+
+Run with ``python benchmarks/bench_state_throughput.py [--url URL]``.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+import fakeredis
+import redis.asyncio as redis
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEYS", "bench")
+
+from config import settings  # noqa: E402
+from agent.models import Scene, SceneChoice, UserChoice  # noqa: E402
+from agent.redis_state import UserRepository  # noqa: E402
+from agent.state_context import StateChanges  # noqa: E402
+
+USER_COUNTS = (1, 10, 50, 200)
+
+
+async def simulate_user(repo: UserRepository, steps: int) -> None:
+    user = f"bench-{uuid.uuid4()}"
+    try:
+        for i in range(steps):
+            state = await repo.get(user)
+            scene = Scene(
+                scene_id=str(uuid.uuid4()),
+                description="The corridor stretches out in front of me. " * 3,
+                choices=[
+                    SceneChoice(text="Open the door", next_scene_short_desc="Room"),
+                    SceneChoice(text="Turn back", next_scene_short_desc="Hall"),
+                ],
+            )
+            await repo.apply(
+                user,
+                StateChanges(
+                    fields={"current_scene_id": scene.scene_id},
+                    scenes={scene.scene_id: scene},
+                    choices=[
+                        UserChoice(
+                            scene_id=state.current_scene_id or "start",
+                            choice_text=f"choice {i}",
+                        )
+                    ],
+                ),
+            )
+    finally:
+        await repo.reset(user)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="Redis URL; fakeredis when omitted")
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    repo = UserRepository(args.url)
+    if not args.url:
+        repo.redis = fakeredis.FakeAsyncRedis(
+            connection_pool_class=redis.BlockingConnectionPool,
+            max_connections=settings.redis_max_connections,
+        )
+
+    print(f"{'users':>6} {'steps/s':>9} {'ops/s':>9} {'round trips':>12}")
+    for users in USER_COUNTS:
+        before = repo.stats.round_trips
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate_user(repo, args.steps) for _ in range(users)))
+        elapsed = time.perf_counter() - started
+        steps = users * args.steps
+        print(
+            f"{users:>6} {steps / elapsed:>9.0f} {2 * steps / elapsed:>9.0f} "
+            f"{repo.stats.round_trips - before:>12}"
+        )
+    await repo.redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+"""References from user states to images in the asset store.
+
+A speculative branch may generate the image of a scene the player never
+picks. Its references are therefore only kept in the branch's step state,
+and :meth:`agent.speculation.Speculator.claim` adds them to the asset store
+when the branch is used. The image of a discarded branch stays unreferenced
+and is removed by the asset store's garbage collection.
+"""
+
+from __future__ import annotations
+
+from agent.models import UserState
+from agent.redis_state import update_user_state
+from agent.speculation import speculating
+from agent.state_context import StateChanges
+from images.asset_store import digest_of, get_asset_store
+
+
+async def record_asset(user_hash: str, scene_id: str, image_path: str) -> None:
+    """Reference the image of a scene in the asset store and in the user state."""
+    if speculating():
+        digest = digest_of(image_path)
+    else:
+        digest = await get_asset_store().add_ref(user_hash, scene_id, image_path)
+    if digest is None:
+        return
+
+    def mutate(state: UserState):
+        if state.assets.get(scene_id) == digest:
+            return None
+        return StateChanges(fields={"assets": {**state.assets, scene_id: digest}})
+
+    await update_user_state(user_hash, mutate)
+
@@ -0,0 +1,115 @@
+"""Milestone tracking and a local gate in front of the LLM ending check.
+
+Every generated scene reports the story milestones it reached, and
+:func:`record_milestones` adds them to ``UserState.milestones_achieved``.
+:func:`should_check_ending` uses that progress to decide whether the heavy
+ending check is worth a call:
+
+* no check before ``ending_check_min_steps`` choices;
+* every step once ``ending_check_min_coverage`` of the milestones is reached;
+* otherwise every ``ending_check_every`` steps. Endings that need no
+  milestones, such as a sudden death, are then noticed a few steps late at
+  worst.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from config import settings
+from agent.models import UserState
+from agent.redis_state import get_user_state, update_user_state
+from agent.state_context import StateChanges
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EndingCheckStats:
+    """How many ending checks ran or were skipped, and what they cost."""
+
+    checks: int = 0
+    skipped: int = 0
+    check_seconds: float = 0.0
+
+    @property
+    def skip_share(self) -> float:
+        total = self.checks + self.skipped
+        return self.skipped / total if total else 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        """Estimated time saved, at the mean duration of the checks that ran."""
+        if not self.checks:
+            return 0.0
+        return self.skipped * self.check_seconds / self.checks
+
+
+_stats = EndingCheckStats()
+
+
+def get_ending_check_stats() -> EndingCheckStats:
+    return _stats
+
+
+async def record_milestones(user_hash: str, milestone_ids: Iterable[str]) -> None:
+    """Mark milestones of the story frame as achieved; unknown ids are ignored."""
+    reached = set(milestone_ids)
+    if not reached:
+        return
+
+    def mutate(state: UserState) -> Optional[StateChanges]:
+        known = {m.id for m in state.story_frame.milestones} if state.story_frame else set()
+        new = (reached & known) - state.milestones_achieved
+        if not new:
+            return None
+        logger.info("[Ending] User %s reached milestones %s", user_hash, sorted(new))
+        return StateChanges(
+            fields={"milestones_achieved": state.milestones_achieved | new}
+        )
+
+    await update_user_state(user_hash, mutate)
+
+
+def should_check_ending(state: UserState) -> Tuple[bool, str]:
+    """Decide whether the LLM ending check should run; returns the reason."""
+    steps = state.choice_count
+    if steps < settings.ending_check_min_steps:
+        return False, f"only {steps} steps"
+    milestones = state.story_frame.milestones if state.story_frame else []
+    if milestones:
+        coverage = len(state.milestones_achieved) / len(milestones)
+    else:
+        coverage = 1.0
+    if coverage >= settings.ending_check_min_coverage:
+        return True, f"{coverage:.0%} of milestones reached"
+    if steps % max(settings.ending_check_every, 1) == 0:
+        return True, f"periodic check at step {steps}"
+    return False, f"{coverage:.0%} of milestones reached"
+
+
+async def check_ending_if_plausible(
+    user_hash: str, check: Callable[[], Awaitable[Dict]]
+) -> Dict:
+    """Run ``check`` only when :func:`should_check_ending` allows it."""
+    run, reason = should_check_ending(await get_user_state(user_hash))
+    if not run:
+        _stats.skipped += 1
+        logger.info(
+            "[Ending] Skipped check for user %s (%s); skipped %.0f%% so far, "
+            "saved ~%.1fs",
+            user_hash,
+            reason,
+            _stats.skip_share * 100,
+            _stats.saved_seconds,
+        )
+        return {"ending_reached": False, "skipped": True}
+    started = time.monotonic()
+    try:
+        return await check()
+    finally:
+        _stats.checks += 1
+        _stats.check_seconds += time.monotonic() - started
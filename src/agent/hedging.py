@@ -0,0 +1,142 @@
+"""Deadlines and hedged requests for outbound model calls.
+
+:meth:`Hedger.call` runs a call through the key pool within a deadline. If
+it is still running after the p95 latency observed for its kind of call,
+a hedged duplicate is sent, preferably on a different API key. The first
+successful response wins and the other call is cancelled.
+
+Hedges are paid for from a budget that grows by ``hedge_budget`` per call,
+up to ``hedge_burst``. With the default of 0.1, at most about one call in
+ten is duplicated, even while the service is slow for everyone.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, TypeVar
+
+from config import settings
+from agent.key_pool import get_key_pool
+from agent.model_router import p95
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class HedgeStats:
+    """Calls of one kind, how many were hedged and how that went."""
+
+    calls: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    over_budget: int = 0
+    deadline_exceeded: int = 0
+
+
+class Hedger:
+    """Applies deadlines and hedging to calls made through the key pool."""
+
+    def __init__(
+        self,
+        budget: Optional[float] = None,
+        burst: Optional[float] = None,
+        min_samples: Optional[int] = None,
+    ) -> None:
+        self.budget = settings.hedge_budget if budget is None else budget
+        self.burst = settings.hedge_burst if burst is None else burst
+        self.min_samples = (
+            settings.hedge_min_samples if min_samples is None else min_samples
+        )
+        self._credit = self.burst
+        self._recent: Dict[str, Deque[float]] = {}
+        self.stats: Dict[str, HedgeStats] = {}
+
+    def observe(self, name: str, seconds: float) -> None:
+        recent = self._recent.get(name)
+        if recent is None:
+            recent = self._recent[name] = deque(maxlen=settings.hedge_window)
+        recent.append(seconds)
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """p95 latency of ``name`` calls, once enough of them were seen."""
+        recent = self._recent.get(name)
+        if recent is None or len(recent) < self.min_samples:
+            return None
+        return p95(recent)
+
+    async def call(
+        self,
+        name: str,
+        fn: Callable[[str], Awaitable[T]],
+        deadline: Optional[float] = None,
+    ) -> T:
+        """Await ``fn(key)`` within ``deadline`` seconds, hedging slow calls.
+
+        Raises :class:`TimeoutError` when the deadline passes.
+        """
+        stats = self.stats.setdefault(name, HedgeStats())
+        stats.calls += 1
+        self._credit = min(self.burst, self._credit + self.budget)
+        pool = get_key_pool()
+        used: Set[str] = set()
+        started = time.monotonic()
+        primary = asyncio.ensure_future(pool.call(fn, used))
+        tasks = {primary}
+        try:
+            async with asyncio.timeout(deadline):
+                delay = self.hedge_delay(name)
+                if delay is not None:
+                    done, _ = await asyncio.wait(tasks, timeout=delay)
+                    if not done:
+                        if self._credit >= 1:
+                            self._credit -= 1
+                            stats.hedged += 1
+                            tasks.add(asyncio.ensure_future(pool.call(fn, used)))
+                        else:
+                            stats.over_budget += 1
+                pending = set(tasks)
+                while True:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.exception() is None:
+                            if task is not primary:
+                                stats.hedge_wins += 1
+                            self.observe(name, time.monotonic() - started)
+                            return task.result()
+                    if not pending:
+                        return primary.result()  # every attempt failed
+        except TimeoutError:
+            stats.deadline_exceeded += 1
+            logger.warning("[Hedge] %s call missed its %.0fs deadline", name, deadline)
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+_hedger: Optional[Hedger] = None
+
+
+def get_hedger() -> Hedger:
+    global _hedger
+    if _hedger is None:
+        _hedger = Hedger()
+    return _hedger
+
+
+def set_hedger(hedger: Optional[Hedger]) -> None:
+    """Replace the shared hedger; ``None`` recreates it from settings."""
+    global _hedger
+    _hedger = hedger
+
+
+def get_hedge_stats() -> Dict[str, HedgeStats]:
+    return get_hedger().stats
@@ -0,0 +1,141 @@
+"""Bounded story history for LLM prompts.
+
+Prompts quote only the last ``history_recent_choices`` player choices
+verbatim. Older choices are folded into ``UserState.history``, a running
+summary that the light model rewrites in the background once
+``history_summary_batch`` choices are waiting to be folded. Summarization
+runs after the step has been committed, off the critical path. Until it
+finishes, the waiting choices are quoted verbatim as well.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from config import settings
+from agent.models import HistorySummary, HistorySummaryLLM, UserChoice, UserState
+from agent.prompts import HISTORY_SUMMARY_PROMPT
+from agent.redis_state import get_user_state, update_user_state
+from agent.repair import structured_call
+from agent.state_context import StateChanges
+
+logger = logging.getLogger(__name__)
+
+Summarize = Callable[[str, List[UserChoice]], Awaitable[str]]
+
+_tasks: Dict[str, asyncio.Task] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a prompt, at about four characters per token."""
+    return (len(text) + 3) // 4
+
+
+def _format_choices(choices: List[UserChoice]) -> str:
+    return "; ".join(c.choice_text for c in choices)
+
+
+def format_history(state: UserState) -> str:
+    """Summary of older choices followed by the unsummarized ones."""
+    recent = _format_choices(state.choices_from(state.history.covered))
+    summary = state.history.summary
+    if not summary or not recent:
+        return summary or recent
+    return f"{summary} Then: {recent}"
+
+
+async def build_history(user_hash: str) -> str:
+    """Return the prompt history for ``user_hash``."""
+    return format_history(await get_user_state(user_hash))
+
+
+def _to_fold(state: UserState) -> List[UserChoice]:
+    """Choices due to be folded into the summary, if a batch is ready."""
+    end = state.choice_count - settings.history_recent_choices
+    if end - state.history.covered < settings.history_summary_batch:
+        return []
+    return state.choices_from(state.history.covered)[: end - state.history.covered]
+
+
+async def _summarize_with_llm(summary: str, choices: List[UserChoice]) -> str:
+    prompt = HISTORY_SUMMARY_PROMPT.format(
+        summary=summary or "The story has just begun.",
+        choices=_format_choices(choices),
+    )
+    resp = await structured_call(
+        "summarize_history",
+        "history_summary",
+        HistorySummaryLLM,
+        prompt,
+        temperature=0.1,
+    )
+    return resp.summary
+
+
+async def summarize_history(
+    user_hash: str, summarize: Summarize = _summarize_with_llm
+) -> bool:
+    """Fold a waiting batch of choices into the stored summary.
+
+    Returns whether the summary was updated. The update is dropped if
+    another writer has changed the summary in the meantime.
+    """
+    state = await get_user_state(user_hash)
+    choices = _to_fold(state)
+    if not choices:
+        return False
+    covered = state.history.covered
+    summary = await summarize(state.history.summary, choices)
+    updated = HistorySummary(summary=summary, covered=covered + len(choices))
+
+    stored = False
+
+    def mutate(latest: UserState) -> Optional[StateChanges]:
+        nonlocal stored
+        stored = latest.history.covered == covered
+        return StateChanges(fields={"history": updated}) if stored else None
+
+    await update_user_state(user_hash, mutate)
+    if not stored:
+        return False
+    logger.info(
+        "[History] Folded %d choices for user %s into a summary of ~%d tokens",
+        len(choices),
+        user_hash,
+        estimate_tokens(summary),
+    )
+    return True
+
+
+def schedule_summary(
+    user_hash: str, state: UserState, summarize: Summarize = _summarize_with_llm
+) -> Optional[asyncio.Task]:
+    """Start :func:`summarize_history` in the background if a batch is due.
+
+    ``state`` is the user's committed state. Call it after the step has been
+    committed: the task runs outside the step and reads and writes the store
+    directly. Returns the running task, or None when nothing is due.
+    """
+    task = _tasks.get(user_hash)
+    if task is not None and not task.done():
+        return task
+    if not _to_fold(state):
+        return None
+    task = asyncio.get_running_loop().create_task(
+        summarize_history(user_hash, summarize), context=contextvars.Context()
+    )
+    _tasks[user_hash] = task
+    task.add_done_callback(lambda t: _finished(user_hash, t))
+    return task
+
+
+def _finished(user_hash: str, task: asyncio.Task) -> None:
+    if _tasks.get(user_hash) is task:
+        del _tasks[user_hash]
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(
+            "[History] Summarizing failed for user %s: %r", user_hash, task.exception()
+        )
@@ -1,6 +1,12 @@
-from pydantic import BaseModel, Field
-from typing import Literal, Optional
-from agent.llm import create_light_llm
+import asyncio
+import json
+from typing import Dict, Optional
+from agent.repair import structured_call
+from agent.models import ChangeScene
+from agent.model_router import get_model_router
+from agent.prompt_cache import cache_key, get_prompt_cache
+from agent.scene_change import classify, get_scene_change_stats
+from config import settings
 from langchain_core.messages import SystemMessage, HumanMessage
 import logging
 
@@ -56,15 +62,20 @@ When generating the image prompt, ensure it's detailed and considers the followi
 "FPS view. Through the cockpit window of a futuristic hovercar, a sprawling neon-lit cyberpunk city stretches out under a stormy, rain-lashed sky. Rain streaks across the glass. The hum of the engine is palpable. Photorealistic, Blade Runner style. Cool blue and vibrant pink neon palette."
 """
 
+# Image prompt for a new location decided without the image agent. The
+# classifier only decides for English scenes, so the description can be
+# passed through.
+LOCAL_IMAGE_PROMPT = (
+    "FPS view, seen through the character's own eyes; no part of the "
+    "character's body is visible. {description}"
+)
 
-class ChangeScene(BaseModel):
-    change_scene: Literal["change_completely", "modify", "no_change"] = Field(
-        description="Whether the scene should be completely changed, just modified or not changed at all"
-    )
-    scene_description: Optional[str] = None
 
+def _has_image_prompt(change: ChangeScene):
+    if change.change_scene == "no_change" or change.scene_description:
+        return None
+    return ("scene_description", "an image prompt is needed to change the scene")
 
-image_prompt_generator_llm = create_light_llm(0.1).with_structured_output(ChangeScene)
 
 async def generate_image_prompt(scene_description: str, request_id: str) -> ChangeScene:
     """
@@ -72,11 +83,82 @@ async def generate_image_prompt(scene_description: str, request_id: str) -> Chan
     This prompt is intended for use with an AI image generation model.
     """
     logger.info(f"Generating image prompt for the current scene: {request_id}")
-    response = await image_prompt_generator_llm.ainvoke(
-        [
-            SystemMessage(content=IMAGE_GENERATION_SYSTEM_PROMPT),
-            HumanMessage(content=scene_description),
-        ]
+    model = get_model_router().route("image_prompt").model
+    response = await get_prompt_cache("image_prompt", ChangeScene).get_or_compute(
+        cache_key(model, IMAGE_GENERATION_SYSTEM_PROMPT, scene_description),
+        lambda: structured_call(
+            "generate_image_prompt",
+            "image_prompt",
+            ChangeScene,
+            [
+                SystemMessage(content=IMAGE_GENERATION_SYSTEM_PROMPT),
+                HumanMessage(content=scene_description),
+            ],
+            temperature=0.1,
+            check=_has_image_prompt,
+        ),
     )
     logger.info(f"Image prompt generated: {request_id}")
-    return response
+    # Callers may edit the answer, so they get their own copy of it.
+    return response.model_copy()
+
+
+def _record_decision(record: Dict) -> None:
+    with open(settings.scene_change_corpus_path, "a", encoding="utf-8") as corpus:
+        corpus.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+async def scene_image_prompt(
+    scene: Dict,
+    request_id: str,
+    previous_description: Optional[str] = None,
+    choice: Optional[str] = None,
+) -> ChangeScene:
+    """Return the image decision for a generated scene.
+
+    In fused mode the decision arrives with the scene and is taken out of
+    ``scene``; one that changes the image without a prompt is ignored.
+    Otherwise obvious cases are decided locally by
+    :func:`agent.scene_change.classify` and the rest go to the image agent.
+    """
+    change_scene = scene.pop("change_scene", None)
+    if change_scene is not None:
+        change = ChangeScene.model_validate(change_scene)
+        if _has_image_prompt(change) is None:
+            return change
+        logger.warning(f"Fused answer has no image prompt: {request_id}")
+    stats = get_scene_change_stats()
+    description = scene["description"]
+    if previous_description and settings.scene_change_classifier:
+        local = classify(previous_description, description, choice)
+        if settings.scene_change_corpus_path:
+            response = await generate_image_prompt(description, request_id)
+            await asyncio.to_thread(
+                _record_decision,
+                {
+                    "previous": previous_description,
+                    "choice": choice,
+                    "current": description,
+                    "decision": response.change_scene,
+                    "local": local.decision,
+                },
+            )
+            stats.llm += 1
+            return response
+        if local.decision == "no_change":
+            stats.no_change += 1
+            logger.info(f"Scene unchanged (similarity {local.similarity:.2f}): {request_id}")
+            return ChangeScene(change_scene="no_change")
+        if local.decision == "change_completely":
+            stats.change_completely += 1
+            logger.info(
+                f"New location {sorted(local.new_locations)} "
+                f"(similarity {local.similarity:.2f}): {request_id}"
+            )
+            return ChangeScene(
+                change_scene="change_completely",
+                scene_description=LOCAL_IMAGE_PROMPT.format(description=description),
+            )
+    stats.llm += 1
+    logger.info(f"Image agent needed, {stats.skip_rate:.0%} skipped so far: {request_id}")
+    return await generate_image_prompt(description, request_id)
@@ -0,0 +1,179 @@
+"""Scene images delivered after the scene text.
+
+Generating the picture is the slowest part of a step. With
+``deferred_scene_images`` the runner opens :func:`defer_images` around a
+step, and the graph hands its image work to :func:`deliver_image` instead of
+awaiting it. Once the step is committed, :func:`start_image_jobs` runs the
+collected jobs in the background. They write the image path to the user
+state as before. The UI shows the text and choices straight away, then
+calls :func:`wait_for_image` to swap the picture in.
+
+Speculative branches and callers outside a deferred step still await the
+image, so a prepared branch comes with its picture.
+
+:class:`DeliveryStats` tracks time to text and time to image separately,
+both measured from the start of the step.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import settings
+from agent.redis_state import get_state_backend
+from agent.speculation import speculating
+
+logger = logging.getLogger(__name__)
+
+ImageJob = Tuple[str, Callable[[], Awaitable[object]]]
+
+
+@dataclass
+class DeliveryStats:
+    """Time from the start of a step to its text and to its image."""
+
+    steps: int = 0
+    images: int = 0
+    text_seconds: float = 0.0
+    image_seconds: float = 0.0
+
+    @property
+    def mean_time_to_text(self) -> float:
+        return self.text_seconds / self.steps if self.steps else 0.0
+
+    @property
+    def mean_time_to_image(self) -> float:
+        return self.image_seconds / self.images if self.images else 0.0
+
+
+_stats = DeliveryStats()
+_deferred: ContextVar[Optional[List[ImageJob]]] = ContextVar(
+    "deferred_images", default=None
+)
+_jobs: Dict[Tuple[str, str], asyncio.Task] = {}
+
+
+def get_delivery_stats() -> DeliveryStats:
+    return _stats
+
+
+@contextmanager
+def defer_images() -> Iterator[List[ImageJob]]:
+    """Collect the image jobs of the steps run inside the block."""
+    jobs: List[ImageJob] = []
+    token = _deferred.set(jobs)
+    try:
+        yield jobs
+    finally:
+        _deferred.reset(token)
+
+
+async def deliver_image(
+    user_hash: str, scene_id: str, make: Callable[[], Awaitable[object]]
+) -> None:
+    """Run ``make`` now, or leave it for after the step when images are deferred."""
+    jobs = _deferred.get()
+    if jobs is None or speculating():
+        await make()
+        return
+    jobs.append((scene_id, make))
+
+
+def record_text(started: float) -> float:
+    """Count a step whose text is ready; returns its time to text."""
+    elapsed = time.monotonic() - started
+    _stats.steps += 1
+    _stats.text_seconds += elapsed
+    return elapsed
+
+
+def start_image_jobs(
+    user_hash: str, jobs: List[ImageJob], started: float
+) -> List[asyncio.Task]:
+    """Start the jobs collected for a committed step of ``user_hash``."""
+    tasks = []
+    for scene_id, make in jobs:
+
+        async def run(make=make, scene_id=scene_id) -> None:
+            await make()
+            elapsed = time.monotonic() - started
+            _stats.images += 1
+            _stats.image_seconds += elapsed
+            logger.info(
+                "[Images] Image of scene %s for user %s ready %.2fs after the step began",
+                scene_id,
+                user_hash,
+                elapsed,
+            )
+
+        # A fresh context: the job writes straight to the store, not to a step.
+        task = asyncio.get_running_loop().create_task(
+            run(), context=contextvars.Context()
+        )
+        key = (user_hash, scene_id)
+        _jobs[key] = task
+        task.add_done_callback(lambda t, key=key: _finished(key, t))
+        tasks.append(task)
+    return tasks
+
+
+def cancel_image_jobs(user_hash: str) -> None:
+    """Cancel the image jobs still running for ``user_hash``."""
+    for (user, _), task in list(_jobs.items()):
+        if user == user_hash:
+            task.cancel()
+
+
+def _finished(key: Tuple[str, str], task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("[Images] Image job %s failed: %s", key, task.exception())
+
+    def forget() -> None:
+        if _jobs.get(key) is task:
+            del _jobs[key]
+
+    # Kept for a while so a late waiter learns that no image is coming.
+    asyncio.get_running_loop().call_later(settings.image_deadline_seconds, forget)
+
+
+async def _stored_image(user_hash: str, scene_id: str) -> Optional[str]:
+    scene = await get_state_backend().get_scene(user_hash, scene_id)
+    return scene.image if scene else None
+
+
+async def pending_image(user_hash: str, scene_id: str) -> Optional[str]:
+    """Image of a scene, waiting for its job if one is still running."""
+    task = _jobs.get((user_hash, scene_id))
+    if task is not None and not task.done():
+        await asyncio.wait({task}, timeout=settings.image_deadline_seconds)
+    return await _stored_image(user_hash, scene_id)
+
+
+async def wait_for_image(
+    user_hash: str, scene_id: str, timeout: Optional[float] = None
+) -> Optional[str]:
+    """Wait until the image of a scene is stored and return its path.
+
+    Waits for a job of this process if there is one, and otherwise polls
+    the store every ``image_poll_interval`` seconds. Returns None when no
+    image arrived within ``timeout`` seconds.
+    """
+    timeout = settings.image_deadline_seconds if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    task = _jobs.get((user_hash, scene_id))
+    if task is not None:
+        if not task.done():
+            await asyncio.wait({task}, timeout=timeout)
+        return await _stored_image(user_hash, scene_id)
+    while True:
+        image = await _stored_image(user_hash, scene_id)
+        if image or time.monotonic() >= deadline:
+            return image
+        await asyncio.sleep(settings.image_poll_interval)
@@ -0,0 +1,343 @@
+"""Pool of Gemini API keys shared by the LLM, image and music clients.
+
+Keys come from both ``gemini_api_key`` and ``gemini_api_keys`` (comma
+separated). Each call leases the healthiest key: the one with the fewest
+requests in flight and the fewest recent errors that still has quota left in
+its token bucket. A key that answers with HTTP 429 is cooled down with
+jittered exponential backoff, and the call is retried on another key.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, replace
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from google import genai
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class KeyPoolExhausted(RuntimeError):
+    """Raised when no key becomes available within the acquire timeout."""
+
+
+@dataclass
+class KeyStats:
+    """Counters and current health of one key."""
+
+    requests: int = 0
+    successes: int = 0
+    throttled: int = 0
+    errors: int = 0
+    in_flight: int = 0
+    tokens: float = 0.0
+    cooldown_remaining: float = 0.0
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    """Return the HTTP status carried by a Google client error, if any."""
+    code = getattr(exc, "code", None)
+    if code is None:
+        code = getattr(exc, "status_code", None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(exc: BaseException) -> bool:
+    return status_code(exc) == 429
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Throttling and server errors are worth retrying on another key."""
+    code = status_code(exc)
+    return code is not None and (code == 429 or code >= 500)
+
+
+class _Key:
+    def __init__(self, key: str, tokens: float) -> None:
+        self.key = key
+        self.tokens = tokens
+        self.in_flight = 0
+        self.last_used = 0.0
+        self.refilled = time.monotonic()
+        self.error_score = 0.0
+        self.error_at = self.refilled
+        self.cooldown_until = 0.0
+        self.backoff = 0
+        self.stats = KeyStats()
+
+
+class KeyPool:
+    """Leases API keys by health and per-key quota.
+
+    All bookkeeping happens under a thread lock, so the pool can be used from
+    the event loop and from worker threads alike.
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        requests_per_minute: float = 60.0,
+        burst: int = 10,
+        cooldown: float = 2.0,
+        max_cooldown: float = 120.0,
+        max_attempts: int = 3,
+        acquire_timeout: float = 30.0,
+        error_half_life: float = 60.0,
+    ) -> None:
+        unique = list(dict.fromkeys(k for k in keys if k))
+        if not unique:
+            msg = "Google API keys are not configured or invalid"
+            logger.error(msg)
+            raise ValueError(msg)
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_attempts = max_attempts
+        self.acquire_timeout = acquire_timeout
+        self.error_half_life = error_half_life
+        self._keys = [_Key(k, burst) for k in unique]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "KeyPool":
+        keys: List[str] = []
+        for secret in (settings.gemini_api_key, settings.gemini_api_keys):
+            keys.extend(k.strip() for k in secret.get_secret_value().split(","))
+        return cls(
+            keys,
+            requests_per_minute=settings.key_requests_per_minute,
+            burst=settings.key_burst,
+            cooldown=settings.key_cooldown,
+            max_cooldown=settings.key_max_cooldown,
+            max_attempts=settings.key_max_attempts,
+            acquire_timeout=settings.key_acquire_timeout,
+        )
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _refresh(self, k: _Key, now: float) -> None:
+        k.tokens = min(self.burst, k.tokens + (now - k.refilled) * self.rate)
+        k.refilled = now
+        k.error_score *= 0.5 ** ((now - k.error_at) / self.error_half_life)
+        k.error_at = now
+
+    def _load(self, k: _Key) -> Tuple[float, float, float]:
+        # Ties go to the key with more quota left, then the least recently used.
+        return (k.in_flight + 2 * k.error_score, -k.tokens, k.last_used)
+
+    def _try_acquire(
+        self, avoid: Collection[str] = ()
+    ) -> Tuple[Optional[_Key], float]:
+        """Take a token from the healthiest usable key.
+
+        Keys in ``avoid`` are only used when no other key is usable.
+        Returns the key, or None and how long to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            usable = []
+            wait = math.inf
+            for k in self._keys:
+                self._refresh(k, now)
+                if k.cooldown_until > now:
+                    wait = min(wait, k.cooldown_until - now)
+                elif k.tokens < 1:
+                    wait = min(wait, (1 - k.tokens) / self.rate)
+                else:
+                    usable.append(k)
+            if not usable:
+                return None, wait
+            usable = [k for k in usable if k.key not in avoid] or usable
+            best = min(usable, key=self._load)
+            best.tokens -= 1
+            best.in_flight += 1
+            best.last_used = now
+            best.stats.requests += 1
+            return best, 0.0
+
+    def _release(self, k: _Key, exc: Optional[BaseException] = None) -> None:
+        with self._lock:
+            k.in_flight -= 1
+            if exc is None:
+                k.stats.successes += 1
+                k.backoff = 0
+                return
+            if not isinstance(exc, Exception):
+                return  # cancelled, says nothing about the key
+            self._refresh(k, time.monotonic())
+            k.error_score += 1
+            if not is_throttled(exc):
+                k.stats.errors += 1
+                return
+            k.stats.throttled += 1
+            delay = min(self.max_cooldown, self.cooldown * 2**k.backoff)
+            delay *= random.uniform(0.5, 1.0)
+            k.backoff += 1
+            k.cooldown_until = time.monotonic() + delay
+            logger.warning(
+                "API key ...%s throttled, cooling down for %.1fs", k.key[-4:], delay
+            )
+
+    def pick(self) -> str:
+        """Return the healthiest key without leasing it."""
+        with self._lock:
+            now = time.monotonic()
+            for k in self._keys:
+                self._refresh(k, now)
+            ready = [k for k in self._keys if k.cooldown_until <= now] or self._keys
+            return min(ready, key=self._load).key
+
+    async def acquire(self, avoid: Collection[str] = ()) -> _Key:
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            k, wait = self._try_acquire(avoid)
+            if k is not None:
+                return k
+            if time.monotonic() + wait > deadline:
+                raise KeyPoolExhausted("No API key available")
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self) -> _Key:
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            k, wait = self._try_acquire()
+            if k is not None:
+                return k
+            if time.monotonic() + wait > deadline:
+                raise KeyPoolExhausted("No API key available")
+            time.sleep(wait)
+
+    @asynccontextmanager
+    async def lease(self, avoid: Collection[str] = ()) -> AsyncIterator[str]:
+        """Lease a key for the duration of the block, avoiding ``avoid``."""
+        k = await self.acquire(avoid)
+        try:
+            yield k.key
+        except BaseException as exc:
+            self._release(k, exc)
+            raise
+        self._release(k)
+
+    @contextmanager
+    def lease_sync(self) -> Iterator[str]:
+        k = self.acquire_sync()
+        try:
+            yield k.key
+        except BaseException as exc:
+            self._release(k, exc)
+            raise
+        self._release(k)
+
+    async def call(
+        self, fn: Callable[[str], Awaitable[T]], used: Optional[Set[str]] = None
+    ) -> T:
+        """Await ``fn(key)``, retrying on another key when throttled.
+
+        ``used`` collects the keys leased for one logical request, such as
+        a call and its hedge; keys already in it are avoided.
+        """
+        used = set() if used is None else used
+        attempt = 1
+        while True:
+            try:
+                async with self.lease(used) as key:
+                    used.add(key)
+                    return await fn(key)
+            except Exception as exc:
+                if attempt >= self.max_attempts or not is_retryable(exc):
+                    raise
+                attempt += 1
+                logger.info("Retrying on another key after: %s", exc)
+
+    def call_sync(self, fn: Callable[[str], T]) -> T:
+        attempt = 1
+        while True:
+            try:
+                with self.lease_sync() as key:
+                    return fn(key)
+            except Exception as exc:
+                if attempt >= self.max_attempts or not is_retryable(exc):
+                    raise
+                attempt += 1
+                logger.info("Retrying on another key after: %s", exc)
+
+    def stats(self) -> Dict[str, KeyStats]:
+        """Return a snapshot per key, labelled by the key's last characters."""
+        with self._lock:
+            now = time.monotonic()
+            snapshot = {}
+            for i, k in enumerate(self._keys):
+                self._refresh(k, now)
+                snapshot[f"{i}:...{k.key[-4:]}"] = replace(
+                    k.stats,
+                    in_flight=k.in_flight,
+                    tokens=round(k.tokens, 2),
+                    cooldown_remaining=round(max(0.0, k.cooldown_until - now), 2),
+                )
+            return snapshot
+
+
+_pool: Optional[KeyPool] = None
+_genai_clients: Dict[Tuple, genai.Client] = {}
+
+
+def get_key_pool() -> KeyPool:
+    global _pool
+    if _pool is None:
+        _pool = KeyPool.from_settings()
+    return _pool
+
+
+def set_key_pool(pool: Optional[KeyPool]) -> None:
+    """Replace the shared pool; None rebuilds it from settings on next use."""
+    global _pool
+    _pool = pool
+
+
+def get_key_pool_stats() -> Dict[str, KeyStats]:
+    return get_key_pool().stats()
+
+
+def genai_client(key: str, api_version: Optional[str] = None) -> genai.Client:
+    """Return a cached ``google-genai`` client for ``key``."""
+    cache_key = (key, api_version, settings.llm_api_endpoint)
+    client = _genai_clients.get(cache_key)
+    if client is None:
+        http_options = {}
+        if api_version:
+            http_options["api_version"] = api_version
+        if settings.llm_api_endpoint:
+            http_options["base_url"] = settings.llm_api_endpoint
+        client = _genai_clients[cache_key] = genai.Client(
+            api_key=key, http_options=http_options or None
+        )
+    return client
@@ -1,57 +1,354 @@
-"""Utility functions for working with the language model."""
+"""Utility functions for working with the language model.
 
+Clients are cached per API key and generation parameters, and structured
+output runnables per client and schema. Building a client opens a new
+connection and ``with_structured_output`` re-derives the tool schema, so
+both are done once and reused.
+
+:func:`structured_llm` hands out one :class:`PooledRunnable` per model,
+schema and generation parameters. Every call through it leases a key from
+the shared :mod:`agent.key_pool` and runs the cached runnable for that key.
+:func:`task_llm` adds per-task model routing on top (see
+:mod:`agent.model_router`).
+"""
+
+import asyncio
+import contextvars
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple, Type
+
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.runnables import Runnable, RunnableConfig
 from langchain_google_genai import ChatGoogleGenerativeAI
+from pydantic import BaseModel
 
 from config import settings
+from agent.hedging import get_hedger
+from agent.key_pool import get_key_pool, is_retryable
+from agent.model_router import Route, get_model_router
 
 logger = logging.getLogger(__name__)
 
-_API_KEYS: list[str] = []
-_current_key_idx = 0
 MODEL_NAME = "gemini-2.5-flash-preview-05-20"
+LIGHT_MODEL_NAME = "gemini-2.0-flash"
+THINKING_BUDGET = 1024
+
+_llms: Dict[Tuple, ChatGoogleGenerativeAI] = {}
+_runnables: Dict[Tuple, Runnable] = {}
+_sync_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _sync_calls() -> ThreadPoolExecutor:
+    """Threads that run sync calls, so they can be abandoned at the deadline."""
+    global _sync_executor
+    if _sync_executor is None:
+        _sync_executor = ThreadPoolExecutor(thread_name_prefix="llm-sync")
+    return _sync_executor
+
+
+def _get_llm(
+    api_key: str,
+    model: str,
+    temperature: float,
+    top_p: float,
+    thinking_budget: Optional[int],
+    max_output_tokens: Optional[int] = None,
+) -> ChatGoogleGenerativeAI:
+    """Return the cached client for ``api_key`` and the given parameters."""
+    key = (api_key, model, temperature, top_p, thinking_budget, max_output_tokens)
+    llm = _llms.get(key)
+    if llm is None:
+        kwargs: Dict[str, Any] = {}
+        if thinking_budget is not None:
+            kwargs["thinking_budget"] = thinking_budget
+        if max_output_tokens is not None:
+            kwargs["max_output_tokens"] = max_output_tokens
+        if settings.llm_transport:
+            kwargs["transport"] = settings.llm_transport
+        if settings.llm_api_endpoint:
+            kwargs["client_options"] = {"api_endpoint": settings.llm_api_endpoint}
+        llm = _llms[key] = ChatGoogleGenerativeAI(
+            model=model,
+            google_api_key=api_key,
+            temperature=temperature,
+            top_p=top_p,
+            **kwargs,
+        )
+        logger.debug("Created LLM client for %s", model)
+    return llm
+
+
+class PooledRunnable(Runnable):
+    """Runnable that leases an API key for every call.
+
+    ``build`` turns the client for a key into the runnable to call; its
+    result is cached per key.
+    """
+
+    def __init__(
+        self,
+        build: Callable[[ChatGoogleGenerativeAI], Runnable],
+        model: str,
+        temperature: float,
+        top_p: float,
+        thinking_budget: Optional[int],
+        max_output_tokens: Optional[int] = None,
+    ) -> None:
+        self._build = build
+        self._params = (model, temperature, top_p, thinking_budget, max_output_tokens)
+        self._by_key: Dict[str, Runnable] = {}
+
+    def for_key(self, api_key: str) -> Runnable:
+        """Return the cached runnable bound to ``api_key``."""
+        runnable = self._by_key.get(api_key)
+        if runnable is None:
+            runnable = self._by_key[api_key] = self._build(
+                _get_llm(api_key, *self._params)
+            )
+        return runnable
+
+    def invoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        return get_key_pool().call_sync(
+            lambda key: self.for_key(key).invoke(input, config, **kwargs)
+        )
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        return await get_key_pool().call(
+            lambda key: self.for_key(key).ainvoke(input, config, **kwargs)
+        )
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        """Stream from one key; moves to another only before the first chunk."""
+        pool = get_key_pool()
+        attempt = 1
+        while True:
+            started = False
+            try:
+                async with pool.lease() as key:
+                    async for chunk in self.for_key(key).astream(
+                        input, config, **kwargs
+                    ):
+                        started = True
+                        yield chunk
+                return
+            except Exception as exc:
+                if started or attempt >= pool.max_attempts or not is_retryable(exc):
+                    raise
+                attempt += 1
+
+
+def _pooled(
+    name: Any,
+    build: Callable[[ChatGoogleGenerativeAI], Runnable],
+    model: str,
+    temperature: Optional[float],
+    top_p: Optional[float],
+    thinking_budget: Optional[int],
+    max_output_tokens: Optional[int] = None,
+) -> PooledRunnable:
+    key = (
+        model,
+        name,
+        settings.temperature if temperature is None else temperature,
+        settings.top_p if top_p is None else top_p,
+        thinking_budget,
+        max_output_tokens,
+    )
+    runnable = _runnables.get(key)
+    if runnable is None:
+        runnable = _runnables[key] = PooledRunnable(build, model, *key[2:])
+    return runnable
+
+
+class RoutedRunnable(Runnable):
+    """Runnable for an LLM task whose model is chosen per call.
+
+    The :mod:`agent.model_router` picks the model, thinking budget and
+    output cap from ``settings.llm_routes`` and records the call latency.
+    Every call is bound by the route's deadline. ``ainvoke`` calls are also
+    hedged, see :mod:`agent.hedging`.
+    """
+
+    def __init__(
+        self,
+        task: str,
+        name: Any,
+        build: Callable[[ChatGoogleGenerativeAI], Runnable],
+        temperature: Optional[float],
+    ) -> None:
+        self.task = task
+        self._name = name
+        self._build = build
+        self._temperature = temperature
 
+    def _pooled(self) -> Tuple[Route, PooledRunnable]:
+        route = get_model_router().route(self.task)
+        return route, _pooled(
+            self._name,
+            self._build,
+            route.model,
+            self._temperature,
+            None,
+            route.thinking_budget,
+            route.max_output_tokens,
+        )
 
-def _get_api_key() -> str:
-    """Return an API key using round-robin selection."""
-    global _API_KEYS, _current_key_idx
+    def invoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        """Call in a worker thread and raise TimeoutError after the deadline.
 
-    if not _API_KEYS:
-        keys_str = settings.gemini_api_key.get_secret_value()
-        if keys_str:
-            _API_KEYS = [k.strip() for k in keys_str.split(",") if k.strip()]
-        if not _API_KEYS:
-            msg = "Google API keys are not configured or invalid"
-            logger.error(msg)
-            raise ValueError(msg)
+        The worker finishes the abandoned call in the background.
+        """
+        route, runnable = self._pooled()
+        started = time.monotonic()
+        call = contextvars.copy_context().run
+        future = _sync_calls().submit(call, runnable.invoke, input, config, **kwargs)
+        result = future.result(timeout=route.deadline_seconds)
+        get_model_router().observe(route, time.monotonic() - started)
+        return result
 
-    key = _API_KEYS[_current_key_idx]
-    _current_key_idx = (_current_key_idx + 1) % len(_API_KEYS)
-    logger.debug("Using Google API key index %s", _current_key_idx)
-    return key
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        route, runnable = self._pooled()
+        started = time.monotonic()
+        result = await get_hedger().call(
+            self.task,
+            lambda key: runnable.for_key(key).ainvoke(input, config, **kwargs),
+            route.deadline_seconds,
+        )
+        get_model_router().observe(route, time.monotonic() - started)
+        return result
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        """Stream the answer; the whole stream is bound by the route's deadline."""
+        route, runnable = self._pooled()
+        started = time.monotonic()
+        async with asyncio.timeout(route.deadline_seconds):
+            async for chunk in runnable.astream(input, config, **kwargs):
+                yield chunk
+        get_model_router().observe(route, time.monotonic() - started)
+
+
+def task_llm(
+    task: str,
+    schema: Optional[Type[BaseModel]] = None,
+    temperature: Optional[float] = None,
+    include_raw: bool = False,
+) -> RoutedRunnable:
+    """Return the shared runnable for ``task`` as routed by the settings.
+
+    It produces ``schema`` instances, or answers in JSON mode (see
+    :func:`json_llm`) when no schema is given. With ``include_raw`` it
+    returns the ``raw``, ``parsed`` and ``parsing_error`` dict of
+    ``with_structured_output``, so malformed answers can be repaired.
+    """
+    key = ("task", task, schema, temperature, include_raw)
+    runnable = _runnables.get(key)
+    if runnable is None:
+        if schema is None:
+            runnable = RoutedRunnable(task, "json", _json_mode, temperature)
+        else:
+            runnable = RoutedRunnable(
+                task,
+                (schema, include_raw),
+                lambda llm: llm.with_structured_output(schema, include_raw=include_raw),
+                temperature,
+            )
+        _runnables[key] = runnable
+    return runnable
+
+
+def _json_mode(llm: ChatGoogleGenerativeAI) -> Runnable:
+    return (
+        llm.bind(generation_config={"response_mime_type": "application/json"})
+        | JsonOutputParser()
+    )
+
+
+def structured_llm(
+    schema: Type[BaseModel],
+    *,
+    model: str = MODEL_NAME,
+    temperature: Optional[float] = None,
+    top_p: Optional[float] = None,
+    thinking_budget: Optional[int] = THINKING_BUDGET,
+) -> PooledRunnable:
+    """Return the shared runnable producing ``schema`` instances.
+
+    ``temperature`` and ``top_p`` default to the configured values.
+    """
+    return _pooled(
+        schema,
+        lambda llm: llm.with_structured_output(schema),
+        model,
+        temperature,
+        top_p,
+        thinking_budget,
+    )
+
+
+def json_llm(
+    *,
+    model: str = MODEL_NAME,
+    temperature: Optional[float] = None,
+    top_p: Optional[float] = None,
+    thinking_budget: Optional[int] = THINKING_BUDGET,
+) -> PooledRunnable:
+    """Return the shared runnable answering in JSON mode.
+
+    Unlike tool calls, JSON output arrives token by token, so ``astream``
+    yields progressively more complete dicts. The prompt has to describe the
+    expected fields.
+    """
+    return _pooled(
+        "json",
+        _json_mode,
+        model,
+        temperature,
+        top_p,
+        thinking_budget,
+    )
+
+
+def structured_light_llm(
+    schema: Type[BaseModel], temperature: Optional[float] = None
+) -> PooledRunnable:
+    """Return the shared runnable on the light model."""
+    return structured_llm(
+        schema, model=LIGHT_MODEL_NAME, temperature=temperature, thinking_budget=None
+    )
+
+
+def clear_llm_cache() -> None:
+    """Drop all cached clients and runnables."""
+    _llms.clear()
+    _runnables.clear()
 
 
 def create_llm(
     temperature: float = settings.temperature,
     top_p: float = settings.top_p,
 ) -> ChatGoogleGenerativeAI:
-    """Create a standard LLM instance."""
-    return ChatGoogleGenerativeAI(
-        model=MODEL_NAME,
-        google_api_key=_get_api_key(),
-        temperature=temperature,
-        top_p=top_p,
-        thinking_budget=1024,
+    """Return a standard LLM instance on the healthiest key."""
+    return _get_llm(
+        get_key_pool().pick(), MODEL_NAME, temperature, top_p, THINKING_BUDGET
     )
-    
-    
+
+
 def create_light_llm(temperature: float = settings.temperature, top_p: float = settings.top_p):
-    return ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
-        google_api_key=_get_api_key(),
-        temperature=temperature,
-        top_p=top_p
-    )
+    return _get_llm(get_key_pool().pick(), LIGHT_MODEL_NAME, temperature, top_p, None)
 
 
 def create_precise_llm() -> ChatGoogleGenerativeAI:
@@ -1,4 +1,4 @@
-from agent.llm import create_llm
+from agent.llm import structured_llm
 from pydantic import BaseModel, Field
 from typing import List
 import logging
@@ -36,8 +36,6 @@ class MultiAgentResponse(BaseModel):
     music_prompt: str = Field(description="The prompt for the music generation model.")
     change_scene: ChangeScene = Field(description="The change to the scene.")
 
-llm = create_llm().with_structured_output(MultiAgentResponse)
-
 
 async def process_user_input(input: str) -> MultiAgentResponse:
     """
@@ -46,6 +44,7 @@ async def process_user_input(input: str) -> MultiAgentResponse:
     request_id = str(uuid.uuid4())
     logger.info(f"LLM input received: {request_id}")
 
+    llm = structured_llm(MultiAgentResponse)
     response: LLMOutput = await llm.ainvoke(input)
 
     # return response
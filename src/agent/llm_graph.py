@@ -5,7 +5,9 @@ from dataclasses import dataclass
 from typing import Any, Dict, Optional
 import asyncio
 from langgraph.graph import END, StateGraph
-from agent.image_agent import generate_image_prompt
+from agent.image_agent import scene_image_prompt
+from agent.image_delivery import deliver_image, pending_image
+from agent.parallel_step import StepTimings, check_ending_and_generate_scene
 
 from agent.tools import (
     check_ending,
@@ -14,7 +16,8 @@ from agent.tools import (
     generate_story_frame,
     update_state_with_choice,
 )
-from agent.redis_state import get_user_state
+from agent.redis_state import get_current_scene
+from agent.speculation import speculating
 from audio.audio_generator import change_music_tone
 logger = logging.getLogger(__name__)
 
@@ -60,14 +63,18 @@ async def node_init_game(state: GraphState) -> GraphState:
     first_scene = await generate_scene.ainvoke(
         {"user_hash": state.user_hash, "last_choice": "start"}
     )
-    change_scene = await generate_image_prompt(first_scene["description"], state.user_hash)
+    change_scene = await scene_image_prompt(first_scene, state.user_hash)
     logger.info(f"Change scene: {change_scene}")
-    await generate_scene_image.ainvoke(
-        {
-            "user_hash": state.user_hash,
-            "scene_id": first_scene["scene_id"],
-            "change_scene": change_scene,
-        }
+    await deliver_image(
+        state.user_hash,
+        first_scene["scene_id"],
+        lambda: generate_scene_image.ainvoke(
+            {
+                "user_hash": state.user_hash,
+                "scene_id": first_scene["scene_id"],
+                "change_scene": change_scene,
+            }
+        ),
     )
     state.scene = first_scene
     return state
@@ -75,8 +82,8 @@ async def node_init_game(state: GraphState) -> GraphState:
 
 async def node_player_step(state: GraphState) -> GraphState:
     logger.debug("[Graph] node_player_step state: %s", state)
-    user_state = await get_user_state(state.user_hash)
-    scene_id = user_state.current_scene_id
+    current_scene = await get_current_scene(state.user_hash)
+    scene_id = current_scene.scene_id if current_scene else None
     if state.choice_text:
         await update_state_with_choice.ainvoke(
             {
@@ -85,31 +92,56 @@ async def node_player_step(state: GraphState) -> GraphState:
                 "choice_text": state.choice_text,
             }
         )
-    ending = await check_ending.ainvoke({"user_hash": state.user_hash})
-    state.ending = ending
-    if not ending.get("ending_reached", False):
-        next_scene = await generate_scene.ainvoke(
+    timings = StepTimings()
+    ending, next_scene = await check_ending_and_generate_scene(
+        state.user_hash,
+        lambda: check_ending.ainvoke({"user_hash": state.user_hash}),
+        lambda: generate_scene.ainvoke(
             {
                 "user_hash": state.user_hash,
                 "last_choice": state.choice_text,
             }
-        )
-        change_scene = await generate_image_prompt(next_scene["description"], state.user_hash)
-        current_image = None
-        if scene_id and scene_id in user_state.scenes:
-            current_image = user_state.scenes[scene_id].image
-
-        image_task = generate_scene_image.ainvoke(
-            {
-                "user_hash": state.user_hash,
-                "scene_id": next_scene["scene_id"],
-                "current_image": current_image,
-                "change_scene": change_scene,
-            }
-        )
-        music_task = change_music_tone(state.user_hash, next_scene["music"])
-        await asyncio.gather(image_task, music_task)
+        ),
+        timings,
+    )
+    state.ending = ending
+    if next_scene is not None:
+        async with timings.phase("image prompt"):
+            change_scene = await scene_image_prompt(
+                next_scene,
+                state.user_hash,
+                current_scene.description if current_scene else None,
+                state.choice_text,
+            )
+
+        async def make_image():
+            current_image = current_scene.image if current_scene else None
+            if current_scene is not None and current_image is None:
+                # The previous picture may still be on its way.
+                current_image = await pending_image(
+                    state.user_hash, current_scene.scene_id
+                )
+            return await generate_scene_image.ainvoke(
+                {
+                    "user_hash": state.user_hash,
+                    "scene_id": next_scene["scene_id"],
+                    "current_image": current_image,
+                    "change_scene": change_scene,
+                }
+            )
+
+        image_task = deliver_image(state.user_hash, next_scene["scene_id"], make_image)
+        async with timings.phase("image"):
+            if speculating():
+                # The runner changes the music if this branch is picked.
+                await image_task
+            else:
+                music_task = change_music_tone(state.user_hash, next_scene["music"])
+                await asyncio.gather(image_task, music_task)
         state.scene = next_scene
+    logger.info(
+        "[Graph] Player step for user %s: %s", state.user_hash, timings.summary()
+    )
     return state
 
 
@@ -0,0 +1,201 @@
+"""Process-local user state storage.
+
+States live as objects in a dict, so nothing is encoded on the hot path. It
+does not survive a restart and is not shared between workers, which makes it
+suitable for single-process deployments, local development and tests.
+
+The same rules as in the Redis store apply: every write bumps the version,
+idle users expire after ``state_ttl_seconds``, and scenes beyond
+``hot_scene_limit`` and summarized choices beyond ``hot_choice_limit`` are
+moved to a compressed archive.
+"""
+
+from __future__ import annotations
+
+import copy
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from config import settings
+from agent.models import Scene, StoryFrame, UserChoice, UserState
+from agent.state_backend import StateBackendBase
+from agent.state_codec import decode_archive, encode_archive
+from agent.state_context import RedisStats, StateChanges
+
+
+@dataclass
+class _Record:
+    state: UserState
+    accessed: float
+    archive: List[bytes] = field(default_factory=list)
+    choice_archive: List[bytes] = field(default_factory=list)
+
+
+class MemoryStateBackend(StateBackendBase):
+    """Keeps user states in process memory.
+
+    Nothing awaits between reading and writing a record, so every write is
+    atomic with respect to other tasks on the event loop. Stored objects are
+    never handed out: reads return copies and writes store copies.
+    """
+
+    def __init__(self) -> None:
+        self.stats = RedisStats()
+        self._records: Dict[str, _Record] = {}
+
+    def _record(self, user_id: str, create: bool = False) -> Optional[_Record]:
+        """Return the user's record, dropping it first if it has expired."""
+        self._track()
+        now = time.monotonic()
+        record = self._records.get(user_id)
+        ttl = settings.state_ttl_seconds
+        if record is not None and ttl > 0 and now - record.accessed > ttl:
+            del self._records[user_id]
+            record = None
+        if record is None and create:
+            record = self._records[user_id] = _Record(UserState(), now)
+        if record is not None:
+            record.accessed = now
+        return record
+
+    def _write(self, record: _Record, changes: StateChanges) -> int:
+        """Apply resolved ``changes`` to ``record``; returns the new version."""
+        state = record.state
+        if changes.replace:
+            state = record.state = UserState(version=state.version)
+            record.archive.clear()
+            record.choice_archive.clear()
+        copy.deepcopy(changes).apply_to(state)
+        state.version += 1
+        if len(state.scenes) > settings.hot_scene_limit:
+            self._archive(record, settings.hot_scene_limit // 2)
+        if len(state.user_choices) > settings.hot_choice_limit:
+            self._archive_choices(record, settings.hot_choice_limit // 2)
+        return state.version
+
+    @staticmethod
+    def _archive(record: _Record, keep: int) -> int:
+        state = record.state
+        oldest = list(state.scenes)[: max(len(state.scenes) - keep, 0)]
+        scene_ids = [sid for sid in oldest if sid != state.current_scene_id]
+        if not scene_ids:
+            return 0
+        record.archive.append(
+            encode_archive([state.scenes.pop(sid) for sid in scene_ids])
+        )
+        return len(scene_ids)
+
+    @staticmethod
+    def _archive_choices(record: _Record, keep: int) -> int:
+        state = record.state
+        folded = state.history.covered - state.archived_choices
+        count = min(folded, len(state.user_choices) - keep)
+        if count <= 0:
+            return 0
+        record.choice_archive.append(encode_archive(state.user_choices[:count]))
+        del state.user_choices[:count]
+        state.archived_choices += count
+        return count
+
+    async def get(self, user_id: str) -> UserState:
+        record = self._record(user_id)
+        if record is None:
+            return UserState()
+        return record.state.model_copy(deep=True)
+
+    async def set(self, user_id: str, state: UserState) -> int:
+        """Replace the stored state; returns the new version."""
+        return self._write(
+            self._record(user_id, create=True), StateChanges.full(state)
+        )
+
+    async def apply(self, user_id: str, changes: StateChanges) -> Optional[int]:
+        """Write only the given changes; returns the new version or None."""
+        if not changes:
+            return None
+        record = self._record(user_id, create=True)
+        resolved = changes.resolve_images(record.state.scenes)
+        return None if resolved is None else self._write(record, resolved)
+
+    async def update(
+        self,
+        user_id: str,
+        mutate: Callable[[UserState], Optional[StateChanges]],
+    ) -> Optional[int]:
+        """Derive changes from the current state and write them atomically."""
+        record = self._record(user_id, create=True)
+        changes = mutate(record.state.model_copy(deep=True))
+        if not changes:
+            return None
+        resolved = changes.resolve_images(record.state.scenes)
+        return None if resolved is None else self._write(record, resolved)
+
+    async def reset(self, user_id: str) -> None:
+        self._track()
+        self._records.pop(user_id, None)
+
+    async def archive_scenes(self, user_id: str, keep: Optional[int] = None) -> int:
+        """Move the oldest scenes, except the current one, to the archive."""
+        record = self._record(user_id)
+        if record is None:
+            return 0
+        if keep is None:
+            keep = settings.hot_scene_limit // 2
+        moved = self._archive(record, keep)
+        if moved:
+            record.state.version += 1
+        return moved
+
+    async def get_archived_scenes(self, user_id: str) -> List[Scene]:
+        record = self._record(user_id)
+        if record is None:
+            return []
+        return [scene for batch in record.archive for scene in decode_archive(batch)]
+
+    async def archive_choices(self, user_id: str, keep: Optional[int] = None) -> int:
+        """Move the oldest summarized choices to the archive."""
+        record = self._record(user_id)
+        if record is None:
+            return 0
+        if keep is None:
+            keep = settings.hot_choice_limit // 2
+        moved = self._archive_choices(record, keep)
+        if moved:
+            record.state.version += 1
+        return moved
+
+    async def get_archived_choices(self, user_id: str) -> List[UserChoice]:
+        record = self._record(user_id)
+        if record is None:
+            return []
+        return [
+            choice
+            for batch in record.choice_archive
+            for choice in decode_archive(batch, UserChoice)
+        ]
+
+    async def get_story_frame(self, user_id: str) -> Optional[StoryFrame]:
+        record = self._record(user_id)
+        return None if record is None else _copy(record.state.story_frame)
+
+    async def get_scene(self, user_id: str, scene_id: str) -> Optional[Scene]:
+        record = self._record(user_id)
+        return None if record is None else _copy(record.state.scenes.get(scene_id))
+
+    async def get_current_scene(self, user_id: str) -> Optional[Scene]:
+        record = self._record(user_id)
+        if record is None:
+            return None
+        state = record.state
+        return _copy(state.scenes.get(state.current_scene_id or ""))
+
+    async def get_user_choices(self, user_id: str) -> List[UserChoice]:
+        record = self._record(user_id)
+        if record is None:
+            return []
+        return [c.model_copy() for c in record.state.user_choices]
+
+
+def _copy(model):
+    return None if model is None else model.model_copy(deep=True)
@@ -0,0 +1,178 @@
+"""Per-task model selection with latency SLOs.
+
+``settings.llm_routes`` maps every LLM task to a model, a thinking budget,
+an output cap and a latency SLO. :class:`ModelRouter` picks the model for
+each call and records how long it took. When the p95 of the last
+``llm_route_window`` calls of a task goes over its SLO, the task moves to
+its fallback model for ``llm_route_fallback_seconds``. It then tries its
+primary model again with a fresh window.
+
+Every call also lands in a per-task, per-model :class:`LatencyHistogram`,
+so SLOs and routes can be tuned from data.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from config import LLMRoute, settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets in seconds; the last bucket is open.
+BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 8, 12, 20, 30, 60)
+
+
+class LatencyHistogram:
+    """Bucketed call latencies of one task on one model."""
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def buckets(self) -> Dict[str, int]:
+        labels = [f"<={b}s" for b in BUCKETS] + [f">{BUCKETS[-1]}s"]
+        return dict(zip(labels, self.counts))
+
+
+@dataclass
+class Route:
+    """Model and limits chosen for one call."""
+
+    task: str
+    model: str
+    thinking_budget: Optional[int]
+    max_output_tokens: Optional[int]
+    deadline_seconds: Optional[float] = None
+    fallback: bool = False
+
+
+def p95(samples: Iterable[float]) -> float:
+    """p95 of recent latency samples, shared with :mod:`agent.hedging`."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class ModelRouter:
+    """Chooses models per task and tracks their latency."""
+
+    def __init__(self, routes: Optional[Dict[str, LLMRoute]] = None) -> None:
+        self._routes = routes
+        self._recent: Dict[str, Deque[float]] = {}
+        self._fallback_until: Dict[str, float] = {}
+        self.histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+
+    @property
+    def routes(self) -> Dict[str, LLMRoute]:
+        return settings.llm_routes if self._routes is None else self._routes
+
+    def route(self, task: str) -> Route:
+        config = self.routes[task]
+        until = self._fallback_until.get(task)
+        if until is not None and config.fallback_model:
+            if time.monotonic() < until:
+                return Route(
+                    task,
+                    config.fallback_model,
+                    None,
+                    config.max_output_tokens,
+                    config.deadline_seconds,
+                    fallback=True,
+                )
+            del self._fallback_until[task]
+            logger.info("[Router] Task %s back on %s", task, config.model)
+        return Route(
+            task,
+            config.model,
+            config.thinking_budget,
+            config.max_output_tokens,
+            config.deadline_seconds,
+        )
+
+    def observe(self, route: Route, seconds: float) -> None:
+        """Record the latency of a call made on ``route``."""
+        histogram = self.histograms.get((route.task, route.model))
+        if histogram is None:
+            histogram = self.histograms[(route.task, route.model)] = LatencyHistogram()
+        histogram.observe(seconds)
+        if route.fallback:
+            return
+        recent = self._recent.get(route.task)
+        if recent is None:
+            recent = self._recent[route.task] = deque(maxlen=settings.llm_route_window)
+        recent.append(seconds)
+
+        config = self.routes[route.task]
+        if (
+            config.slo_seconds is None
+            or not config.fallback_model
+            or len(recent) < settings.llm_route_min_samples
+        ):
+            return
+        recent_p95 = p95(recent)
+        if recent_p95 > config.slo_seconds:
+            self._fallback_until[route.task] = (
+                time.monotonic() + settings.llm_route_fallback_seconds
+            )
+            recent.clear()
+            logger.warning(
+                "[Router] Task %s p95 %.2fs over its %.2fs SLO, using %s for %.0fs",
+                route.task,
+                recent_p95,
+                config.slo_seconds,
+                config.fallback_model,
+                settings.llm_route_fallback_seconds,
+            )
+
+    def report(self) -> Dict[str, Dict[str, Dict]]:
+        """Latency summary per task and model."""
+        report: Dict[str, Dict[str, Dict]] = {}
+        for (task, model), histogram in sorted(self.histograms.items()):
+            report.setdefault(task, {})[model] = {
+                "calls": histogram.count,
+                "mean": histogram.mean,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "buckets": histogram.buckets(),
+            }
+        return report
+
+
+_router = ModelRouter()
+
+
+def get_model_router() -> ModelRouter:
+    return _router
+
+
+def set_model_router(router: Optional[ModelRouter]) -> None:
+    """Replace the shared router; ``None`` resets it to the configured routes."""
+    global _router
+    _router = router or ModelRouter()
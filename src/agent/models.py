@@ -1,6 +1,6 @@
 """Pydantic models representing game state and LLM outputs."""
 
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Literal, Optional, Set
 
 from pydantic import BaseModel, Field
 
@@ -75,6 +75,34 @@ class SceneLLM(BaseModel):
 
     description: str
     choices: List[SceneChoice]
+    milestones_achieved: List[str] = Field(default_factory=list)
+
+    def to_scene(self, scene_id: str) -> Scene:
+        """Scene with the first two choices of the answer."""
+        return Scene(
+            scene_id=scene_id,
+            description=self.description,
+            choices=[choice.model_copy() for choice in self.choices[:2]],
+        )
+
+
+class ChangeScene(BaseModel):
+    change_scene: Literal["change_completely", "modify", "no_change"] = Field(
+        description="Whether the scene should be completely changed, just modified or not changed at all"
+    )
+    scene_description: Optional[str] = None
+
+
+class FusedSceneLLM(SceneLLM):
+    """Scene together with its image decision and music prompt in one answer."""
+
+    change_scene: ChangeScene
+    music: str
+
+    def to_scene(self, scene_id: str) -> Scene:
+        scene = super().to_scene(scene_id)
+        scene.music = self.music
+        return scene
 
 
 class EndingCheckResult(BaseModel):
@@ -92,6 +120,21 @@ class UserChoice(BaseModel):
     timestamp: Optional[str] = None
 
 
+class HistorySummary(BaseModel):
+    """Running summary of the oldest player choices."""
+
+    summary: str = ""
+    # Number of leading choices folded into ``summary``, counted from the
+    # first choice of the game, archived ones included.
+    covered: int = 0
+
+
+class HistorySummaryLLM(BaseModel):
+    """Structure expected from the LLM when folding choices into the summary."""
+
+    summary: str
+
+
 class UserState(BaseModel):
     """State stored for each user."""
 
@@ -99,6 +142,21 @@ class UserState(BaseModel):
     current_scene_id: Optional[str] = None
     scenes: Dict[str, Scene] = Field(default_factory=dict)
     milestones_achieved: Set[str] = Field(default_factory=set)
+    # Recent choices only; the ``archived_choices`` before them are in the
+    # choice archive.
     user_choices: List[UserChoice] = Field(default_factory=list)
+    archived_choices: int = 0
+    history: HistorySummary = Field(default_factory=HistorySummary)
     ending: Optional[Ending] = None
+    # scene_id -> content hash of its image in ``images.asset_store``
     assets: Dict[str, str] = Field(default_factory=dict)
+    version: int = 0
+
+    @property
+    def choice_count(self) -> int:
+        """Number of choices made so far, archived ones included."""
+        return self.archived_choices + len(self.user_choices)
+
+    def choices_from(self, index: int) -> List[UserChoice]:
+        """Hot choices from the ``index``-th choice of the game on."""
+        return self.user_choices[max(index - self.archived_choices, 0) :]
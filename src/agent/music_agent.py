@@ -1,5 +1,7 @@
 from pydantic import BaseModel
-from agent.llm import create_light_llm
+from agent.model_router import get_model_router
+from agent.prompt_cache import cache_key, get_prompt_cache
+from agent.repair import structured_call
 from langchain_core.messages import SystemMessage, HumanMessage
 import logging
 
@@ -35,13 +37,18 @@ class MusicPrompt(BaseModel):
     prompt: str
 
 
-llm = create_light_llm(0.1).with_structured_output(MusicPrompt)
-
-
 async def generate_music_prompt(scene_description: str, request_id: str) -> str:
     logger.info(f"Generating music prompt for the current scene: {request_id}")
-    response = await llm.ainvoke(
-        [SystemMessage(content=system_prompt), HumanMessage(content=scene_description)]
+    model = get_model_router().route("music_prompt").model
+    response = await get_prompt_cache("music_prompt", MusicPrompt).get_or_compute(
+        cache_key(model, system_prompt, scene_description),
+        lambda: structured_call(
+            "generate_music_prompt",
+            "music_prompt",
+            MusicPrompt,
+            [SystemMessage(content=system_prompt), HumanMessage(content=scene_description)],
+            temperature=0.1,
+        ),
     )
     logger.info(f"Music prompt generated: {request_id}")
     return response.prompt
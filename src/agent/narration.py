@@ -0,0 +1,90 @@
+"""Streaming of scene text to the UI while a step is still running.
+
+:func:`agent.runner.stream_step` opens a :class:`Narration` for the step and
+forwards its text to Gradio. Tools that generate player-facing text publish
+it with :func:`stream_json_field`. Without an open narration, for example
+in speculative branches, nothing is streamed and the caller should make a
+plain call instead.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from langchain_core.runnables import Runnable
+
+
+class Narration:
+    """Latest text of one step, plus when it first appeared.
+
+    Only the newest text is kept: each update contains everything generated
+    so far, so a slow reader simply skips intermediate versions.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.first_text_at: Optional[float] = None
+        self.text = ""
+        self._changed = asyncio.Event()
+
+    def publish(self, text: str) -> None:
+        if not text or text == self.text:
+            return
+        if self.first_text_at is None:
+            self.first_text_at = time.monotonic()
+        self.text = text
+        self._changed.set()
+
+    async def wait(self) -> str:
+        """Wait for text newer than what was last returned."""
+        await self._changed.wait()
+        self._changed.clear()
+        return self.text
+
+    @property
+    def time_to_first_text(self) -> Optional[float]:
+        if self.first_text_at is None:
+            return None
+        return self.first_text_at - self.started
+
+
+_current: ContextVar[Optional[Narration]] = ContextVar("narration", default=None)
+
+
+def current_narration() -> Optional[Narration]:
+    return _current.get()
+
+
+@contextmanager
+def narrate(narration: Narration) -> Iterator[Narration]:
+    """Make ``narration`` the target of streamed text inside the block.
+
+    Tasks created inside the block inherit it.
+    """
+    token = _current.set(narration)
+    try:
+        yield narration
+    finally:
+        _current.reset(token)
+
+
+async def stream_json_field(
+    runnable: Runnable, prompt: Any, field: str
+) -> Dict[str, Any]:
+    """Stream ``prompt`` through a JSON-mode runnable.
+
+    The growing value of ``field`` is published to the current narration.
+    Returns the final parsed object.
+    """
+    narration = current_narration()
+    data: Dict[str, Any] = {}
+    async for data in runnable.astream(prompt):
+        if narration is not None and isinstance(data, dict):
+            value = data.get(field)
+            if isinstance(value, str):
+                narration.publish(value)
+    return data
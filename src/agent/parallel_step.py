@@ -0,0 +1,94 @@
+"""Concurrent ending check and scene generation for a player step.
+
+Most steps do not reach an ending, so waiting for the ending check before
+writing the next scene puts two LLM calls on the critical path. Here both
+start together. The scene is written into a fork of the active
+:class:`~agent.state_context.StepState`. Its changes are kept only when no
+ending was reached; otherwise the scene task is cancelled and the fork is
+dropped.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from agent.state_context import activate, current_step_state
+
+logger = logging.getLogger(__name__)
+
+
+class StepTimings:
+    """Wall-clock duration of the phases of one step."""
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.phases: Dict[str, float] = {}
+
+    @asynccontextmanager
+    async def phase(self, name: str) -> AsyncIterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.monotonic() - started
+
+    @property
+    def total(self) -> float:
+        return time.monotonic() - self.started
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{n} {s:.2f}s" for n, s in self.phases.items())
+        return f"{phases}, total {self.total:.2f}s"
+
+
+async def check_ending_and_generate_scene(
+    user_hash: str,
+    check_ending: Callable[[], Awaitable[Dict]],
+    generate_scene: Callable[[], Awaitable[Dict]],
+    timings: Optional[StepTimings] = None,
+) -> Tuple[Dict, Optional[Dict]]:
+    """Run the ending check and scene generation concurrently.
+
+    Returns the ending check result and the new scene, which is None when an
+    ending was reached. Without an active step the scene cannot be written
+    aside, so the calls run one after the other.
+    """
+    timings = timings or StepTimings()
+    step = current_step_state(user_hash)
+    if step is None:
+        async with timings.phase("ending"):
+            ending = await check_ending()
+        if ending.get("ending_reached", False):
+            return ending, None
+        async with timings.phase("scene"):
+            return ending, await generate_scene()
+
+    fork = await step.fork()
+
+    async def scene_in_fork() -> Dict:
+        # Runs in the task's own copy of the context.
+        activate(fork)
+        async with timings.phase("scene"):
+            return await generate_scene()
+
+    scene_task = asyncio.create_task(scene_in_fork())
+    try:
+        async with timings.phase("ending"):
+            ending = await check_ending()
+    except BaseException:
+        scene_task.cancel()
+        raise
+    if ending.get("ending_reached", False):
+        scene_task.cancel()
+        await asyncio.gather(scene_task, return_exceptions=True)
+        logger.info("[Step] Ending reached for user %s, scene discarded", user_hash)
+        return ending, None
+
+    async with timings.phase("scene wait"):
+        scene = await scene_task
+    await step.record(fork.pending)
+    return ending, scene
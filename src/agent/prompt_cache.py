@@ -0,0 +1,216 @@
+"""Memoisation of the light prompt agents.
+
+The image and music prompt agents run at temperature 0.1 and behave almost
+like pure functions of the scene description. Restarted games, preset worlds
+and endings ask them the same question again and again. :class:`PromptCache`
+keeps their answers in two tiers:
+
+* a process-local LRU of ``prompt_cache_size`` entries;
+* with the Redis state backend, a shared tier. Entries expire after
+  ``prompt_cache_ttl`` seconds, and the oldest are evicted once there are
+  more than ``prompt_cache_shared_max_entries`` of them.
+
+Keys hash the model, the system prompt and the whitespace-normalised input,
+so a new prompt or model never reads old answers. Identical requests that
+run at the same time share one call. Redis errors are logged and the call
+goes to the model, so the cache never breaks a step.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Generic, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+M = TypeVar("M", bound=BaseModel)
+
+KEY_PREFIX = "llmgamehub:prompt-cache"
+
+
+@dataclass
+class PromptCacheStats:
+    """Lookups of one cache and the model time they saved."""
+
+    local_hits: int = 0
+    shared_hits: int = 0
+    coalesced: int = 0
+    misses: int = 0
+    errors: int = 0
+    compute_seconds: float = 0.0
+
+    @property
+    def hits(self) -> int:
+        return self.local_hits + self.shared_hits + self.coalesced
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        """Estimated, at the mean duration of the calls that were made."""
+        if not self.misses:
+            return 0.0
+        return self.hits * self.compute_seconds / self.misses
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def cache_key(model: str, system_prompt: str, text: str) -> str:
+    digest = hashlib.sha256()
+    for part in (model, system_prompt, normalize(text)):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _shared_client():
+    if settings.state_backend != "redis":
+        return None
+    from agent.redis_state import create_redis_client
+
+    return create_redis_client()
+
+
+class PromptCache(Generic[M]):
+    """Two-tier cache of ``schema`` answers with single-flight lookups."""
+
+    def __init__(
+        self,
+        name: str,
+        schema: Type[M],
+        shared: Optional[Callable[[], object]] = _shared_client,
+    ) -> None:
+        self.name = name
+        self.schema = schema
+        self.stats = PromptCacheStats()
+        self._local: OrderedDict[str, Tuple[float, M]] = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._make_shared = shared
+        self._shared = None
+
+    @property
+    def shared(self):
+        """Redis client of the shared tier, created on first use."""
+        if self._shared is None and self._make_shared is not None:
+            self._shared = self._make_shared()
+            self._make_shared = None
+        return self._shared
+
+    def _redis_key(self, key: str) -> str:
+        return f"{KEY_PREFIX}:{self.name}:{key}"
+
+    def _index_key(self) -> str:
+        return f"{KEY_PREFIX}:{self.name}:index"
+
+    def _get_local(self, key: str) -> Optional[M]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return entry[1]
+
+    def _put_local(self, key: str, value: M) -> None:
+        self._local[key] = (time.monotonic() + settings.prompt_cache_ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > settings.prompt_cache_size:
+            self._local.popitem(last=False)
+
+    async def _get_shared(self, key: str) -> Optional[M]:
+        if self.shared is None:
+            return None
+        try:
+            raw = await self.shared.get(self._redis_key(key))
+            return None if raw is None else self.schema.model_validate_json(raw)
+        except Exception as exc:  # noqa: BLE001
+            self.stats.errors += 1
+            logger.warning("[PromptCache] %s read failed: %s", self.name, exc)
+            return None
+
+    async def _put_shared(self, key: str, value: M) -> None:
+        if self.shared is None:
+            return
+        index = self._index_key()
+        try:
+            async with self.shared.pipeline(transaction=False) as pipe:
+                pipe.set(
+                    self._redis_key(key),
+                    value.model_dump_json(),
+                    ex=settings.prompt_cache_ttl,
+                )
+                pipe.zadd(index, {key: time.time()})
+                pipe.zcard(index)
+                *_, size = await pipe.execute()
+            excess = size - settings.prompt_cache_shared_max_entries
+            if excess > 0:
+                evicted = await self.shared.zpopmin(index, excess)
+                if evicted:
+                    await self.shared.delete(
+                        *(self._redis_key(k.decode()) for k, _ in evicted)
+                    )
+        except Exception as exc:  # noqa: BLE001
+            self.stats.errors += 1
+            logger.warning("[PromptCache] %s write failed: %s", self.name, exc)
+
+    async def _lookup(self, key: str, compute: Callable[[], Awaitable[M]]) -> M:
+        value = await self._get_shared(key)
+        if value is not None:
+            self.stats.shared_hits += 1
+        else:
+            started = time.monotonic()
+            value = await compute()
+            self.stats.misses += 1
+            self.stats.compute_seconds += time.monotonic() - started
+            await self._put_shared(key, value)
+        self._put_local(key, value)
+        return value
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[M]]) -> M:
+        """Return the cached answer for ``key``, or await ``compute`` once."""
+        if not settings.prompt_cache_enabled:
+            return await compute()
+        value = self._get_local(key)
+        if value is not None:
+            self.stats.local_hits += 1
+            return value
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats.coalesced += 1
+            return await asyncio.shield(inflight)
+        task = asyncio.ensure_future(self._lookup(key, compute))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def clear(self) -> None:
+        self._local.clear()
+
+
+_caches: Dict[str, PromptCache] = {}
+
+
+def get_prompt_cache(name: str, schema: Type[M]) -> PromptCache[M]:
+    cache = _caches.get(name)
+    if cache is None:
+        cache = _caches[name] = PromptCache(name, schema)
+    return cache
+
+
+def get_prompt_cache_stats() -> Dict[str, PromptCacheStats]:
+    return {name: cache.stats for name, cache in _caches.items()}
@@ -26,11 +26,13 @@ Each choice text must be concise, up to 7 words.
 Respond ONLY with JSON containing:
 - description: short summary of the scene
 - choices: exactly two dicts {{"text": ..., "next_scene_short_desc": ...}}
+- milestones_achieved: ids of the milestones reached in this scene, if any
 Translate the scene description and choices into a language of lore language.
 """
 
 ENDING_CHECK_PROMPT = """
 History: {history}
+Milestones achieved: {milestones_achieved}
 Endings: {endings}
 Check if any ending conditions are met.
 If none are met return ending_reached: false.
@@ -38,3 +40,48 @@ If an ending is reached return ending_reached: true and provide the
 ending object (id, type, description).
 Respond ONLY with JSON.
 """
+
+FUSED_SCENE_PROMPT = """
+Using the provided lore and history, generate the next scene together with
+its picture and soundtrack.
+Lore: {lore}
+Goal: {goal}
+Milestones: {milestones}
+Endings: {endings}
+History: {history}
+Last choice: {last_choice}
+The scene description must be 2-3 sentences and no more than 50 words.
+Each choice text must be concise, up to 7 words.
+Respond ONLY with JSON containing:
+- description: short summary of the scene
+- choices: exactly two dicts {{"text": ..., "next_scene_short_desc": ...}}
+- milestones_achieved: ids of the milestones reached in this scene, if any
+- change_scene: {{"change_scene": ..., "scene_description": ...}} where
+  change_scene is "change_completely" for a new location, "modify" when the
+  view changes within the same place and "no_change" otherwise. Unless it is
+  "no_change", scene_description is a detailed English image prompt seen
+  strictly from the character's eyes (first person, no part of the
+  character's body visible) covering subject, surroundings, art style,
+  lighting, mood and color palette.
+- music: English prompt for the soundtrack naming the genre, instruments,
+  mood and intensity that fit the scene
+Translate the scene description and choices into a language of lore language.
+"""
+
+HISTORY_SUMMARY_PROMPT = """
+Summary of the story so far: {summary}
+Player choices since then, oldest first: {choices}
+Rewrite the summary so that it also covers these choices. Keep every fact
+that matters for the goal, milestones and endings: places visited, items,
+characters met and decisions taken. Use at most 120 words.
+Respond ONLY with JSON containing:
+- summary: the updated summary
+"""
+
+REPAIR_PROMPT = """
+An answer of type {schema} came back incomplete:
+{partial}
+Provide ONLY the following fields so that the answer becomes complete:
+{fields}
+Stay consistent with the rest of the answer and keep its language.
+"""
@@ -0,0 +1,123 @@
+"""Memory report for the user state and prompt cache keys stored in Redis.
+
+Run from ``src`` with ``python -m agent.redis_report [--url URL]``. Prints key
+counts, size distribution and how many keys have no expiry, per key kind.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+from agent.prompt_cache import KEY_PREFIX as PROMPT_CACHE_PREFIX
+from agent.redis_state import create_redis_client
+
+KEY_PATTERN = "llmgamehub:*"
+_SUFFIX_KINDS = ("scenes", "choices", "scene_order", "archive", "choice_archive")
+
+
+@dataclass
+class KindReport:
+    """Sizes of all keys of one kind."""
+
+    sizes: List[int] = field(default_factory=list)
+    without_ttl: int = 0
+
+    def percentile(self, q: float) -> int:
+        ordered = sorted(self.sizes)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def key_kind(key: str) -> str:
+    """Classify a key as ``state``, ``legacy``, ``prompt_cache`` or a suffix kind."""
+    if key.startswith(PROMPT_CACHE_PREFIX + ":"):
+        return "prompt_cache"
+    if "{" not in key:
+        return "legacy"
+    suffix = key.rsplit("}", 1)[1].lstrip(":")
+    if not suffix:
+        return "state"
+    return suffix if suffix in _SUFFIX_KINDS else "other"
+
+
+async def _sizes(client: redis.Redis, keys: List[str]) -> List[int]:
+    """Return MEMORY USAGE of each key, or its DUMP length where unsupported."""
+    try:
+        async with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.memory_usage(key)
+            return [size or 0 for size in await pipe.execute()]
+    except ResponseError:
+        async with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.dump(key)
+            return [len(dump or b"") for dump in await pipe.execute()]
+
+
+async def collect(
+    client: redis.Redis, pattern: str = KEY_PATTERN, batch: int = 500
+) -> Dict[str, KindReport]:
+    """Scan keys matching ``pattern`` and group their sizes by kind."""
+    reports: Dict[str, KindReport] = defaultdict(KindReport)
+    keys: List[str] = []
+
+    async def flush() -> None:
+        sizes = await _sizes(client, keys)
+        async with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.ttl(key)
+            ttls = await pipe.execute()
+        for key, size, ttl in zip(keys, sizes, ttls):
+            report = reports[key_kind(key)]
+            report.sizes.append(size)
+            report.without_ttl += ttl == -1
+        keys.clear()
+
+    async for key in client.scan_iter(match=pattern, count=batch):
+        keys.append(key.decode() if isinstance(key, bytes) else key)
+        if len(keys) >= batch:
+            await flush()
+    if keys:
+        await flush()
+    return dict(reports)
+
+
+def format_report(reports: Dict[str, KindReport]) -> str:
+    header = (
+        f"{'kind':<12} {'keys':>7} {'total B':>11} {'mean':>8} {'p50':>8} "
+        f"{'p90':>8} {'p99':>8} {'max':>9} {'no ttl':>7}"
+    )
+    lines = [header, "-" * len(header)]
+    for kind in sorted(reports):
+        r = reports[kind]
+        total = sum(r.sizes)
+        lines.append(
+            f"{kind:<12} {len(r.sizes):>7} {total:>11} {total // len(r.sizes):>8} "
+            f"{r.percentile(0.5):>8} {r.percentile(0.9):>8} "
+            f"{r.percentile(0.99):>8} {max(r.sizes):>9} {r.without_ttl:>7}"
+        )
+    users = len(reports["state"].sizes) if "state" in reports else 0
+    lines.append(f"users: {users}")
+    return "\n".join(lines)
+
+
+async def main(url: Optional[str] = None, pattern: str = KEY_PATTERN) -> None:
+    client = create_redis_client(url)
+    try:
+        print(format_report(await collect(client, pattern)))
+    finally:
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="Redis URL; defaults to settings.redis_url")
+    parser.add_argument("--pattern", default=KEY_PATTERN)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.pattern))
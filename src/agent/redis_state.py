@@ -1,51 +1,786 @@
-"""Async Redis-backed user state storage."""
+"""Async Redis-backed user state storage.
+
+Each user's state is split across six keys so that a step only writes what
+it changed:
+
+* ``llmgamehub:{<user>}`` - hash with ``story_frame``, ``current_scene_id``,
+  ``milestones_achieved``, ``ending``, ``assets``, ``history``,
+  ``archived_choices`` and ``version`` fields;
+* ``llmgamehub:{<user>}:scenes`` - hash of ``scene_id`` -> scene;
+* ``llmgamehub:{<user>}:choices`` - list of recent player choices;
+* ``llmgamehub:{<user>}:scene_order`` - sorted set of scene ids by age;
+* ``llmgamehub:{<user>}:archive`` - append-only list of zlib-compressed
+  batches of old scenes, read only on demand;
+* ``llmgamehub:{<user>}:choice_archive`` - the same for old choices.
+
+Once a user has more than ``hot_scene_limit`` scenes the oldest ones are moved
+to the archive in the background. Likewise, beyond ``hot_choice_limit``
+choices the oldest ones already folded into the history summary are moved
+to the choice archive. Loading the state therefore costs about the same
+however long the game runs. Every access refreshes the ``state_ttl_seconds``
+expiry of all keys, so abandoned sessions disappear on their own.
+
+The braces are a Redis Cluster hash tag: all keys of one user live in the same
+slot, so multi-key transactions work when users are spread across shards.
+
+Inside :func:`step_state` all reads and writes go to a shared in-memory
+:class:`~agent.state_context.StepState` and are flushed once at the end.
+
+With ``state_cache_enabled`` decoded states are also kept in a process-local
+:class:`~agent.state_cache.StateCache`. Writes go through to Redis and are
+announced on :data:`INVALIDATION_CHANNEL` so other workers drop their copies.
+"""
 
 from __future__ import annotations
 
-import json
-import msgpack
+import asyncio
+import contextvars
+import logging
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
 import redis.asyncio as redis
+from pydantic import BaseModel
+from redis.exceptions import WatchError
+
+from config import settings
+from agent.models import (
+    Ending,
+    HistorySummary,
+    Scene,
+    StoryFrame,
+    UserChoice,
+    UserState,
+)
+from agent.state_backend import StateBackend, StateBackendBase, scene_changes
+from agent.state_cache import CacheStats, StateCache
+from agent.state_codec import (
+    decode,
+    decode_archive,
+    decode_raw,
+    decode_state,
+    encode,
+    encode_archive,
+)
+from agent.state_context import (
+    RedisStats,
+    StateChanges,
+    StepState,
+    activate,
+    current_step_state,
+    deactivate,
+)
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "llmgamehub:state-invalidations"
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def create_redis_client(redis_url: Optional[str] = None) -> redis.Redis:
+    """Create a client whose connection pool is configured from settings.
+
+    The pool blocks for up to ``redis_pool_timeout`` when all connections are
+    busy instead of failing straight away.
+    """
+    pool = redis.BlockingConnectionPool.from_url(
+        redis_url or settings.redis_url,
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+        socket_timeout=settings.redis_socket_timeout,
+        socket_connect_timeout=settings.redis_socket_connect_timeout,
+        health_check_interval=settings.redis_health_check_interval,
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+class StateConflictError(RuntimeError):
+    """Raised when a write keeps losing the race against other writers."""
+
+
+class UserRepository(StateBackendBase):
+    """Repository for storing UserState objects in Redis.
+
+    Every write increments the ``version`` field of the main hash. Writes that
+    depend on stored data watch that hash and are retried with jittered
+    backoff when another writer gets in first.
+    """
+
+    max_retries = 20
+    retry_delay = 0.002
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        cache: Optional[StateCache] = None,
+    ) -> None:
+        self.redis = create_redis_client(redis_url)
+        self.stats = RedisStats()
+        self.cache = cache
+        self.worker_id = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+        self._cache_live = False
+        self._archiving: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"llmgamehub:{{{user_id}}}"
+
+    @staticmethod
+    def _legacy_key(user_id: str) -> str:
+        """Key of the single-blob state used before the per-field layout."""
+        return f"llmgamehub:{user_id}"
+
+    def _keys(self, user_id: str) -> tuple[str, str, str]:
+        key = self._key(user_id)
+        return key, f"{key}:scenes", f"{key}:choices"
+
+    def _order_key(self, user_id: str) -> str:
+        return f"{self._key(user_id)}:scene_order"
 
-from agent.models import UserState
+    def _archive_key(self, user_id: str) -> str:
+        return f"{self._key(user_id)}:archive"
 
+    def _choice_archive_key(self, user_id: str) -> str:
+        return f"{self._key(user_id)}:choice_archive"
 
-class UserRepository:
-    """Repository for storing UserState objects in Redis."""
+    def _all_keys(self, user_id: str) -> List[str]:
+        return [
+            *self._keys(user_id),
+            self._order_key(user_id),
+            self._archive_key(user_id),
+            self._choice_archive_key(user_id),
+        ]
 
-    def __init__(self, redis_url: str = "redis://localhost") -> None:
-        self.redis = redis.from_url(redis_url)
+    def _touch(self, pipe, user_id: str) -> int:
+        """Queue expiry refreshes for all keys of a user; returns their count."""
+        ttl = settings.state_ttl_seconds
+        if ttl <= 0:
+            return 0
+        keys = self._all_keys(user_id)
+        for key in keys:
+            pipe.expire(key, ttl)
+        return len(keys)
+
+    async def _read(self, user_id: str, command: str, *args: Any) -> Any:
+        """Run one read command, refreshing the TTL in the same round trip."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            getattr(pipe, command)(*args)
+            commands = 1 + self._touch(pipe, user_id)
+            result = (await pipe.execute())[0]
+        self._track(commands)
+        return result
+
+    @staticmethod
+    def _decode_state(fields: dict, scenes: dict, choices: list) -> UserState:
+        fields = dict(fields)
+        version = int(fields.pop(b"version", 0))
+        state_dict = {k.decode(): decode_raw(v) for k, v in fields.items()}
+        state_dict["scenes"] = {k.decode(): decode_raw(v) for k, v in scenes.items()}
+        state_dict["user_choices"] = [decode_raw(c) for c in choices]
+        state_dict["version"] = version
+        return UserState.model_validate(state_dict)
+
+    def _cached(self, user_id: str, copy: bool = True) -> Optional[UserState]:
+        """Return the cached state while invalidations are being received.
+
+        With ``copy=False`` the shared cached object is returned and must not
+        be mutated.
+        """
+        if self.cache is None:
+            return None
+        self._ensure_listener()
+        return self.cache.get(user_id, copy) if self._cache_live else None
+
+    def _ensure_listener(self) -> None:
+        loop = asyncio.get_running_loop()
+        task = self._listener
+        if task is None or task.done() or task.get_loop() is not loop:
+            # Run outside the caller's context so that the listener does not
+            # hold on to the step that happened to start it.
+            self._listener = loop.create_task(
+                self._listen_invalidations(), context=contextvars.Context()
+            )
+
+    async def _listen_invalidations(self) -> None:
+        """Drop cached states that other workers have written."""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                self._cache_live = True
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    worker_id, user_id = message["data"].decode().split(" ", 1)
+                    if worker_id != self.worker_id:
+                        self.cache.invalidate(user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("State cache invalidation listener failed: %s", exc)
+            finally:
+                # Without the subscription the cache could serve stale data.
+                self._cache_live = False
+                self.cache.clear()
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    def _cache_written(
+        self, user_id: str, changes: StateChanges, version: int
+    ) -> None:
+        """Write ``changes`` through to the cached copy of the state."""
+        if self.cache is None:
+            return
+        state = UserState() if changes.replace else self.cache.peek(user_id)
+        if state is None or (not changes.replace and state.version != version - 1):
+            # Someone else wrote in between; the cached copy is stale.
+            self.cache.invalidate(user_id)
+            return
+        changes.apply_to(state)
+        state.version = version
+        self.cache.put(user_id, state)
 
     async def get(self, user_id: str) -> UserState:
         """Return user state for the given id, creating it if absent."""
-        key = f"llmgamehub:{user_id}"
-        data = await self.redis.hget(key, "data")
+        cached = self._cached(user_id)
+        if cached is not None:
+            return cached
+        key, scenes_key, choices_key = self._keys(user_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(key)
+            pipe.hgetall(scenes_key)
+            pipe.lrange(choices_key, 0, -1)
+            commands = 3 + self._touch(pipe, user_id)
+            fields, scenes, choices = (await pipe.execute())[:3]
+        self._track(commands)
+        if not fields:
+            legacy = await self._migrate_legacy(user_id)
+            if legacy is not None:
+                return legacy
+        state = self._decode_state(fields, scenes, choices)
+        if self.cache is not None and self._cache_live:
+            self.cache.put(user_id, state)
+        return state
+
+    async def _migrate_legacy(self, user_id: str) -> Optional[UserState]:
+        """Move a state stored in the old single-blob format to the new layout."""
+        legacy_key = self._legacy_key(user_id)
+        data = await self.redis.hget(legacy_key, "data")
+        self._track()
         if data is None:
-            return UserState()
-        state_dict = msgpack.unpackb(data, raw=False)
-        return UserState.parse_obj(state_dict)
+            return None
+        state = decode_state(data)
+        state.version = await self.set(user_id, state)
+        await self.redis.delete(legacy_key)
+        self._track()
+        return state
+
+    def _queue_writes(self, pipe, user_id: str, changes: StateChanges) -> int:
+        """Queue ``changes`` on a MULTI pipeline; returns the command count.
+
+        The last three results are the number of hot choices, the number of
+        hot scenes and the new version.
+        """
+        key, scenes_key, choices_key = self._keys(user_id)
+        order_key = self._order_key(user_id)
+        if changes.replace:
+            pipe.delete(
+                scenes_key,
+                choices_key,
+                order_key,
+                self._archive_key(user_id),
+                self._choice_archive_key(user_id),
+            )
+        if changes.fields:
+            pipe.hset(
+                key,
+                mapping={k: encode(v) for k, v in changes.fields.items()},
+            )
+        if changes.scenes:
+            pipe.hset(
+                scenes_key,
+                mapping={sid: encode(s) for sid, s in changes.scenes.items()},
+            )
+            now = time.time()
+            pipe.zadd(
+                order_key,
+                {sid: now + i * 1e-6 for i, sid in enumerate(changes.scenes)},
+                nx=True,
+            )
+        if changes.choices:
+            pipe.rpush(choices_key, *(encode(c) for c in changes.choices))
+        self._touch(pipe, user_id)
+        if self.cache is not None:
+            pipe.publish(INVALIDATION_CHANNEL, f"{self.worker_id} {user_id}")
+        pipe.llen(choices_key)
+        pipe.zcard(order_key)
+        pipe.hincrby(key, "version", 1)
+        return len(pipe.command_stack)
+
+    def _written(self, user_id: str, changes: StateChanges, results: list) -> int:
+        """Handle a successful write; returns the new version."""
+        choice_count, scene_count, version = results[-3:]
+        self._cache_written(user_id, changes, version)
+        if scene_count > settings.hot_scene_limit:
+            self._schedule_archive(user_id, self.archive_scenes)
+        if choice_count > settings.hot_choice_limit:
+            self._schedule_archive(user_id, self.archive_choices)
+        return version
+
+    async def _execute(self, user_id: str, changes: StateChanges) -> int:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            commands = self._queue_writes(pipe, user_id, changes)
+            results = await pipe.execute()
+        self._track(commands)
+        return self._written(user_id, changes, results)
+
+    async def _transaction(
+        self,
+        user_id: str,
+        prepare: Callable[[redis.client.Pipeline], Awaitable[Optional[StateChanges]]],
+    ) -> Optional[int]:
+        """Read-modify-write under WATCH, retrying on conflicting writes.
+
+        ``prepare`` reads what it needs through the watching pipeline and
+        returns the changes to write, or None to write nothing.
+        """
+        key = self._key(user_id)
+        for attempt in range(self.max_retries):
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(key)
+                self._track()
+                changes = await prepare(pipe)
+                if changes is None:
+                    return None
+                pipe.multi()
+                commands = self._queue_writes(pipe, user_id, changes)
+                try:
+                    results = await pipe.execute()
+                except WatchError:
+                    self._track(commands)
+                    self.stats.conflicts += 1
+                    await asyncio.sleep(
+                        random.uniform(0, self.retry_delay * 2 ** min(attempt, 6))
+                    )
+                    continue
+                self._track(commands)
+                return self._written(user_id, changes, results)
+        raise StateConflictError(
+            f"Could not update state for {user_id} after {self.max_retries} attempts"
+        )
+
+    async def set(self, user_id: str, state: UserState) -> int:
+        """Persist the whole user state, replacing whatever was stored.
+
+        Returns the new state version.
+        """
+        return await self._execute(user_id, StateChanges.full(state))
+
+    async def apply(self, user_id: str, changes: StateChanges) -> Optional[int]:
+        """Write only the given changes, atomically.
+
+        Returns the new state version, or None if there was nothing to write.
+        """
+        if not changes:
+            return None
+        _, scenes_key, _ = self._keys(user_id)
+        missing = [sid for sid in changes.scene_images if sid not in changes.scenes]
+        if not missing:
+            merged = changes.resolve_images({})
+            return None if merged is None else await self._execute(user_id, merged)
+
+        async def prepare(pipe) -> Optional[StateChanges]:
+            raw = await pipe.hmget(scenes_key, missing)
+            self._track()
+            stored = {
+                sid: decode(data, Scene)
+                for sid, data in zip(missing, raw)
+                if data is not None
+            }
+            return changes.resolve_images(stored)
+
+        return await self._transaction(user_id, prepare)
+
+    async def update(
+        self,
+        user_id: str,
+        mutate: Callable[[UserState], Optional[StateChanges]],
+    ) -> Optional[int]:
+        """Compare-and-set: derive changes from the current state and write them.
+
+        ``mutate`` may be called several times if other writers interfere.
+        Returns the new state version, or None if ``mutate`` returned nothing.
+        """
+        key, scenes_key, choices_key = self._keys(user_id)
+
+        async def prepare(pipe) -> Optional[StateChanges]:
+            fields = await pipe.hgetall(key)
+            scenes = await pipe.hgetall(scenes_key)
+            choices = await pipe.lrange(choices_key, 0, -1)
+            self._track(3)
+            state = self._decode_state(fields, scenes, choices)
+            changes = mutate(state)
+            return None if not changes else changes.resolve_images(state.scenes)
+
+        return await self._transaction(user_id, prepare)
+
+    def _schedule_archive(
+        self, user_id: str, archive: Callable[[str], Awaitable[int]]
+    ) -> None:
+        name = (user_id, archive.__name__)
+        task = self._archiving.get(name)
+        if task is not None and not task.done():
+            return
+        # Off the critical path and outside the step that triggered it.
+        task = asyncio.get_running_loop().create_task(
+            archive(user_id), context=contextvars.Context()
+        )
+        self._archiving[name] = task
+        task.add_done_callback(lambda _: self._archiving.pop(name, None))
 
-    async def set(self, user_id: str, state: UserState) -> None:
-        """Persist updated user state."""
-        key = f"llmgamehub:{user_id}"
-        packed = msgpack.packb(json.loads(state.json()))
-        await self.redis.hset(key, mapping={"data": packed})
+    async def archive_scenes(self, user_id: str, keep: Optional[int] = None) -> int:
+        """Move the oldest scenes out of the hot state.
+
+        Keeps the newest ``keep`` scenes (half of ``hot_scene_limit`` by
+        default) and the current scene. The moved scenes are appended to the
+        archive as one compressed batch. Returns how many were moved.
+        """
+        if keep is None:
+            keep = settings.hot_scene_limit // 2
+        key, scenes_key, _ = self._keys(user_id)
+        order_key = self._order_key(user_id)
+        for attempt in range(self.max_retries):
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(key)
+                oldest = await pipe.zrange(order_key, 0, -keep - 1)
+                current = await pipe.hget(key, "current_scene_id")
+                self._track(3)
+                current_id = decode_raw(current) if current else None
+                scene_ids = [s.decode() for s in oldest if s.decode() != current_id]
+                if not scene_ids:
+                    return 0
+                raw = await pipe.hmget(scenes_key, scene_ids)
+                self._track()
+                batch = [decode_raw(data) for data in raw if data is not None]
+                pipe.multi()
+                pipe.rpush(self._archive_key(user_id), encode_archive(batch))
+                pipe.hdel(scenes_key, *scene_ids)
+                pipe.zrem(order_key, *scene_ids)
+                self._touch(pipe, user_id)
+                if self.cache is not None:
+                    pipe.publish(INVALIDATION_CHANNEL, f"{self.worker_id} {user_id}")
+                pipe.hincrby(key, "version", 1)
+                commands = len(pipe.command_stack)
+                try:
+                    await pipe.execute()
+                except WatchError:
+                    self._track(commands)
+                    self.stats.conflicts += 1
+                    await asyncio.sleep(
+                        random.uniform(0, self.retry_delay * 2 ** min(attempt, 6))
+                    )
+                    continue
+                self._track(commands)
+                if self.cache is not None:
+                    self.cache.invalidate(user_id)
+                return len(scene_ids)
+        raise StateConflictError(
+            f"Could not archive scenes for {user_id} after {self.max_retries} attempts"
+        )
+
+    async def get_archived_scenes(self, user_id: str) -> List[Scene]:
+        """Return archived scenes, oldest first."""
+        batches = await self._read(user_id, "lrange", self._archive_key(user_id), 0, -1)
+        return [scene for batch in batches for scene in decode_archive(batch)]
+
+    async def archive_choices(self, user_id: str, keep: Optional[int] = None) -> int:
+        """Move the oldest summarized choices out of the hot state.
+
+        Keeps at least the newest ``keep`` choices (half of ``hot_choice_limit``
+        by default). Returns how many were moved.
+        """
+        if keep is None:
+            keep = settings.hot_choice_limit // 2
+        key, _, choices_key = self._keys(user_id)
+        for attempt in range(self.max_retries):
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(key)
+                history, archived = await pipe.hmget(
+                    key, ["history", "archived_choices"]
+                )
+                stored = await pipe.llen(choices_key)
+                self._track(3)
+                covered = decode(history, HistorySummary).covered if history else 0
+                archived = decode_raw(archived) if archived else 0
+                count = min(covered - archived, stored - keep)
+                if count <= 0:
+                    return 0
+                raw = await pipe.lrange(choices_key, 0, count - 1)
+                self._track()
+                pipe.multi()
+                pipe.rpush(
+                    self._choice_archive_key(user_id),
+                    encode_archive([decode_raw(data) for data in raw]),
+                )
+                pipe.ltrim(choices_key, count, -1)
+                pipe.hset(key, "archived_choices", encode(archived + count))
+                self._touch(pipe, user_id)
+                if self.cache is not None:
+                    pipe.publish(INVALIDATION_CHANNEL, f"{self.worker_id} {user_id}")
+                pipe.hincrby(key, "version", 1)
+                commands = len(pipe.command_stack)
+                try:
+                    await pipe.execute()
+                except WatchError:
+                    self._track(commands)
+                    self.stats.conflicts += 1
+                    await asyncio.sleep(
+                        random.uniform(0, self.retry_delay * 2 ** min(attempt, 6))
+                    )
+                    continue
+                self._track(commands)
+                if self.cache is not None:
+                    self.cache.invalidate(user_id)
+                return count
+        raise StateConflictError(
+            f"Could not archive choices for {user_id} after {self.max_retries} attempts"
+        )
+
+    async def get_archived_choices(self, user_id: str) -> List[UserChoice]:
+        """Return archived choices, oldest first."""
+        batches = await self._read(
+            user_id, "lrange", self._choice_archive_key(user_id), 0, -1
+        )
+        return [
+            choice
+            for batch in batches
+            for choice in decode_archive(batch, UserChoice)
+        ]
 
     async def reset(self, user_id: str) -> None:
-        """Remove stored state for a user."""
-        key = f"llmgamehub:{user_id}"
-        await self.redis.delete(key)
+        """Remove stored state for a user, including a legacy blob."""
+        # Otherwise the next get would migrate the legacy blob back.
+        keys = [*self._all_keys(user_id), self._legacy_key(user_id)]
+        if self.cache is None:
+            await self.redis.delete(*keys)
+            self._track()
+            return
+        self.cache.invalidate(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*keys)
+            pipe.publish(INVALIDATION_CHANNEL, f"{self.worker_id} {user_id}")
+            await pipe.execute()
+        self._track(2)
+
+    async def get_story_frame(self, user_id: str) -> Optional[StoryFrame]:
+        """Return only the story frame."""
+        if (cached := self._cached(user_id, copy=False)) is not None:
+            return _copy(cached.story_frame)
+        data = await self._read(user_id, "hget", self._key(user_id), "story_frame")
+        return None if data is None else decode(data, StoryFrame)
+
+    async def get_scene(self, user_id: str, scene_id: str) -> Optional[Scene]:
+        """Return a single scene without loading the rest of the state."""
+        if (cached := self._cached(user_id, copy=False)) is not None:
+            return _copy(cached.scenes.get(scene_id))
+        _, scenes_key, _ = self._keys(user_id)
+        data = await self._read(user_id, "hget", scenes_key, scene_id)
+        return None if data is None else decode(data, Scene)
+
+    async def get_current_scene(self, user_id: str) -> Optional[Scene]:
+        if (cached := self._cached(user_id, copy=False)) is not None:
+            return _copy(cached.scenes.get(cached.current_scene_id or ""))
+        data = await self._read(
+            user_id, "hget", self._key(user_id), "current_scene_id"
+        )
+        if data is None or (scene_id := decode_raw(data)) is None:
+            return None
+        return await self.get_scene(user_id, scene_id)
+
+    async def get_user_choices(self, user_id: str) -> list[UserChoice]:
+        if (cached := self._cached(user_id, copy=False)) is not None:
+            return [c.model_copy() for c in cached.user_choices]
+        _, _, choices_key = self._keys(user_id)
+        choices = await self._read(user_id, "lrange", choices_key, 0, -1)
+        return [decode(c, UserChoice) for c in choices]
+
+
+def _copy(model: Optional[M]) -> Optional[M]:
+    return None if model is None else model.model_copy(deep=True)
+
+
+def create_state_backend(kind: Optional[str] = None) -> StateBackend:
+    """Create the state store selected by ``settings.state_backend``."""
+    kind = kind or settings.state_backend
+    if kind == "redis":
+        return UserRepository(
+            cache=StateCache(settings.state_cache_size, settings.state_cache_ttl)
+            if settings.state_cache_enabled
+            else None
+        )
+    if kind == "memory":
+        from agent.memory_state import MemoryStateBackend
+
+        return MemoryStateBackend()
+    if kind == "sqlite":
+        from agent.sqlite_state import SQLiteStateBackend
+
+        return SQLiteStateBackend(settings.sqlite_state_path)
+    raise ValueError(f"Unknown state backend '{kind}'")
+
+
+_repo: StateBackend = create_state_backend()
+
+
+def set_state_backend(backend: StateBackend) -> None:
+    """Replace the store used by the module-level helpers."""
+    global _repo
+    _repo = backend
+
+
+def get_state_backend() -> StateBackend:
+    return _repo
+
+
+def get_redis_stats() -> RedisStats:
+    """Return the round trips and commands issued to the state store."""
+    return _repo.stats
+
+
+def get_cache_stats() -> Optional[CacheStats]:
+    """Return state cache counters, or None when the cache is disabled."""
+    cache = getattr(_repo, "cache", None)
+    return cache.stats if cache is not None else None
 
 
-_repo = UserRepository()
+@asynccontextmanager
+async def step_state(user_hash: str) -> AsyncIterator[StepState]:
+    """Share one in-memory state between everything run inside the block.
+
+    Pending changes are written when the block exits without an error.
+    """
+    step = StepState(user_hash, _repo)
+    token = activate(step)
+    try:
+        yield step
+        await step.commit()
+    finally:
+        deactivate(token)
+
+
+async def _write(user_hash: str, changes: StateChanges) -> None:
+    step = current_step_state(user_hash)
+    if step is not None:
+        await step.record(changes)
+    else:
+        await _repo.apply(user_hash, changes)
 
 
 async def get_user_state(user_hash: str) -> UserState:
+    step = current_step_state(user_hash)
+    if step is not None:
+        return await step.load()
     return await _repo.get(user_hash)
 
 
 async def set_user_state(user_hash: str, state: UserState) -> None:
+    step = current_step_state(user_hash)
+    if step is not None:
+        step.replace(state)
+        return
     await _repo.set(user_hash, state)
 
 
+async def update_user_state(
+    user_hash: str, mutate: Callable[[UserState], Optional[StateChanges]]
+) -> None:
+    """Atomically derive changes from the latest stored state and write them."""
+    step = current_step_state(user_hash)
+    if step is not None:
+        changes = mutate(await step.load())
+        if changes:
+            await step.record(changes)
+        return
+    await _repo.update(user_hash, mutate)
+
+
 async def reset_user_state(user_hash: str) -> None:
+    step = current_step_state(user_hash)
+    if step is not None:
+        step.discard()
     await _repo.reset(user_hash)
+
+
+async def get_archived_scenes(user_hash: str) -> List[Scene]:
+    """Return scenes that were moved out of the hot state, oldest first."""
+    return await _repo.get_archived_scenes(user_hash)
+
+
+async def get_archived_choices(user_hash: str) -> List[UserChoice]:
+    """Return choices that were moved out of the hot state, oldest first."""
+    return await _repo.get_archived_choices(user_hash)
+
+
+async def get_story_frame(user_hash: str) -> Optional[StoryFrame]:
+    step = current_step_state(user_hash)
+    if step is not None:
+        return (await step.load()).story_frame
+    return await _repo.get_story_frame(user_hash)
+
+
+async def set_story_frame(user_hash: str, story_frame: StoryFrame) -> None:
+    await _write(user_hash, StateChanges(fields={"story_frame": story_frame}))
+
+
+async def get_current_scene(user_hash: str) -> Optional[Scene]:
+    step = current_step_state(user_hash)
+    if step is not None:
+        state = await step.load()
+        return state.scenes.get(state.current_scene_id or "")
+    return await _repo.get_current_scene(user_hash)
+
+
+async def add_scene(user_hash: str, scene: Scene, make_current: bool = True) -> None:
+    await _write(user_hash, scene_changes(scene, make_current))
+
+
+async def update_scene_image(
+    user_hash: str, scene_id: str, image: Optional[str]
+) -> bool:
+    step = current_step_state(user_hash)
+    if step is None:
+        return await _repo.update_scene_image(user_hash, scene_id, image)
+    if scene_id not in (await step.load()).scenes:
+        return False
+    await step.record(StateChanges(scene_images={scene_id: image}))
+    return True
+
+
+async def get_user_choices(user_hash: str) -> list[UserChoice]:
+    step = current_step_state(user_hash)
+    if step is not None:
+        return list((await step.load()).user_choices)
+    return await _repo.get_user_choices(user_hash)
+
+
+async def append_user_choice(user_hash: str, choice: UserChoice) -> None:
+    await _write(user_hash, StateChanges(choices=[choice]))
+
+
+async def set_ending(user_hash: str, ending: Optional[Ending]) -> None:
+    await _write(user_hash, StateChanges(fields={"ending": ending}))
@@ -0,0 +1,275 @@
+"""Repair of malformed structured LLM outputs.
+
+A structured call whose answer fails validation, or fails a tool's own
+check such as "a scene needs two choices", is not simply sent again. The
+fixes are tried from cheapest to most expensive:
+
+1. **Salvage** the answer locally. Truncated JSON is closed, invalid list
+   items are dropped, and the result is validated again.
+2. **Complete** it with a small call on the ``repair`` route that asks only
+   for the missing or invalid fields.
+3. **Retry** the whole call, at most ``llm_repair_max_retries`` times, after
+   a jittered exponential backoff.
+
+:class:`RepairStats` counts each outcome per tool, together with the
+latency the repairs added.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from langchain_core.messages import BaseMessage
+from langchain_core.utils.json import parse_json_markdown
+from pydantic import BaseModel, ValidationError, create_model
+
+from config import settings
+from agent.llm import task_llm
+from agent.prompts import REPAIR_PROMPT
+
+logger = logging.getLogger(__name__)
+
+M = TypeVar("M", bound=BaseModel)
+
+# Returns ``(field, problem)`` when a valid answer is still not usable.
+Check = Callable[[Any], Optional[Tuple[str, str]]]
+Complete = Callable[[Type[BaseModel], str], Awaitable[BaseModel]]
+
+
+class StructuredOutputError(ValueError):
+    """Raised when no usable answer could be obtained."""
+
+
+@dataclass
+class RepairStats:
+    """Outcomes of structured calls of one tool.
+
+    ``valid`` counts answers used as they came, also after a failed stream
+    or a retry; ``retries`` counts the whole calls sent again.
+    """
+
+    calls: int = 0
+    valid: int = 0
+    salvaged: int = 0
+    completed: int = 0
+    retries: int = 0
+    failed: int = 0
+    added_seconds: float = 0.0
+
+
+_stats: Dict[str, RepairStats] = {}
+
+
+def get_repair_stats() -> Dict[str, RepairStats]:
+    return _stats
+
+
+def _answer_data(
+    schema: Type[BaseModel], answer: Any
+) -> Tuple[Optional[BaseModel], Optional[Dict]]:
+    """Split a call result into the parsed model and the raw field values.
+
+    Accepts the ``include_raw`` dict of ``with_structured_output``, a model,
+    or a plain (possibly partial) dict such as a streamed JSON answer.
+    """
+    if isinstance(answer, BaseModel):
+        return answer, answer.model_dump()
+    if not isinstance(answer, dict):
+        return None, None
+    if "raw" not in answer:
+        try:
+            return schema.model_validate(answer), answer
+        except ValidationError:
+            return None, answer
+    parsed, raw = answer.get("parsed"), answer["raw"]
+    data = parsed.model_dump() if isinstance(parsed, BaseModel) else None
+    if data is None and isinstance(raw, BaseMessage):
+        tool_calls = getattr(raw, "tool_calls", None)
+        if tool_calls:
+            data = tool_calls[0].get("args")
+        elif isinstance(raw.content, str) and raw.content.strip():
+            try:
+                data = parse_json_markdown(raw.content)
+            except ValueError:
+                data = None
+    return parsed, data if isinstance(data, dict) else None
+
+
+def salvage(
+    schema: Type[M], data: Dict, check: Optional[Check] = None
+) -> Tuple[Optional[M], Dict[str, str]]:
+    """Validate ``data`` after dropping invalid list items.
+
+    Returns the model if it is usable. Otherwise returns the fields that
+    still need fixing, each with a description of the problem.
+    """
+    data = dict(data)
+    try:
+        model = schema.model_validate(data)
+    except ValidationError as exc:
+        bad_items: Dict[str, set] = {}
+        for error in exc.errors():
+            loc = error["loc"]
+            if (
+                len(loc) >= 2
+                and isinstance(loc[1], int)
+                and isinstance(data.get(loc[0]), list)
+            ):
+                bad_items.setdefault(loc[0], set()).add(loc[1])
+        for name, indexes in bad_items.items():
+            data[name] = [v for i, v in enumerate(data[name]) if i not in indexes]
+        try:
+            model = schema.model_validate(data)
+        except ValidationError as exc:
+            return None, {
+                str(error["loc"][0]): error["msg"]
+                for error in exc.errors()
+                if error["loc"]
+            }
+    problem = check(model) if check else None
+    if problem is not None:
+        return None, {problem[0]: problem[1]}
+    return model, {}
+
+
+_repair_models: Dict[Tuple, Type[BaseModel]] = {}
+
+
+def _repair_model(schema: Type[BaseModel], fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """Model with only ``fields`` of ``schema``, cached so its tool schema is reused."""
+    key = (schema, fields)
+    model = _repair_models.get(key)
+    if model is None:
+        model = _repair_models[key] = create_model(
+            f"{schema.__name__}Fields",
+            **{name: (schema.model_fields[name].annotation, ...) for name in fields},
+        )
+    return model
+
+
+async def _complete_with_llm(model: Type[BaseModel], prompt: str) -> BaseModel:
+    return await task_llm("repair", model, temperature=0.1).ainvoke(prompt)
+
+
+async def complete(
+    schema: Type[M],
+    data: Dict,
+    problems: Dict[str, str],
+    check: Optional[Check] = None,
+    complete_fields: Complete = _complete_with_llm,
+) -> Optional[M]:
+    """Ask for just the fields in ``problems`` and merge them into ``data``."""
+    fields = tuple(sorted(name for name in problems if name in schema.model_fields))
+    if not fields:
+        return None
+    partial = {k: v for k, v in data.items() if k not in fields}
+    prompt = REPAIR_PROMPT.format(
+        schema=schema.__name__,
+        partial=json.dumps(partial, ensure_ascii=False, default=str),
+        fields="\n".join(f"- {name}: {problems[name]}" for name in fields),
+    )
+    answer = await complete_fields(_repair_model(schema, fields), prompt)
+    if answer is None:
+        return None
+    model, _ = salvage(schema, {**data, **answer.model_dump()}, check)
+    return model
+
+
+async def repair_structured(
+    tool: str,
+    schema: Type[M],
+    call: Callable[[], Awaitable[Any]],
+    check: Optional[Check] = None,
+    first: Optional[Callable[[], Awaitable[Any]]] = None,
+    complete_fields: Complete = _complete_with_llm,
+) -> M:
+    """Run ``call`` and repair its answer until it is valid and passes ``check``.
+
+    ``first`` is an optional extra first attempt, for example a streamed
+    answer; it may return None to hand over to ``call``. If every attempt
+    fails, the last answer that validated is returned even if it fails
+    ``check``. Without one, :class:`StructuredOutputError` is raised.
+    """
+    stats = _stats.setdefault(tool, RepairStats())
+    stats.calls += 1
+    fallback: Optional[M] = None
+    error: Optional[BaseException] = None
+    first_done: Optional[float] = None
+    attempts = [first] if first else []
+    attempts += [call] * (settings.llm_repair_max_retries + 1)
+    try:
+        for attempt, make in enumerate(attempts):
+            retry = attempt - len(attempts) + settings.llm_repair_max_retries + 1
+            if retry > 0:
+                stats.retries += 1
+                delay = min(
+                    settings.llm_repair_max_backoff,
+                    settings.llm_repair_backoff * 2 ** (retry - 1),
+                )
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            try:
+                answer = await make()
+            except ValueError as exc:
+                error, answer = exc, None
+            finally:
+                first_done = first_done or time.monotonic()
+            parsed, data = _answer_data(schema, answer)
+            if isinstance(parsed, schema):
+                fallback = parsed
+                if check is None or check(parsed) is None:
+                    stats.valid += 1
+                    return parsed
+            if data is None:
+                continue
+
+            model, problems = salvage(schema, data, check)
+            if model is not None:
+                stats.salvaged += 1
+                logger.info("[Repair] Salvaged %s output locally", tool)
+                return model
+            model = await complete(schema, data, problems, check, complete_fields)
+            if model is not None:
+                stats.completed += 1
+                logger.info("[Repair] Completed %s fields %s", tool, sorted(problems))
+                return model
+            logger.warning("[Repair] Could not repair %s output: %s", tool, problems)
+
+        stats.failed += 1
+        if fallback is not None:
+            return fallback
+        raise StructuredOutputError(f"No valid {schema.__name__} from {tool}") from error
+    finally:
+        if first_done is not None:
+            stats.added_seconds += time.monotonic() - first_done
+
+
+async def structured_call(
+    tool: str,
+    task: str,
+    schema: Type[M],
+    prompt: Any,
+    *,
+    temperature: Optional[float] = None,
+    check: Optional[Check] = None,
+    first: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> M:
+    """Structured call on the ``task`` route with repair, see :func:`repair_structured`."""
+    llm = task_llm(task, schema, temperature=temperature, include_raw=True)
+    return await repair_structured(
+        tool, schema, lambda: llm.ainvoke(prompt), check, first
+    )
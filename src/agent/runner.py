@@ -1,16 +1,28 @@
 """Entry point for executing a graph step."""
 
+import asyncio
 import logging
+import time
 from dataclasses import asdict
-from typing import Dict, Optional
+from typing import AsyncIterator, Dict, List, Optional
 import uuid
 
+from agent.history import schedule_summary
 from agent.image_agent import generate_image_prompt
+from agent.image_delivery import (
+    ImageJob,
+    defer_images,
+    record_text,
+    start_image_jobs,
+)
 from agent.tools import generate_scene_image
 
 from agent.llm_graph import GraphState, llm_game_graph
-from agent.models import UserState
-from agent.redis_state import get_user_state
+from agent.narration import Narration, narrate
+from agent.redis_state import get_current_scene, get_story_frame, step_state
+from agent.speculation import speculator
+from audio.audio_generator import change_music_tone
+from config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -23,8 +35,14 @@ async def process_step(
     genre: Optional[str] = None,
     choice_text: Optional[str] = None,
 ) -> Dict:
-    """Run one interaction step through the graph."""
+    """Run one interaction step through the graph.
+
+    With ``deferred_scene_images`` the response comes back without the new
+    scene's image. The image is generated once the step is committed, see
+    :mod:`agent.image_delivery`.
+    """
     logger.info("[Runner] Step %s for user %s", step, user_hash)
+    started = time.monotonic()
 
     graph_state = GraphState(user_hash=user_hash, step=step)
     if step == "start":
@@ -36,19 +54,108 @@ async def process_step(
         assert choice_text, "choice_text is required"
         graph_state.choice_text = choice_text
 
+    images: List[ImageJob] = []
+    async with step_state(user_hash) as user_step:
+        response = None
+        if step == "choose":
+            response = await speculator.claim(user_step, choice_text)
+            if response is not None and not response["game_over"]:
+                await change_music_tone(user_hash, response["scene"].get("music"))
+        if response is None:
+            speculator.cancel(user_hash)
+            if settings.deferred_scene_images:
+                with defer_images() as images:
+                    response = await _run_graph(user_hash, graph_state)
+            else:
+                response = await _run_graph(user_hash, graph_state)
+    writes = start_image_jobs(user_hash, images, started)
+    summary = schedule_summary(user_hash, await user_step.load())
+    if summary is not None:
+        writes.append(summary)
+    if settings.pregenerate_next_scene and not response["game_over"]:
+        if not writes:
+            _pregenerate(user_hash, response["scene"])
+        else:
+            # Branches started now would go stale when these writes land.
+            asyncio.create_task(
+                _pregenerate_after(writes, user_hash, response["scene"])
+            )
+    logger.info(
+        "[Runner] Step %s for user %s: text after %.2fs, %d Redis round trips "
+        "(%d commands)",
+        step,
+        user_hash,
+        record_text(started),
+        user_step.stats.round_trips,
+        user_step.stats.commands,
+    )
+    return response
+
+
+async def stream_step(user_hash: str, step: str, **kwargs) -> AsyncIterator[Dict]:
+    """Run :func:`process_step`, yielding the scene text while it is written.
+
+    Yields ``{"text": ...}`` each time the description grows and finally
+    ``{"response": ...}`` with the full step response.
+    """
+    with narrate(Narration()) as narration:
+        task = asyncio.create_task(process_step(user_hash, step, **kwargs))
+    try:
+        while not task.done():
+            text = asyncio.create_task(narration.wait())
+            await asyncio.wait({task, text}, return_when=asyncio.FIRST_COMPLETED)
+            if text.done():
+                yield {"text": text.result()}
+            else:
+                text.cancel()
+        response = task.result()
+    finally:
+        task.cancel()
+    total = time.monotonic() - narration.started
+    first_text = narration.time_to_first_text
+    logger.info(
+        "[Runner] Step %s for user %s: first text after %.2fs, done after %.2fs",
+        step,
+        user_hash,
+        total if first_text is None else first_text,
+        total,
+    )
+    yield {"response": response}
+
+
+def _pregenerate(user_hash: str, scene: Dict) -> None:
+    """Play out every listed choice of ``scene`` in the background."""
+
+    async def run(choice_text: str) -> Dict:
+        graph_state = GraphState(
+            user_hash=user_hash, step="choose", choice_text=choice_text
+        )
+        return await _run_graph(user_hash, graph_state)
+
+    choices = [choice["text"] for choice in scene.get("choices", [])]
+    speculator.schedule(user_hash, choices, run)
+
+
+async def _pregenerate_after(
+    writes: List[asyncio.Task], user_hash: str, scene: Dict
+) -> None:
+    await asyncio.wait(writes)
+    current = await get_current_scene(user_hash)
+    if current is not None and current.scene_id == scene.get("scene_id"):
+        _pregenerate(user_hash, scene)
+
+
+async def _run_graph(user_hash: str, graph_state: GraphState) -> Dict:
     final_state = await llm_game_graph.ainvoke(asdict(graph_state))
 
-    user_state: UserState = await get_user_state(user_hash)
     response: Dict = {}
 
     ending = final_state.get("ending")
     if ending and ending.get("ending_reached"):
         ending_info = ending["ending"]
-        if (
-            ("description" not in ending_info or not ending_info["description"])
-            and user_state.story_frame
-        ):
-            for e in user_state.story_frame.endings:
+        if not ending_info.get("description"):
+            story_frame = await get_story_frame(user_hash)
+            for e in story_frame.endings if story_frame else []:
                 if e.id == ending_info.get("id"):
                     ending_info["description"] = e.description
                     break
@@ -78,16 +185,10 @@ async def process_step(
         response["image"] = image_path
         response["game_over"] = True
     else:
-        if (
-            user_state.current_scene_id
-            and user_state.current_scene_id in user_state.scenes
-        ):
-            current_scene = user_state.scenes[
-                user_state.current_scene_id
-            ].dict()
-        else:
-            current_scene = final_state.get("scene")
-        response["scene"] = current_scene
+        current_scene = await get_current_scene(user_hash)
+        response["scene"] = (
+            current_scene.dict() if current_scene else final_state.get("scene")
+        )
         response["game_over"] = False
 
     return response
@@ -0,0 +1,173 @@
+"""Local decision on whether the scene picture has to change.
+
+The image agent is a light LLM call with a long system prompt, made on every
+step just to choose between ``no_change``, ``modify`` and
+``change_completely``. Most steps are obvious: the player looks around the
+same room, or walks through a door into a new place. :func:`classify`
+recognises those cases from the previous and the new scene description:
+
+* the similarity of hashed bag-of-words and character-trigram vectors;
+* location nouns, and movement verbs in the scene or in the chosen option.
+
+The word lists are English. Scenes that do not read as English, judged by
+the share of common English words in them, are not classified at all. It
+also returns ``None`` for everything in between, and those cases still go
+to the LLM. The classifier never answers ``modify``, because what has to be
+redrawn is up to the LLM. :class:`SceneChangeStats` counts how often the LLM
+was skipped.
+"""
+
+from __future__ import annotations
+
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+import numpy as np
+
+from config import settings
+
+DIMENSIONS = 1024
+
+LOCATIONS = frozenset(
+    """
+    alley apartment arch arena attic balcony bank bar barracks basement beach
+    bedroom bridge cabin camp canyon castle cathedral cave cavern cell cellar
+    chamber chapel church city cliff club corridor courtyard crypt deck desert
+    dock dungeon facility factory farm field forest fortress garden gate
+    graveyard hall hallway harbor hangar hill house hut island jungle kitchen
+    laboratory lake library lighthouse market marsh meadow mill mine monastery
+    mountain museum oasis office palace park pier platform plaza pond port
+    prison ravine river road roof rooftop room ruins school sewer shore shop
+    square stable stables station street swamp tavern temple tent tower town
+    tunnel valley vault village wall warehouse woods yard
+    """.split()
+)
+
+# Verbs of moving somewhere else, in the scene or in the chosen option.
+MOVEMENT = re.compile(
+    r"\b(arrive|arrives|arrived|ascend|ascends|burst|bursts|climb|climbs|"
+    r"climbed|descend|descends|descended|emerge|emerges|emerged|enter|enters|"
+    r"entered|escape|escapes|get off|go into|go to|head to|inside|leave|leaves|"
+    r"reach|reaches|reached|run into|step into|step out|surface|travel|"
+    r"walk into|walk out|slip into)\b"
+)
+
+# Frequent English words; the descriptions of English scenes are full of them.
+COMMON_WORDS = frozenset(
+    """
+    a an and are as at be but by for from he her his i in into is it its me
+    my of on or she the their them there they this to was were with you your
+    """.split()
+)
+ENGLISH_SHARE = 0.15
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class SceneChangeStats:
+    """How image decisions were made."""
+
+    no_change: int = 0
+    change_completely: int = 0
+    llm: int = 0
+
+    @property
+    def skip_rate(self) -> float:
+        local = self.no_change + self.change_completely
+        total = local + self.llm
+        return local / total if total else 0.0
+
+
+_stats = SceneChangeStats()
+
+
+def get_scene_change_stats() -> SceneChangeStats:
+    return _stats
+
+
+def _bucket(feature: str) -> int:
+    # crc32 instead of hash() so vectors are stable across processes.
+    return zlib.crc32(feature.encode()) % DIMENSIONS
+
+
+def embed(text: str) -> np.ndarray:
+    """Unit-length hashed vector of the words and word trigrams of ``text``."""
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for word in _WORD.findall(text.lower()):
+        if len(word) < 3:
+            continue
+        vector[_bucket(word)] += 1.0
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            vector[_bucket(padded[i : i + 3])] += 0.5
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def similarity(first: str, second: str) -> float:
+    return float(embed(first) @ embed(second))
+
+
+def is_english(text: str) -> bool:
+    """Whether ``text`` reads as English, so the word lists apply to it."""
+    words = _WORD.findall(text.lower())
+    if not words:
+        return False
+    return sum(word in COMMON_WORDS for word in words) >= ENGLISH_SHARE * len(words)
+
+
+def locations(text: str) -> Set[str]:
+    return {word for word in _WORD.findall(text.lower()) if word in LOCATIONS}
+
+
+@dataclass
+class SceneChange:
+    """Local decision with the evidence it was based on."""
+
+    decision: Optional[str]
+    similarity: float
+    moved: bool
+    new_locations: Set[str]
+    english: bool = True
+
+
+def classify(previous: str, current: str, choice: Optional[str] = None) -> SceneChange:
+    """Decide ``no_change`` or ``change_completely`` locally, or ``None``."""
+    score = similarity(previous, current)
+    if not (is_english(previous) and is_english(current)):
+        return SceneChange(None, score, False, set(), english=False)
+    moved = bool(MOVEMENT.search(current.lower())) or bool(
+        choice and MOVEMENT.search(choice.lower())
+    )
+    before, after = locations(previous), locations(current)
+    new = after - before
+    decision = None
+    if not moved and not new and score >= settings.scene_change_same_similarity:
+        decision = "no_change"
+    elif moved and new and score <= settings.scene_change_new_similarity:
+        decision = "change_completely"
+    return SceneChange(decision, score, moved, new)
+
+
+def agreement(records) -> Dict[str, float]:
+    """Skip rate and agreement with recorded LLM decisions.
+
+    ``records`` holds dicts with ``previous``, ``current``, the optional
+    ``choice`` and the ``decision`` of the LLM.
+    """
+    total = skipped = agreed = 0
+    for record in records:
+        total += 1
+        local = classify(record["previous"], record["current"], record.get("choice"))
+        if local.decision is None:
+            continue
+        skipped += 1
+        agreed += local.decision == record["decision"]
+    return {
+        "records": total,
+        "skip_rate": skipped / total if total else 0.0,
+        "agreement": agreed / skipped if skipped else 1.0,
+    }
@@ -0,0 +1,258 @@
+"""Speculative pregeneration of the next scene.
+
+While the player reads a scene, every listed choice is played out in the
+background: ending check, scene text, image prompt and image. Each branch
+runs inside its own :class:`~agent.state_context.StepState` that is never
+committed, so nothing it does reaches the store. When the player picks a
+prepared choice, :meth:`Speculator.claim` replays the branch's pending
+changes into the real step, references the branch's images in the asset
+store and hands back its response. The other branches are cancelled.
+Free-text choices, stale branches and failed branches fall back to the
+normal path.
+
+Enabled with ``pregenerate_next_scene``. Branches per scene, running branches
+across all users and time per branch are capped by the ``pregenerate_*``
+settings.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import datetime
+import logging
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import settings
+from agent.models import UserState
+from agent.redis_state import get_state_backend
+from agent.state_context import StateChanges, StepState, activate, deactivate
+from images.asset_store import get_asset_store
+
+logger = logging.getLogger(__name__)
+
+BranchResult = Tuple[Dict, StateChanges, Tuple]
+
+_speculating: ContextVar[bool] = ContextVar("speculating", default=False)
+
+
+def speculating() -> bool:
+    """Whether the current task is playing out a speculative branch.
+
+    Side effects that cannot be undone, such as changing the music, must be
+    skipped while speculating.
+    """
+    return _speculating.get()
+
+
+@dataclass
+class SpeculationStats:
+    """How often prepared branches were used."""
+
+    scheduled: int = 0
+    skipped: int = 0
+    hits: int = 0
+    misses: int = 0
+    stale: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    wait_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        claims = self.hits + self.misses + self.stale + self.failed
+        return self.hits / claims if claims else 0.0
+
+
+@dataclass
+class _Branch:
+    choice_text: str
+    task: "asyncio.Task[BranchResult]"
+    started: float = field(default_factory=time.monotonic)
+
+
+class Speculator:
+    """Runs and hands out speculative branches per user."""
+
+    def __init__(
+        self,
+        max_branches: Optional[int] = None,
+        max_concurrent: Optional[int] = None,
+        timeout: Optional[float] = None,
+        result_ttl: Optional[float] = None,
+    ) -> None:
+        self.max_branches = (
+            settings.pregenerate_max_branches if max_branches is None else max_branches
+        )
+        self.max_concurrent = (
+            settings.pregenerate_max_concurrent
+            if max_concurrent is None
+            else max_concurrent
+        )
+        self.timeout = settings.pregenerate_timeout if timeout is None else timeout
+        self.result_ttl = (
+            settings.pregenerate_result_ttl if result_ttl is None else result_ttl
+        )
+        self.stats = SpeculationStats()
+        self._branches: Dict[str, Dict[str, _Branch]] = {}
+
+    def running(self) -> int:
+        return sum(
+            not branch.task.done()
+            for branches in self._branches.values()
+            for branch in branches.values()
+        )
+
+    def schedule(
+        self,
+        user_hash: str,
+        choices: List[str],
+        run: Callable[[str], Awaitable[Dict]],
+    ) -> int:
+        """Start a branch per choice; returns how many were started.
+
+        ``run(choice_text)`` plays out one step and returns its response.
+        Branches left over from an earlier scene are cancelled first.
+        """
+        self.cancel(user_hash)
+        self.prune()
+        branches: Dict[str, _Branch] = {}
+        for choice_text in dict.fromkeys(choices):
+            if len(branches) >= self.max_branches or (
+                self.running() >= self.max_concurrent
+            ):
+                self.stats.skipped += 1
+                continue
+            # A fresh context: the branch must not see the step that spawned it.
+            task = asyncio.get_running_loop().create_task(
+                self._run(user_hash, choice_text, run), context=contextvars.Context()
+            )
+            task.add_done_callback(_log_failure)
+            branches[choice_text] = _Branch(choice_text, task)
+            self.stats.scheduled += 1
+        if branches:
+            self._branches[user_hash] = branches
+        return len(branches)
+
+    def prune(self) -> None:
+        """Forget prepared branches the player has not come back for."""
+        cutoff = time.monotonic() - self.result_ttl
+        for user_hash, branches in list(self._branches.items()):
+            if all(b.started < cutoff for b in branches.values()):
+                self.cancel(user_hash)
+
+    async def _run(
+        self,
+        user_hash: str,
+        choice_text: str,
+        run: Callable[[str], Awaitable[Dict]],
+    ) -> BranchResult:
+        step = StepState(user_hash, get_state_backend())
+        token = activate(step)
+        _speculating.set(True)
+        try:
+            base = _basis(await step.load())
+            async with asyncio.timeout(self.timeout):
+                response = await run(choice_text)
+            return response, step.pending, base
+        finally:
+            deactivate(token)
+
+    def cancel(self, user_hash: str) -> None:
+        """Cancel and forget all branches of a user."""
+        for branch in self._branches.pop(user_hash, {}).values():
+            if not branch.task.done():
+                branch.task.cancel()
+                self.stats.cancelled += 1
+
+    async def claim(self, step: StepState, choice_text: str) -> Optional[Dict]:
+        """Use the branch prepared for ``choice_text``, if there is one.
+
+        On a hit the branch's changes are recorded in ``step`` and its
+        response is returned; the branch is awaited if it is still running.
+        Returns None when the caller has to run the step itself.
+        """
+        branches = self._branches.pop(step.user_hash, None)
+        if branches is None:
+            return None
+        branch = branches.pop(choice_text, None)
+        for other in branches.values():
+            if not other.task.done():
+                other.task.cancel()
+                self.stats.cancelled += 1
+        if branch is None:
+            self.stats.misses += 1
+            logger.info("[Speculation] Miss for user %s", step.user_hash)
+            return None
+
+        waited = time.monotonic()
+        await asyncio.wait({branch.task})
+        waited = time.monotonic() - waited
+        if branch.task.cancelled() or branch.task.exception() is not None:
+            self.stats.failed += 1
+            return None
+        response, changes, base = branch.task.result()
+        state = await step.load()
+        if _basis(state) != base:
+            self.stats.stale += 1
+            logger.info("[Speculation] Stale branch for user %s", step.user_hash)
+            return None
+
+        refs = _new_assets(state.assets, changes)
+        # The choice is made now, not when the branch was played out.
+        now = datetime.datetime.utcnow().isoformat()
+        for choice in changes.choices:
+            choice.timestamp = now
+        await step.record(changes)
+        # Branches reference their images only in their own state.
+        await get_asset_store().add_refs(step.user_hash, refs)
+        self.stats.hits += 1
+        self.stats.wait_seconds += waited
+        logger.info(
+            "[Speculation] Hit for user %s, waited %.2fs (hit rate %.0f%%)",
+            step.user_hash,
+            waited,
+            self.stats.hit_rate * 100,
+        )
+        return response
+
+
+def _basis(state: UserState) -> Tuple:
+    """The parts of a state a branch builds on.
+
+    The version is not used: archiving old scenes and choices bumps it
+    without changing what the player sees.
+    """
+    return (
+        state.current_scene_id,
+        state.choice_count,
+        state.story_frame,
+        state.ending,
+        sorted(state.milestones_achieved),
+        state.assets,
+    )
+
+
+def _new_assets(known: Dict[str, str], changes: StateChanges) -> Dict[str, str]:
+    """Image references set by ``changes`` that are not in ``known`` yet."""
+    assets = changes.fields.get("assets") or {}
+    return {
+        scene_id: digest
+        for scene_id, digest in assets.items()
+        if known.get(scene_id) != digest
+    }
+
+
+def _log_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("[Speculation] Branch failed: %r", task.exception())
+
+
+speculator = Speculator()
+
+
+def get_speculation_stats() -> SpeculationStats:
+    return speculator.stats
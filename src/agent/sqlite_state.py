@@ -0,0 +1,496 @@
+"""SQLite-backed user state storage for single-node deployments.
+
+The layout mirrors the Redis store: one row per stored field, scene and
+choice, so a step only writes what it changed. Values use the same msgpack
+codec. The database runs in WAL mode and every call is executed on a single
+worker thread, which keeps the event loop free and serialises writes within
+the process; ``BEGIN IMMEDIATE`` serialises them across processes.
+
+Idle users expire after ``state_ttl_seconds``, and scenes beyond
+``hot_scene_limit`` and summarized choices beyond ``hot_choice_limit`` are
+moved to a compressed archive, as in the other stores.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from config import settings
+from agent.models import Scene, StoryFrame, UserChoice, UserState
+from agent.state_backend import StateBackendBase
+from agent.state_codec import (
+    decode,
+    decode_archive,
+    decode_raw,
+    encode,
+    encode_archive,
+)
+from agent.state_context import RedisStats, StateChanges
+
+T = TypeVar("T")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    accessed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fields (
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    user_id TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (user_id, scene_id)
+);
+CREATE TABLE IF NOT EXISTS choices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS choices_user ON choices (user_id, id);
+CREATE TABLE IF NOT EXISTS archive (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS archive_user ON archive (user_id, id);
+CREATE TABLE IF NOT EXISTS choice_archive (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS choice_archive_user ON choice_archive (user_id, id);
+"""
+
+_USER_TABLES = ("fields", "scenes", "choices", "archive", "choice_archive", "users")
+
+
+class SQLiteStateBackend(StateBackendBase):
+    """Stores user states in a local SQLite database."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.stats = RedisStats()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sqlite-state"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run ``fn(conn, *args)`` on the database thread."""
+        self._track()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: fn(self._connect(), *args)
+        )
+
+    @contextmanager
+    def _transaction(self, conn: sqlite3.Connection) -> Iterator[None]:
+        # Every call at least refreshes the access time, so all transactions
+        # take the write lock up front instead of upgrading halfway.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _touch(conn: sqlite3.Connection, user_id: str) -> bool:
+        """Refresh the user's access time, purging the user if it expired.
+
+        Returns whether the user has any stored state.
+        """
+        now = time.time()
+        row = conn.execute(
+            "SELECT accessed_at FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        ttl = settings.state_ttl_seconds
+        if ttl > 0 and now - row[0] > ttl:
+            for table in _USER_TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            return False
+        conn.execute(
+            "UPDATE users SET accessed_at = ? WHERE user_id = ?", (now, user_id)
+        )
+        return True
+
+    @staticmethod
+    def _load(conn: sqlite3.Connection, user_id: str) -> UserState:
+        data: Dict[str, Any] = {
+            name: decode_raw(value)
+            for name, value in conn.execute(
+                "SELECT name, value FROM fields WHERE user_id = ?", (user_id,)
+            )
+        }
+        data["scenes"] = {
+            scene_id: decode_raw(value)
+            for scene_id, value in conn.execute(
+                "SELECT scene_id, data FROM scenes WHERE user_id = ? ORDER BY seq",
+                (user_id,),
+            )
+        }
+        data["user_choices"] = [
+            decode_raw(value)
+            for (value,) in conn.execute(
+                "SELECT data FROM choices WHERE user_id = ? ORDER BY id", (user_id,)
+            )
+        ]
+        row = conn.execute(
+            "SELECT version FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        data["version"] = row[0] if row else 0
+        return UserState.model_validate(data)
+
+    def _get(self, conn: sqlite3.Connection, user_id: str) -> UserState:
+        with self._transaction(conn):
+            if not self._touch(conn, user_id):
+                return UserState()
+            return self._load(conn, user_id)
+
+    def _write(
+        self, conn: sqlite3.Connection, user_id: str, changes: StateChanges
+    ) -> int:
+        """Write resolved ``changes`` inside an open transaction."""
+        conn.execute(
+            "INSERT INTO users (user_id, accessed_at) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO NOTHING",
+            (user_id, time.time()),
+        )
+        if changes.replace:
+            for table in ("fields", "scenes", "choices", "archive", "choice_archive"):
+                conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO fields (user_id, name, value) VALUES (?, ?, ?)",
+            [(user_id, name, encode(value)) for name, value in changes.fields.items()],
+        )
+        seq = time.time_ns()
+        conn.executemany(
+            "INSERT INTO scenes (user_id, scene_id, seq, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (user_id, scene_id) DO UPDATE SET data = excluded.data",
+            [
+                (user_id, scene_id, seq + i, encode(scene))
+                for i, (scene_id, scene) in enumerate(changes.scenes.items())
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO choices (user_id, data) VALUES (?, ?)",
+            [(user_id, encode(choice)) for choice in changes.choices],
+        )
+        (scene_count,) = conn.execute(
+            "SELECT COUNT(*) FROM scenes WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if scene_count > settings.hot_scene_limit:
+            self._archive(conn, user_id, settings.hot_scene_limit // 2)
+        (choice_count,) = conn.execute(
+            "SELECT COUNT(*) FROM choices WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if choice_count > settings.hot_choice_limit:
+            self._archive_choices(conn, user_id, settings.hot_choice_limit // 2)
+        return self._bump(conn, user_id)
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection, user_id: str) -> int:
+        conn.execute(
+            "UPDATE users SET version = version + 1, accessed_at = ? "
+            "WHERE user_id = ?",
+            (time.time(), user_id),
+        )
+        (version,) = conn.execute(
+            "SELECT version FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return version
+
+    @staticmethod
+    def _archive(conn: sqlite3.Connection, user_id: str, keep: int) -> int:
+        row = conn.execute(
+            "SELECT value FROM fields WHERE user_id = ? AND name = 'current_scene_id'",
+            (user_id,),
+        ).fetchone()
+        current_id = decode_raw(row[0]) if row else None
+        rows = conn.execute(
+            "SELECT scene_id, data FROM scenes WHERE user_id = ? "
+            "ORDER BY seq DESC LIMIT -1 OFFSET ?",
+            (user_id, keep),
+        ).fetchall()
+        rows = [(sid, data) for sid, data in reversed(rows) if sid != current_id]
+        if not rows:
+            return 0
+        conn.execute(
+            "INSERT INTO archive (user_id, data) VALUES (?, ?)",
+            (user_id, encode_archive([decode_raw(data) for _, data in rows])),
+        )
+        conn.executemany(
+            "DELETE FROM scenes WHERE user_id = ? AND scene_id = ?",
+            [(user_id, sid) for sid, _ in rows],
+        )
+        return len(rows)
+
+    @staticmethod
+    def _field_value(conn: sqlite3.Connection, user_id: str, name: str) -> Any:
+        row = conn.execute(
+            "SELECT value FROM fields WHERE user_id = ? AND name = ?",
+            (user_id, name),
+        ).fetchone()
+        return None if row is None else decode_raw(row[0])
+
+    def _archive_choices(
+        self, conn: sqlite3.Connection, user_id: str, keep: int
+    ) -> int:
+        history = self._field_value(conn, user_id, "history") or {}
+        archived = self._field_value(conn, user_id, "archived_choices") or 0
+        (stored,) = conn.execute(
+            "SELECT COUNT(*) FROM choices WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        count = min(history.get("covered", 0) - archived, stored - keep)
+        if count <= 0:
+            return 0
+        rows = conn.execute(
+            "SELECT id, data FROM choices WHERE user_id = ? ORDER BY id LIMIT ?",
+            (user_id, count),
+        ).fetchall()
+        conn.execute(
+            "INSERT INTO choice_archive (user_id, data) VALUES (?, ?)",
+            (user_id, encode_archive([decode_raw(data) for _, data in rows])),
+        )
+        conn.execute(
+            "DELETE FROM choices WHERE user_id = ? AND id <= ?", (user_id, rows[-1][0])
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO fields (user_id, name, value) VALUES (?, ?, ?)",
+            (user_id, "archived_choices", encode(archived + count)),
+        )
+        return count
+
+    def _apply(
+        self, conn: sqlite3.Connection, user_id: str, changes: StateChanges
+    ) -> Optional[int]:
+        with self._transaction(conn):
+            self._touch(conn, user_id)
+            missing = [
+                sid for sid in changes.scene_images if sid not in changes.scenes
+            ]
+            stored = {}
+            for sid in missing:
+                scene = self._scene(conn, user_id, sid)
+                if scene is not None:
+                    stored[sid] = scene
+            resolved = changes.resolve_images(stored)
+            return None if resolved is None else self._write(conn, user_id, resolved)
+
+    def _update(
+        self,
+        conn: sqlite3.Connection,
+        user_id: str,
+        mutate: Callable[[UserState], Optional[StateChanges]],
+    ) -> Optional[int]:
+        with self._transaction(conn):
+            self._touch(conn, user_id)
+            state = self._load(conn, user_id)
+            changes = mutate(state)
+            if not changes:
+                return None
+            resolved = changes.resolve_images(state.scenes)
+            return None if resolved is None else self._write(conn, user_id, resolved)
+
+    @staticmethod
+    def _scene(
+        conn: sqlite3.Connection, user_id: str, scene_id: str
+    ) -> Optional[Scene]:
+        row = conn.execute(
+            "SELECT data FROM scenes WHERE user_id = ? AND scene_id = ?",
+            (user_id, scene_id),
+        ).fetchone()
+        return None if row is None else decode(row[0], Scene)
+
+    def _read(
+        self,
+        conn: sqlite3.Connection,
+        user_id: str,
+        read: Callable[[sqlite3.Connection], T],
+        default: T,
+    ) -> T:
+        with self._transaction(conn):
+            return read(conn) if self._touch(conn, user_id) else default
+
+    async def get(self, user_id: str) -> UserState:
+        return await self._run(self._get, user_id)
+
+    async def set(self, user_id: str, state: UserState) -> int:
+        """Replace the stored state; returns the new version."""
+        return await self._run(self._apply, user_id, StateChanges.full(state))
+
+    async def apply(self, user_id: str, changes: StateChanges) -> Optional[int]:
+        """Write only the given changes; returns the new version or None."""
+        if not changes:
+            return None
+        return await self._run(self._apply, user_id, changes)
+
+    async def update(
+        self,
+        user_id: str,
+        mutate: Callable[[UserState], Optional[StateChanges]],
+    ) -> Optional[int]:
+        """Derive changes from the current state and write them atomically."""
+        return await self._run(self._update, user_id, mutate)
+
+    async def reset(self, user_id: str) -> None:
+        def reset(conn: sqlite3.Connection) -> None:
+            with self._transaction(conn):
+                for table in _USER_TABLES:
+                    conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+
+        await self._run(reset)
+
+    async def archive_scenes(self, user_id: str, keep: Optional[int] = None) -> int:
+        """Move the oldest scenes, except the current one, to the archive."""
+        if keep is None:
+            keep = settings.hot_scene_limit // 2
+
+        def archive(conn: sqlite3.Connection) -> int:
+            moved = self._archive(conn, user_id, keep)
+            if moved:
+                self._bump(conn, user_id)
+            return moved
+
+        return await self._run(self._read, user_id, archive, 0)
+
+    async def get_archived_scenes(self, user_id: str) -> List[Scene]:
+        def read(conn: sqlite3.Connection) -> List[Scene]:
+            rows = conn.execute(
+                "SELECT data FROM archive WHERE user_id = ? ORDER BY id", (user_id,)
+            )
+            return [scene for (data,) in rows for scene in decode_archive(data)]
+
+        return await self._run(self._read, user_id, read, [])
+
+    async def archive_choices(self, user_id: str, keep: Optional[int] = None) -> int:
+        """Move the oldest summarized choices to the archive."""
+        if keep is None:
+            keep = settings.hot_choice_limit // 2
+
+        def archive(conn: sqlite3.Connection) -> int:
+            moved = self._archive_choices(conn, user_id, keep)
+            if moved:
+                self._bump(conn, user_id)
+            return moved
+
+        return await self._run(self._read, user_id, archive, 0)
+
+    async def get_archived_choices(self, user_id: str) -> List[UserChoice]:
+        def read(conn: sqlite3.Connection) -> List[UserChoice]:
+            rows = conn.execute(
+                "SELECT data FROM choice_archive WHERE user_id = ? ORDER BY id",
+                (user_id,),
+            )
+            return [
+                choice
+                for (data,) in rows
+                for choice in decode_archive(data, UserChoice)
+            ]
+
+        return await self._run(self._read, user_id, read, [])
+
+    async def _field(self, user_id: str, name: str) -> Any:
+        return await self._run(
+            self._read,
+            user_id,
+            lambda conn: self._field_value(conn, user_id, name),
+            None,
+        )
+
+    async def get_story_frame(self, user_id: str) -> Optional[StoryFrame]:
+        data = await self._field(user_id, "story_frame")
+        return None if data is None else StoryFrame.model_validate(data)
+
+    async def get_scene(self, user_id: str, scene_id: str) -> Optional[Scene]:
+        return await self._run(
+            self._read,
+            user_id,
+            lambda conn: self._scene(conn, user_id, scene_id),
+            None,
+        )
+
+    async def get_current_scene(self, user_id: str) -> Optional[Scene]:
+        def read(conn: sqlite3.Connection) -> Optional[Scene]:
+            row = conn.execute(
+                "SELECT value FROM fields WHERE user_id = ? "
+                "AND name = 'current_scene_id'",
+                (user_id,),
+            ).fetchone()
+            scene_id = decode_raw(row[0]) if row else None
+            return None if scene_id is None else self._scene(conn, user_id, scene_id)
+
+        return await self._run(self._read, user_id, read, None)
+
+    async def get_user_choices(self, user_id: str) -> List[UserChoice]:
+        def read(conn: sqlite3.Connection) -> List[UserChoice]:
+            rows = conn.execute(
+                "SELECT data FROM choices WHERE user_id = ? ORDER BY id", (user_id,)
+            )
+            return [decode(data, UserChoice) for (data,) in rows]
+
+        return await self._run(self._read, user_id, read, [])
+
+    async def purge_expired(self) -> int:
+        """Delete every user idle for longer than ``state_ttl_seconds``."""
+        ttl = settings.state_ttl_seconds
+        if ttl <= 0:
+            return 0
+
+        def purge(conn: sqlite3.Connection) -> int:
+            with self._transaction(conn):
+                cutoff = time.time() - ttl
+                expired = [
+                    (user_id,)
+                    for (user_id,) in conn.execute(
+                        "SELECT user_id FROM users WHERE accessed_at < ?", (cutoff,)
+                    )
+                ]
+                for table in _USER_TABLES:
+                    conn.executemany(
+                        f"DELETE FROM {table} WHERE user_id = ?", expired
+                    )
+                return len(expired)
+
+        return await self._run(purge)
+
+    def close(self) -> None:
+        """Close the connection and stop the database thread."""
+
+        def close(conn: Optional[sqlite3.Connection]) -> None:
+            if conn is not None:
+                conn.close()
+
+        self._executor.submit(close, self._conn).result()
+        self._conn = None
+        self._executor.shutdown()
@@ -0,0 +1,130 @@
+"""Interface shared by the user state stores.
+
+The store is chosen with ``settings.state_backend``:
+
+* ``redis`` - :class:`agent.redis_state.UserRepository`, shared by workers;
+* ``memory`` - :class:`agent.memory_state.MemoryStateBackend`, one process;
+* ``sqlite`` - :class:`agent.sqlite_state.SQLiteStateBackend`, one node.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, List, Optional, Protocol, runtime_checkable
+
+from agent.models import Ending, Scene, StoryFrame, UserChoice, UserState
+from agent.state_context import RedisStats, StateChanges, active_step
+
+
+@runtime_checkable
+class StateBackend(Protocol):
+    """Storage for per-user game state.
+
+    Every write bumps ``UserState.version`` and returns the new version.
+    ``apply`` merges changes into whatever is stored; ``update`` is a
+    compare-and-set that may call ``mutate`` again when it loses a race.
+    """
+
+    stats: RedisStats
+
+    async def get(self, user_id: str) -> UserState: ...
+
+    async def set(self, user_id: str, state: UserState) -> int: ...
+
+    async def apply(self, user_id: str, changes: StateChanges) -> Optional[int]: ...
+
+    async def update(
+        self,
+        user_id: str,
+        mutate: Callable[[UserState], Optional[StateChanges]],
+    ) -> Optional[int]: ...
+
+    async def reset(self, user_id: str) -> None: ...
+
+    async def get_story_frame(self, user_id: str) -> Optional[StoryFrame]: ...
+
+    async def set_story_frame(self, user_id: str, story_frame: StoryFrame) -> None: ...
+
+    async def get_scene(self, user_id: str, scene_id: str) -> Optional[Scene]: ...
+
+    async def get_current_scene(self, user_id: str) -> Optional[Scene]: ...
+
+    async def add_scene(
+        self, user_id: str, scene: Scene, make_current: bool = True
+    ) -> None: ...
+
+    async def update_scene_image(
+        self, user_id: str, scene_id: str, image: Optional[str]
+    ) -> bool: ...
+
+    async def get_user_choices(self, user_id: str) -> List[UserChoice]: ...
+
+    async def append_user_choice(self, user_id: str, choice: UserChoice) -> None: ...
+
+    async def set_ending(self, user_id: str, ending: Optional[Ending]) -> None: ...
+
+    async def archive_scenes(self, user_id: str, keep: Optional[int] = None) -> int: ...
+
+    async def get_archived_scenes(self, user_id: str) -> List[Scene]: ...
+
+    async def archive_choices(self, user_id: str, keep: Optional[int] = None) -> int: ...
+
+    async def get_archived_choices(self, user_id: str) -> List[UserChoice]: ...
+
+
+def scene_changes(scene: Scene, make_current: bool) -> StateChanges:
+    """Changes that store ``scene`` and optionally make it current."""
+    changes = StateChanges(scenes={scene.scene_id: scene})
+    if make_current:
+        changes.fields["current_scene_id"] = scene.scene_id
+    return changes
+
+
+class StateBackendBase:
+    """Partial reads and writes expressed through ``get`` and ``apply``.
+
+    Stores override the reads they can serve more cheaply.
+    """
+
+    stats: RedisStats
+
+    def _track(self, commands: int = 1) -> None:
+        """Count one round trip carrying ``commands`` commands."""
+        for stats in (self.stats, getattr(active_step(), "stats", None)):
+            if stats is not None:
+                stats.round_trips += 1
+                stats.commands += commands
+
+    async def get_story_frame(self, user_id: str) -> Optional[StoryFrame]:
+        return (await self.get(user_id)).story_frame
+
+    async def set_story_frame(self, user_id: str, story_frame: StoryFrame) -> None:
+        await self.apply(user_id, StateChanges(fields={"story_frame": story_frame}))
+
+    async def get_scene(self, user_id: str, scene_id: str) -> Optional[Scene]:
+        return (await self.get(user_id)).scenes.get(scene_id)
+
+    async def get_current_scene(self, user_id: str) -> Optional[Scene]:
+        state = await self.get(user_id)
+        return state.scenes.get(state.current_scene_id or "")
+
+    async def add_scene(
+        self, user_id: str, scene: Scene, make_current: bool = True
+    ) -> None:
+        """Store a new scene and optionally make it the current one."""
+        await self.apply(user_id, scene_changes(scene, make_current))
+
+    async def update_scene_image(
+        self, user_id: str, scene_id: str, image: Optional[str]
+    ) -> bool:
+        """Set the image path of a stored scene. Returns False if it is absent."""
+        changes = StateChanges(scene_images={scene_id: image})
+        return await self.apply(user_id, changes) is not None
+
+    async def get_user_choices(self, user_id: str) -> List[UserChoice]:
+        return (await self.get(user_id)).user_choices
+
+    async def append_user_choice(self, user_id: str, choice: UserChoice) -> None:
+        await self.apply(user_id, StateChanges(choices=[choice]))
+
+    async def set_ending(self, user_id: str, ending: Optional[Ending]) -> None:
+        await self.apply(user_id, StateChanges(fields={"ending": ending}))
@@ -0,0 +1,80 @@
+"""Process-local LRU cache of decoded user states."""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from agent.models import UserState
+
+
+@dataclass
+class CacheStats:
+    """Counters describing how the cache is used."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+class StateCache:
+    """Bounded LRU of user states whose entries expire after ``ttl`` seconds.
+
+    The cache owns the objects it stores: :meth:`put` stores a copy and
+    :meth:`get` hands out a copy, so callers may mutate what they get.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 30.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, Tuple[float, UserState]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, user_id: str) -> Optional[UserState]:
+        """Return the cached object itself, without copying or counting."""
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def get(self, user_id: str, copy: bool = True) -> Optional[UserState]:
+        """Return the cached state, or None on a miss or expiry.
+
+        With ``copy=False`` the shared object is returned and must not be
+        mutated.
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._entries[user_id]
+            self.stats.expirations += 1
+            entry = None
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.stats.hits += 1
+        return entry[1].model_copy(deep=True) if copy else entry[1]
+
+    def put(self, user_id: str, state: UserState) -> None:
+        self._entries[user_id] = (
+            time.monotonic() + self.ttl,
+            state.model_copy(deep=True),
+        )
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def invalidate(self, user_id: str) -> None:
+        if self._entries.pop(user_id, None) is not None:
+            self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -0,0 +1,87 @@
+"""Binary codec for user state stored in Redis.
+
+Values are dumped straight from the pydantic models to msgpack, without going
+through JSON text. Every payload starts with a schema version byte so the
+format can change without breaking states that are already stored. Payloads
+without the byte were written by the earlier ``json`` based encoder and are
+still accepted.
+"""
+
+from __future__ import annotations
+
+import zlib
+from typing import Any, List, Optional, Type, TypeVar
+
+import msgpack
+from pydantic import BaseModel
+
+from agent.models import Scene, UserState
+
+SCHEMA_VERSION = 1
+
+_VERSION_PREFIX = bytes([SCHEMA_VERSION])
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class CodecError(ValueError):
+    """Raised when a payload cannot be decoded."""
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def encode(value: Any) -> bytes:
+    """Encode a model or plain value."""
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    return encode_raw(value)
+
+
+def encode_raw(value: Any) -> bytes:
+    """Encode plain Python values, such as lists of dumped models."""
+    return _VERSION_PREFIX + msgpack.packb(value, default=_default)
+
+
+def decode_raw(data: bytes) -> Any:
+    """Decode a payload into plain Python values."""
+    if not data:
+        raise CodecError("Empty payload")
+    version = data[0]
+    if version == SCHEMA_VERSION:
+        return msgpack.unpackb(data[1:], raw=False)
+    if version < 0x80:
+        # Positive fixints are never written as a whole value, so anything in
+        # that range must be a version byte.
+        raise CodecError(f"Unsupported state schema version {version}")
+    return msgpack.unpackb(data, raw=False)
+
+
+def decode(data: bytes, model: Type[M]) -> Optional[M]:
+    """Decode a payload into ``model``; stored ``None`` decodes to ``None``."""
+    raw = decode_raw(data)
+    return None if raw is None else model.model_validate(raw)
+
+
+def encode_state(state: UserState) -> bytes:
+    """Encode a whole user state as one payload."""
+    return encode(state)
+
+
+def decode_state(data: bytes) -> UserState:
+    """Decode a payload produced by :func:`encode_state`."""
+    return UserState.model_validate(decode_raw(data))
+
+
+def encode_archive(scenes: List[Any]) -> bytes:
+    """Encode a batch of archived scenes or choices (models or dicts), compressed."""
+    batch = [s.model_dump() if isinstance(s, BaseModel) else s for s in scenes]
+    return zlib.compress(encode_raw(batch))
+
+
+def decode_archive(data: bytes, model: Type[M] = Scene) -> List[M]:
+    """Decode a batch of ``model`` produced by :func:`encode_archive`."""
+    return [model.model_validate(s) for s in decode_raw(zlib.decompress(data))]
@@ -0,0 +1,212 @@
+"""Request-scoped unit of work for user state.
+
+``runner.process_step`` opens a :class:`StepState` for the user and every tool
+running inside the step reads and mutates that in-memory copy instead of going
+back to the state store. Pending changes are written in a single batch when the step
+finishes.
+
+The active step is tracked with a context variable rather than a field of
+``GraphState`` so that it reaches every graph node and the tasks they spawn
+without being copied along with the rest of the graph state.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from agent.models import Scene, UserChoice, UserState
+
+if TYPE_CHECKING:
+    from agent.state_backend import StateBackend
+
+STATE_FIELDS = (
+    "story_frame",
+    "current_scene_id",
+    "milestones_achieved",
+    "ending",
+    "assets",
+    "history",
+    "archived_choices",
+)
+
+
+@dataclass
+class StateChanges:
+    """Set of writes to apply to a stored user state.
+
+    ``scene_images`` holds image updates for scenes that are not rewritten as
+    a whole; they are applied to the stored scene at write time so that a
+    stale copy of the scene never overwrites someone else's update.
+    ``replace`` drops everything that is stored before writing.
+    """
+
+    fields: Dict[str, Any] = field(default_factory=dict)
+    scenes: Dict[str, Scene] = field(default_factory=dict)
+    choices: List[UserChoice] = field(default_factory=list)
+    scene_images: Dict[str, Optional[str]] = field(default_factory=dict)
+    replace: bool = False
+
+    @classmethod
+    def full(cls, state: UserState) -> "StateChanges":
+        """Changes that replace the stored state with ``state``."""
+        return cls(
+            fields={name: getattr(state, name) for name in STATE_FIELDS},
+            scenes=dict(state.scenes),
+            choices=list(state.user_choices),
+            replace=True,
+        )
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.fields
+            or self.scenes
+            or self.choices
+            or self.scene_images
+            or self.replace
+        )
+
+    def resolve_images(self, stored: Dict[str, Scene]) -> Optional["StateChanges"]:
+        """Fold ``scene_images`` into whole-scene writes.
+
+        ``stored`` holds the current version of scenes that are not part of
+        the change set. Images for scenes found in neither are dropped.
+        Returns None when nothing is left to write.
+        """
+        if not self.scene_images:
+            return self if self else None
+        scenes = dict(self.scenes)
+        for scene_id, image in self.scene_images.items():
+            scene = scenes.get(scene_id) or stored.get(scene_id)
+            if scene is not None:
+                scenes[scene_id] = scene.model_copy(update={"image": image})
+        resolved = StateChanges(
+            fields=self.fields,
+            scenes=scenes,
+            choices=self.choices,
+            replace=self.replace,
+        )
+        return resolved if resolved else None
+
+    def merge(self, other: "StateChanges") -> None:
+        self.fields.update(other.fields)
+        self.scenes.update(other.scenes)
+        self.choices.extend(other.choices)
+        self.scene_images.update(other.scene_images)
+
+    def apply_to(self, state: UserState) -> None:
+        """Apply the changes to an in-memory state."""
+        for name, value in self.fields.items():
+            setattr(state, name, value)
+        state.scenes.update(self.scenes)
+        state.user_choices.extend(self.choices)
+        for scene_id, image in self.scene_images.items():
+            if scene_id in state.scenes:
+                state.scenes[scene_id].image = image
+
+
+@dataclass
+class RedisStats:
+    """Number of round trips, commands and write conflicts of a state store."""
+
+    round_trips: int = 0
+    commands: int = 0
+    conflicts: int = 0
+
+
+class StepState:
+    """In-memory user state shared by all graph nodes of one step."""
+
+    def __init__(self, user_hash: str, repo: "StateBackend") -> None:
+        self.user_hash = user_hash
+        self.stats = RedisStats()
+        self._repo = repo
+        self._state: Optional[UserState] = None
+        self._pending = StateChanges()
+        self._replace = False
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> UserState:
+        """Return the user state, reading it from the store on first use."""
+        if self._state is None:
+            async with self._lock:
+                if self._state is None:
+                    self._state = await self._repo.get(self.user_hash)
+        return self._state
+
+    @property
+    def pending(self) -> StateChanges:
+        """Changes recorded since the last commit."""
+        return self._pending
+
+    async def record(self, changes: StateChanges) -> None:
+        """Apply ``changes`` in memory and queue them for the final write."""
+        changes.apply_to(await self.load())
+        self._pending.merge(changes)
+
+    async def fork(self) -> "StepState":
+        """Return a child step starting from this step's current state.
+
+        Changes made through the child stay private to it. Hand them to
+        :meth:`record` to keep them, or drop the child to discard them.
+        """
+        child = StepState(self.user_hash, self._repo)
+        child.stats = self.stats
+        child._state = (await self.load()).model_copy(deep=True)
+        return child
+
+    def replace(self, state: UserState) -> None:
+        """Replace the whole state; it will be rewritten on commit."""
+        self._state = state
+        self._pending = StateChanges()
+        self._replace = True
+
+    def discard(self) -> None:
+        """Forget the loaded state and any pending changes."""
+        self._state = None
+        self._pending = StateChanges()
+        self._replace = False
+
+    async def commit(self) -> None:
+        """Write pending changes to the store in a single batch.
+
+        Changes are merged into whatever is stored at commit time, so writes
+        made by other steps since :meth:`load` are kept.
+        """
+        if self._replace:
+            version = await self._repo.set(self.user_hash, self._state)
+        else:
+            version = await self._repo.apply(self.user_hash, self._pending)
+        if version is not None:
+            self._state.version = version
+        self._pending = StateChanges()
+        self._replace = False
+
+
+_current_step: ContextVar[Optional[StepState]] = ContextVar(
+    "current_step", default=None
+)
+
+
+def active_step() -> Optional[StepState]:
+    """Return the step state active in the current context, if any."""
+    return _current_step.get()
+
+
+def current_step_state(user_hash: str) -> Optional[StepState]:
+    """Return the active step state for ``user_hash``, if any."""
+    step = _current_step.get()
+    if step is not None and step.user_hash == user_hash:
+        return step
+    return None
+
+
+def activate(step: Optional[StepState]):
+    """Make ``step`` the active step state; returns a reset token."""
+    return _current_step.set(step)
+
+
+def deactivate(token) -> None:
+    _current_step.reset(token)
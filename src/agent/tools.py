@@ -6,20 +6,38 @@ from typing import Annotated, Dict
 
 from langchain_core.tools import tool
 
-from agent.llm import create_llm
+from agent.assets import record_asset
+from agent.ending_policy import check_ending_if_plausible, record_milestones
+from agent.history import build_history, estimate_tokens
+from agent.llm import task_llm
 from agent.models import (
     EndingCheckResult,
-    Scene,
-    SceneChoice,
+    FusedSceneLLM,
     SceneLLM,
     StoryFrame,
     StoryFrameLLM,
     UserChoice,
 )
-from agent.prompts import ENDING_CHECK_PROMPT, SCENE_PROMPT, STORY_FRAME_PROMPT
-from agent.redis_state import get_user_state, set_user_state
+from agent.narration import current_narration, stream_json_field
+from agent.prompts import (
+    ENDING_CHECK_PROMPT,
+    FUSED_SCENE_PROMPT,
+    SCENE_PROMPT,
+    STORY_FRAME_PROMPT,
+)
+from agent.redis_state import (
+    add_scene,
+    append_user_choice,
+    get_story_frame,
+    get_user_state,
+    set_ending,
+    set_story_frame,
+    update_scene_image,
+)
 from images.image_generator import modify_image, generate_image
 from agent.image_agent import ChangeScene
+from agent.repair import structured_call
+from config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -37,13 +55,18 @@ async def generate_story_frame(
     genre: Annotated[str, "Genre"],
 ) -> Annotated[Dict, "Generated story frame"]:
     """Create the initial story frame and store it in user state."""
-    llm = create_llm().with_structured_output(StoryFrameLLM)
     prompt = STORY_FRAME_PROMPT.format(
         setting=setting,
         character=character,
         genre=genre,
     )
-    resp: StoryFrameLLM = await llm.ainvoke(prompt)
+    resp = await structured_call(
+        "generate_story_frame",
+        "story_frame",
+        StoryFrameLLM,
+        prompt,
+        check=_has_endings,
+    )
     story_frame = StoryFrame(
         lore=resp.lore,
         goal=resp.goal,
@@ -53,53 +76,72 @@ async def generate_story_frame(
         character=character,
         genre=genre,
     )
-    state = await get_user_state(user_hash)
-    state.story_frame = story_frame
-    await set_user_state(user_hash, state)
+    await set_story_frame(user_hash, story_frame)
     return story_frame.dict()
 
 
+def _has_endings(resp: StoryFrameLLM):
+    return None if resp.endings else ("endings", "at least one ending is needed")
+
+
+def _has_two_choices(resp: SceneLLM):
+    if len(resp.choices) >= 2:
+        return None
+    return ("choices", "exactly two choices are needed")
+
+
+def _ending_is_described(resp: EndingCheckResult):
+    if resp.ending_reached and resp.ending is None:
+        return ("ending", "ending_reached is true, so the reached ending is needed")
+    return None
+
+
+async def _stream_scene(prompt: str) -> Dict | None:
+    """Generate the scene in JSON mode, streaming its description to the UI."""
+    try:
+        return await stream_json_field(task_llm("scene"), prompt, "description")
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("Streaming scene generation failed: %s", exc)
+        return None
+
+
 @tool
 async def generate_scene(
     user_hash: Annotated[str, "User session ID"],
     last_choice: Annotated[str, "Last user choice"],
 ) -> Annotated[Dict, "Generated scene"]:
     """Generate a new scene based on the current user state."""
-    state = await get_user_state(user_hash)
-    if not state.story_frame:
+    story_frame = await get_story_frame(user_hash)
+    if not story_frame:
         return _err("Story frame not initialized")
-    llm = create_llm().with_structured_output(SceneLLM)
-    prompt = SCENE_PROMPT.format(
-        lore=state.story_frame.lore,
-        goal=state.story_frame.goal,
-        milestones=",".join(m.id for m in state.story_frame.milestones),
-        endings=",".join(e.id for e in state.story_frame.endings),
-        history="; ".join(f"{c.scene_id}:{c.choice_text}" for c in state.user_choices),
+    history = await build_history(user_hash)
+    fused = settings.scene_generation_mode == "fused"
+    schema = FusedSceneLLM if fused else SceneLLM
+    prompt = (FUSED_SCENE_PROMPT if fused else SCENE_PROMPT).format(
+        lore=story_frame.lore,
+        goal=story_frame.goal,
+        milestones=",".join(m.id for m in story_frame.milestones),
+        endings=",".join(e.id for e in story_frame.endings),
+        history=history,
         last_choice=last_choice,
     )
-    resp: SceneLLM = await llm.ainvoke(prompt)
-    if len(resp.choices) < 2:
-        resp = await llm.ainvoke(
-            prompt + "\nThe scene must contain exactly two choices."
-        )
-    scene_id = str(uuid.uuid4())
-    choices = [
-        SceneChoice(**ch.model_dump())
-        if hasattr(ch, "model_dump")
-        else SceneChoice(**ch)
-        for ch in resp.choices[:2]
-    ]
-    scene = Scene(
-        scene_id=scene_id,
-        description=resp.description,
-        choices=choices,
-        image=None,
-        music=None,
+    logger.info("Scene prompt for user %s: ~%d tokens", user_hash, estimate_tokens(prompt))
+    resp = await structured_call(
+        "generate_scene",
+        "scene",
+        schema,
+        prompt,
+        check=_has_two_choices,
+        first=(lambda: _stream_scene(prompt)) if current_narration() else None,
     )
-    state.current_scene_id = scene_id
-    state.scenes[scene_id] = scene
-    await set_user_state(user_hash, state)
-    return scene.dict()
+    scene = resp.to_scene(str(uuid.uuid4()))
+    await add_scene(user_hash, scene)
+    await record_milestones(user_hash, resp.milestones_achieved)
+    result = scene.dict()
+    if fused:
+        # Picked up by scene_image_prompt instead of calling the image agent.
+        result["change_scene"] = resp.change_scene.model_dump()
+    return result
 
 
 @tool
@@ -114,15 +156,16 @@ async def generate_scene_image(
         image_path = current_image
         if change_scene.change_scene == "change_completely" or change_scene.change_scene == "modify":
             image_path, _ = await (
-                generate_image(change_scene.scene_description)
+                generate_image(change_scene.scene_description, user_hash)
                 if current_image is None
                 # for now always modify the image to avoid the generating an update in a completely wrong style
-                else modify_image(current_image, change_scene.scene_description)
+                else modify_image(
+                    current_image, change_scene.scene_description, user_hash
+                )
             )
-        state = await get_user_state(user_hash)
-        if scene_id in state.scenes:
-            state.scenes[scene_id].image = image_path
-        await set_user_state(user_hash, state)
+        await update_scene_image(user_hash, scene_id, image_path)
+        if image_path:
+            await record_asset(user_hash, scene_id, image_path)
         return image_path
     except Exception as exc:  # noqa: BLE001
         return _err(str(exc))
@@ -137,15 +180,14 @@ async def update_state_with_choice(
     """Record the player's choice in the state."""
     import datetime
 
-    state = await get_user_state(user_hash)
-    state.user_choices.append(
-        UserChoice(
-            scene_id=scene_id,
-            choice_text=choice_text,
-            timestamp=datetime.datetime.utcnow().isoformat(),
-        )
+    choice = UserChoice(
+        scene_id=scene_id,
+        choice_text=choice_text,
+        timestamp=datetime.datetime.utcnow().isoformat(),
     )
-    await set_user_state(user_hash, state)
+    await append_user_choice(user_hash, choice)
+    # Inside a step this reads the shared step state, not the store.
+    state = await get_user_state(user_hash)
     return state.dict()
 
 
@@ -154,18 +196,32 @@ async def check_ending(
     user_hash: Annotated[str, "User session ID"],
 ) -> Annotated[Dict, "Ending check result"]:
     """Check whether an ending has been reached."""
+    return await check_ending_if_plausible(
+        user_hash, lambda: _check_ending_with_llm(user_hash)
+    )
+
+
+async def _check_ending_with_llm(user_hash: str) -> Dict:
     state = await get_user_state(user_hash)
-    if not state.story_frame:
+    story_frame = state.story_frame
+    if not story_frame:
         return _err("No story frame")
-    llm = create_llm().with_structured_output(EndingCheckResult)
-    history = "; ".join(f"{c.scene_id}:{c.choice_text}" for c in state.user_choices)
     prompt = ENDING_CHECK_PROMPT.format(
-        history=history,
-        endings=",".join(f"{e.id}:{e.condition}" for e in state.story_frame.endings),
+        history=await build_history(user_hash),
+        milestones_achieved=",".join(sorted(state.milestones_achieved)) or "none",
+        endings=",".join(f"{e.id}:{e.condition}" for e in story_frame.endings),
+    )
+    logger.info(
+        "Ending check prompt for user %s: ~%d tokens", user_hash, estimate_tokens(prompt)
+    )
+    resp = await structured_call(
+        "check_ending",
+        "ending_check",
+        EndingCheckResult,
+        prompt,
+        check=_ending_is_described,
     )
-    resp: EndingCheckResult = await llm.ainvoke(prompt)
     if resp.ending_reached and resp.ending:
-        state.ending = resp.ending
-        await set_user_state(user_hash, state)
+        await set_ending(user_hash, resp.ending)
         return {"ending_reached": True, "ending": resp.ending.dict()}
     return {"ending_reached": False}
@@ -1,7 +1,7 @@
 import asyncio
-from google import genai
+from contextlib import AsyncExitStack
 from google.genai import types
-from config import settings
+from agent.key_pool import genai_client, get_key_pool
 import wave
 import queue
 import logging
@@ -10,35 +10,52 @@ import time
 
 logger = logging.getLogger(__name__)
 
-client = genai.Client(api_key=settings.gemini_api_key.get_secret_value(), http_options={'api_version': 'v1alpha'})
+async def _open_music_session(stack: AsyncExitStack):
+    """Connect on a key from the pool; the key is leased only while connecting.
+
+    The session stays open until ``stack`` is closed.
+    """
+
+    async def connect(key: str):
+        connection = genai_client(key, api_version='v1alpha').aio.live.music.connect(
+            model='models/lyria-realtime-exp'
+        )
+        session = await connection.__aenter__()
+        stack.push_async_exit(connection)
+        return session
+
+    return await get_key_pool().call(connect)
+
 
 async def generate_music(user_hash: str, music_tone: str, receive_audio):
     if user_hash in sessions:
         return
-    async with (
-        client.aio.live.music.connect(model='models/lyria-realtime-exp') as session,
-        asyncio.TaskGroup() as tg,
-    ):
-        # Set up task to receive server messages.
-        tg.create_task(receive_audio(session, user_hash))
+    async with AsyncExitStack() as stack:
+        session = await _open_music_session(stack)
+        async with asyncio.TaskGroup() as tg:
+            # Set up task to receive server messages.
+            tg.create_task(receive_audio(session, user_hash))
 
-        # Send initial prompts and config
-        await session.set_weighted_prompts(
-          prompts=[
-            types.WeightedPrompt(text=music_tone, weight=1.0),
-          ]
-        )
-        await session.set_music_generation_config(
-          config=types.LiveMusicGenerationConfig(bpm=90, temperature=1.0)
-        )
-        await session.play()
-        logger.info(f"Started music generation for user hash {user_hash}, music tone: {music_tone}")
-        sessions[user_hash] = {
-            'session': session,
-            'queue': queue.Queue()
-        }
+            # Send initial prompts and config
+            await session.set_weighted_prompts(
+              prompts=[
+                types.WeightedPrompt(text=music_tone, weight=1.0),
+              ]
+            )
+            await session.set_music_generation_config(
+              config=types.LiveMusicGenerationConfig(bpm=90, temperature=1.0)
+            )
+            await session.play()
+            logger.info(f"Started music generation for user hash {user_hash}, music tone: {music_tone}")
+            sessions[user_hash] = {
+                'session': session,
+                'queue': queue.Queue()
+            }
         
 async def change_music_tone(user_hash: str, new_tone):
+    if not new_tone:
+        # Only the fused scene mode produces a music prompt.
+        return
     logger.info(f"Changing music tone to {new_tone}")
     session = sessions.get(user_hash, {}).get('session')
     if not session:
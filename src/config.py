@@ -1,7 +1,8 @@
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 import logging
-from pydantic import SecretStr
+from pydantic import BaseModel, Field, SecretStr
+from typing import Dict, Literal, Optional
 
 load_dotenv()
 
@@ -22,6 +23,82 @@ class BaseAppSettings(BaseSettings):
         extra = "ignore"
 
 
+class LLMRoute(BaseModel):
+    """Model and limits used for one LLM task.
+
+    When the observed p95 latency of ``model`` goes over ``slo_seconds``,
+    calls move to ``fallback_model`` for a while. A call still running after
+    ``deadline_seconds`` is abandoned.
+    """
+
+    model: str
+    thinking_budget: Optional[int] = None
+    max_output_tokens: Optional[int] = None
+    slo_seconds: Optional[float] = None
+    fallback_model: Optional[str] = "gemini-2.0-flash"
+    deadline_seconds: Optional[float] = 60.0
+
+
+def _default_llm_routes() -> Dict[str, LLMRoute]:
+    heavy, light = "gemini-2.5-flash-preview-05-20", "gemini-2.0-flash"
+    return {
+        "story_frame": LLMRoute(
+            model=heavy,
+            thinking_budget=1024,
+            max_output_tokens=4096,
+            slo_seconds=30,
+            deadline_seconds=90,
+        ),
+        "scene": LLMRoute(
+            model=heavy, thinking_budget=1024, max_output_tokens=2048, slo_seconds=12
+        ),
+        "ending_check": LLMRoute(
+            model=heavy, thinking_budget=1024, max_output_tokens=1536, slo_seconds=8
+        ),
+        "image_prompt": LLMRoute(
+            model=light,
+            max_output_tokens=1024,
+            slo_seconds=5,
+            fallback_model=None,
+            deadline_seconds=30,
+        ),
+        "music_prompt": LLMRoute(
+            model=light,
+            max_output_tokens=256,
+            slo_seconds=4,
+            fallback_model=None,
+            deadline_seconds=30,
+        ),
+        "history_summary": LLMRoute(
+            model=light, max_output_tokens=512, fallback_model=None
+        ),
+        "repair": LLMRoute(
+            model=light, max_output_tokens=1024, fallback_model=None, deadline_seconds=30
+        ),
+    }
+
+
+class ImageVariant(BaseModel):
+    """Resized copy of generated images; images are never upscaled.
+
+    ``method`` is the WebP encoder effort from 0 to 6; 2 encodes about twice
+    as fast as the default of 4 for files a few percent larger.
+    """
+
+    max_width: int
+    format: Literal["webp", "jpeg"] = "webp"
+    quality: int = 80
+    method: int = 2
+
+
+def _default_image_variants() -> Dict[str, ImageVariant]:
+    return {
+        "desktop": ImageVariant(max_width=1920, quality=82),
+        "mobile": ImageVariant(max_width=960, quality=75),
+        "thumbnail": ImageVariant(max_width=320, format="jpeg", quality=70),
+    }
+
+
 class AppSettings(BaseAppSettings):
     gemini_api_key: SecretStr
     gemini_api_keys: SecretStr
@@ -29,6 +106,139 @@ class AppSettings(BaseAppSettings):
     top_p: float = 0.95
     temperature: float = 0.5
     pregenerate_next_scene: bool = True
-    
+    # The LLM ending check is skipped before ``ending_check_min_steps``
+    # choices, and until ``ending_check_min_coverage`` of the milestones are
+    # reached it runs only every ``ending_check_every`` steps.
+    ending_check_min_steps: int = 3
+    ending_check_min_coverage: float = 0.5
+    ending_check_every: int = 3
+    # "multi_agent" asks separate agents for the image prompt; "fused" gets
+    # the scene, image decision and music prompt from a single call.
+    scene_generation_mode: Literal["multi_agent", "fused"] = "multi_agent"
+    # Limits for speculative branches: per scene, running across all users,
+    # seconds per branch, and how long an unclaimed result is kept.
+    pregenerate_max_branches: int = 2
+    pregenerate_max_concurrent: int = 8
+    pregenerate_timeout: float = 90.0
+    pregenerate_result_ttl: float = 1800.0
+    # Gemini transport ("grpc" or "rest") and endpoint override, e.g. for a
+    # proxy or a local stand-in server. Async calls always use gRPC.
+    llm_transport: Optional[str] = None
+    llm_api_endpoint: Optional[str] = None
+
+    # Model, thinking budget, output cap and latency SLO per LLM task. A
+    # task whose p95 over the last ``llm_route_window`` calls exceeds its SLO
+    # uses its fallback model for ``llm_route_fallback_seconds``.
+    llm_routes: Dict[str, LLMRoute] = Field(default_factory=_default_llm_routes)
+    llm_route_window: int = 50
+    llm_route_min_samples: int = 10
+    llm_route_fallback_seconds: float = 300.0
+
+    # Malformed structured outputs are salvaged locally or completed with a
+    # small call first; full retries are capped and back off with jitter.
+    llm_repair_max_retries: int = 1
+    llm_repair_backoff: float = 0.5
+    llm_repair_max_backoff: float = 4.0
+
+    # Steps return the scene text and choices without waiting for the
+    # picture, which is generated after the step and pushed to the UI.
+    deferred_scene_images: bool = True
+    image_poll_interval: float = 0.5
+
+    # Generated images are stored by content hash under ``asset_dir``.
+    # Unreferenced ones older than ``asset_gc_grace_seconds`` are deleted
+    # every ``asset_gc_interval_seconds``, or as soon as the store grows past
+    # ``asset_quota_mb``.
+    asset_dir: str = "generated/images"
+    asset_quota_mb: int = 2048
+    asset_gc_interval_seconds: float = 600.0
+    asset_gc_grace_seconds: float = 600.0
+    # Images are stored as returned by the model. Smaller ``image_variants``
+    # are encoded next to them by ``image_variant_workers`` threads. When
+    # ``image_variant_queue`` images are already waiting, only the original
+    # is kept. Clients get the smallest variant that covers their screen.
+    image_variants: Dict[str, ImageVariant] = Field(
+        default_factory=_default_image_variants
+    )
+    image_variant_workers: int = 2
+    image_variant_queue: int = 16
+    # Images sent back to the model for editing are shrunk to at most
+    # ``image_upload_max_side`` pixels and ``image_upload_max_kb`` KB. The
+    # last ``image_memory_per_user`` uploads of ``image_memory_users`` users
+    # are kept in memory, so an edit chain does not read from disk.
+    image_upload_max_side: int = 1024
+    image_upload_max_kb: int = 384
+    image_memory_users: int = 256
+    image_memory_per_user: int = 3
+
+    # Answers of the image and music prompt agents are cached in a local LRU
+    # and, with the Redis state backend, in Redis for ``prompt_cache_ttl``
+    # seconds. See ``agent.prompt_cache``.
+    prompt_cache_enabled: bool = True
+    prompt_cache_size: int = 512
+    prompt_cache_ttl: int = 24 * 3600
+    prompt_cache_shared_max_entries: int = 20000
+
+    # The image agent is skipped when consecutive scene descriptions are at
+    # least ``scene_change_same_similarity`` alike and nobody moved, or when
+    # the player moved to a new location and they are at most
+    # ``scene_change_new_similarity`` alike. See ``agent.scene_change``.
+    scene_change_classifier: bool = True
+    scene_change_same_similarity: float = 0.75
+    scene_change_new_similarity: float = 0.6
+    # When set, each scene also gets an LLM decision, and both decisions are
+    # appended to this JSONL file to measure agreement.
+    scene_change_corpus_path: Optional[str] = None
+
+    # Calls still running after their p95 latency are duplicated on another
+    # key. The hedge budget grows by ``hedge_budget`` per call, up to
+    # ``hedge_burst``, so it cannot double the traffic. Image calls are
+    # abandoned after ``image_deadline_seconds``.
+    hedge_budget: float = 0.1
+    hedge_burst: float = 5.0
+    hedge_min_samples: int = 20
+    hedge_window: int = 200
+    image_deadline_seconds: float = 120.0
+
+    # Gemini API key pool shared by the LLM, image and music clients. Quotas
+    # apply per key; throttled keys cool down with exponential backoff.
+    key_requests_per_minute: float = 60.0
+    key_burst: int = 10
+    key_cooldown: float = 2.0
+    key_max_cooldown: float = 120.0
+    key_max_attempts: int = 3
+    key_acquire_timeout: float = 30.0
+
+    # User state store: "redis", "memory" (single process) or "sqlite"
+    # (single node).
+    state_backend: Literal["redis", "memory", "sqlite"] = "redis"
+    sqlite_state_path: str = "generated/state.db"
+    # Idle sessions expire after this many seconds; 0 keeps them forever.
+    state_ttl_seconds: int = 7 * 24 * 3600
+    # Older scenes are archived once a user has more than this many.
+    hot_scene_limit: int = 20
+    # Likewise older choices, once more than this many are stored. Only
+    # choices already folded into the history summary are archived.
+    hot_choice_limit: int = 40
+    # Prompts quote the last ``history_recent_choices`` choices verbatim;
+    # older ones are folded into a running summary in batches of
+    # ``history_summary_batch``.
+    history_recent_choices: int = 6
+    history_summary_batch: int = 6
+
+    # Redis state store. All keys of a user share the ``llmgamehub:{<user>}``
+    # hash tag, so users can be spread across shards.
+    redis_url: str = "redis://localhost"
+    redis_max_connections: int = 50
+    redis_pool_timeout: float = 5.0
+    redis_socket_timeout: float = 5.0
+    redis_socket_connect_timeout: float = 2.0
+    redis_health_check_interval: int = 30
+
+    # Optional process-local cache of decoded user states in front of Redis.
+    state_cache_enabled: bool = False
+    state_cache_size: int = 256
+    state_cache_ttl: float = 30.0
+
 
 settings = AppSettings()
@@ -6,7 +6,9 @@ from game_state import story, state, get_current_scene
 from agent.llm_agent import process_user_input
 from images.image_generator import generate_image
 from game_setting import Character, GameSetting
-from agent.runner import process_step
+from agent.image_delivery import wait_for_image
+from images.variants import DESKTOP_WIDTH, pick_variant
+from agent.runner import stream_step
 from audio.audio_generator import start_music_generation
 import asyncio
 from config import settings
@@ -120,12 +122,19 @@ async def start_game_with_settings(
     char_background: str,
     char_personality: str,
     genre: str,
+    width: int = DESKTOP_WIDTH,
 ):
-    """Initialize the game with custom settings and switch to game interface"""
+    """Initialize the game with custom settings and switch to game interface.
+
+    The game interface is shown as soon as the first scene text streams in;
+    the choices follow when the step completes and the image when it is
+    ready. Images are served in the variant that suits a screen ``width``
+    pixels wide.
+    """
     if not all(
         [setting_desc, char_name, char_age, char_background, char_personality, genre]
     ):
-        return (
+        yield (
             gr.update(visible=True),  # constructor_interface
             gr.update(visible=False),  # loading indicator
             gr.update(visible=False),  # game_interface
@@ -138,6 +147,7 @@ async def start_game_with_settings(
             gr.update(),  # game components unchanged
             gr.update(),  # custom choice
         )
+        return
 
     character = Character(
         name=char_name,
@@ -151,26 +161,52 @@ async def start_game_with_settings(
     asyncio.create_task(start_music_generation(user_hash, "neutral"))
 
     # Запускаем LLM-граф для инициализации истории
-    result = await process_step(
+    async for event in stream_step(
         user_hash=user_hash,
         step="start",
         setting=game_setting.setting,
         character=game_setting.character.model_dump(),
         genre=game_setting.genre,
-    )
+    ):
+        if "text" in event:
+            yield (
+                gr.update(visible=False),  # loading indicator
+                gr.update(visible=False),  # constructor_interface
+                gr.update(visible=True),  # game_interface
+                gr.update(visible=False),  # error_message
+                gr.update(value=event["text"]),  # game_text
+                gr.update(),  # game_image
+                gr.update(),  # game_choices
+                gr.update(),  # custom choice
+            )
+        else:
+            result = event["response"]
 
     scene = result["scene"]
     scene_text = scene["description"]
     scene_image = scene.get("image", "")
     scene_choices = [ch["text"] for ch in scene.get("choices", [])]
 
-    return (
+    yield (
         gr.update(visible=False),  # loading indicator
         gr.update(visible=False),  # constructor_interface
         gr.update(visible=True),  # game_interface
         gr.update(visible=False),  # error_message
         gr.update(value=scene_text),  # game_text
-        gr.update(value=scene_image),  # game_image
+        gr.update(value=pick_variant(scene_image, width)),  # game_image
         gr.update(choices=scene_choices, value=None),  # game_choices
         gr.update(value="", visible=True),  # custom choice
     )
+    if not scene_image:
+        scene_image = await wait_for_image(user_hash, scene["scene_id"])
+        if scene_image:
+            yield (
+                gr.update(),  # loading indicator
+                gr.update(),  # constructor_interface
+                gr.update(),  # game_interface
+                gr.update(),  # error_message
+                gr.update(),  # game_text
+                gr.update(value=pick_variant(scene_image, width)),  # game_image
+                gr.update(),  # game_choices
+                gr.update(),  # custom choice
+            )
@@ -0,0 +1,324 @@
+"""Content-addressed store of generated images.
+
+Images are saved as ``<asset_dir>/<aa>/<sha256>.<ext>``, named after the
+hash of their bytes, so two users generating at the same moment can no
+longer overwrite each other's files, and identical images are stored once.
+Resized variants live next to them as ``<sha256>.<variant>.<ext>`` and
+share the lifetime of the original.
+
+A SQLite index next to the files records every asset and which scenes of
+which users reference it. The users' own side of that mapping is kept in
+``UserState.assets``. Resetting a user drops their references. References
+of users idle for longer than ``state_ttl_seconds`` are dropped as well,
+since their state has expired too.
+
+:meth:`AssetStore.collect_garbage` deletes assets that nobody references
+and that are older than ``asset_gc_grace_seconds``. The grace period covers
+an image that is saved but whose scene is not yet recorded. It runs in the
+background at most every ``asset_gc_interval_seconds``, and straight away
+once the store grows past ``asset_quota_mb``. Referenced assets are never
+deleted. A store still over quota after a pass is logged.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import glob
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    digest TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    user_id TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    touched_at REAL NOT NULL,
+    PRIMARY KEY (user_id, scene_id)
+);
+CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest);
+CREATE INDEX IF NOT EXISTS refs_touched ON refs (touched_at);
+"""
+
+
+@dataclass
+class AssetStoreStats:
+    """Writes, deduplication and garbage collection of the store."""
+
+    puts: int = 0
+    deduplicated: int = 0
+    gc_runs: int = 0
+    gc_removed: int = 0
+    gc_freed_bytes: int = 0
+    gc_seconds: float = 0.0
+    last_gc_seconds: float = 0.0
+
+    @property
+    def dedupe_ratio(self) -> float:
+        """Share of saved images that were already stored."""
+        return self.deduplicated / self.puts if self.puts else 0.0
+
+
+def digest_of(path: str) -> Optional[str]:
+    """Content hash an asset or variant path was named after, if it is one."""
+    name = os.path.basename(path).split(".")[0]
+    if len(name) == 64 and all(c in "0123456789abcdef" for c in name):
+        return name
+    return None
+
+
+class AssetStore:
+    """Images on local disk, indexed by content hash."""
+
+    def __init__(self, root: Optional[str] = None) -> None:
+        self.root = root or settings.asset_dir
+        self.stats = AssetStoreStats()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="asset-store"
+        )
+        self._last_gc = time.monotonic()
+        self._gc_task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            conn = sqlite3.connect(
+                os.path.join(self.root, "assets.db"),
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run ``fn(conn, *args)`` on the store thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: fn(self._connect(), *args)
+        )
+
+    def path_for(self, digest: str, suffix: str = ".png") -> str:
+        return os.path.join(self.root, digest[:2], digest + suffix)
+
+    @staticmethod
+    def variant_path(path: str, name: str, suffix: str) -> str:
+        """Where the ``name`` variant of the asset at ``path`` is stored."""
+        base, _ = os.path.splitext(path)
+        return f"{base}.{name}{suffix}"
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _put(self, conn: sqlite3.Connection, data: bytes, suffix: str) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, suffix)
+        self.stats.puts += 1
+        if os.path.exists(path):
+            self.stats.deduplicated += 1
+        else:
+            self._write(path, data)
+        conn.execute(
+            "INSERT INTO assets (digest, path, size, created_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (digest) DO UPDATE SET created_at = excluded.created_at",
+            (digest, path, len(data), time.time()),
+        )
+        return path
+
+    async def put(self, data: bytes, suffix: str = ".png") -> str:
+        """Store encoded image bytes and return the path of the asset."""
+        path = await self._run(self._put, data, suffix)
+        self._maybe_collect()
+        return path
+
+    def _put_variant(
+        self, conn: sqlite3.Connection, path: str, name: str, data: bytes, suffix: str
+    ) -> str:
+        target = self.variant_path(path, name, suffix)
+        if not os.path.exists(target):
+            self._write(target, data)
+            # Variants count towards the quota of their original.
+            conn.execute(
+                "UPDATE assets SET size = size + ? WHERE digest = ?",
+                (len(data), digest_of(path)),
+            )
+        return target
+
+    async def put_variant(self, path: str, name: str, data: bytes, suffix: str) -> str:
+        """Store the ``name`` variant of the asset at ``path``; returns its path."""
+        return await self._run(self._put_variant, path, name, data, suffix)
+
+    @staticmethod
+    def _add_refs(
+        conn: sqlite3.Connection, user_id: str, refs: Dict[str, str]
+    ) -> None:
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO refs (user_id, scene_id, digest, touched_at) "
+            "VALUES (?, ?, ?, ?)",
+            [(user_id, scene_id, digest, now) for scene_id, digest in refs.items()],
+        )
+        conn.execute("UPDATE refs SET touched_at = ? WHERE user_id = ?", (now, user_id))
+
+    async def add_ref(self, user_id: str, scene_id: str, path: str) -> Optional[str]:
+        """Record that ``scene_id`` of ``user_id`` shows the asset at ``path``.
+
+        Returns the digest of the asset, or None for paths outside the store.
+        """
+        digest = digest_of(path)
+        if digest is None:
+            return None
+        await self.add_refs(user_id, {scene_id: digest})
+        return digest
+
+    async def add_refs(self, user_id: str, refs: Dict[str, str]) -> None:
+        """Record the ``scene_id -> digest`` references of ``user_id``."""
+        if refs:
+            await self._run(self._add_refs, user_id, refs)
+
+    async def drop_user(self, user_id: str) -> None:
+        """Forget every reference of ``user_id``; GC removes what is left over."""
+        await self._run(
+            lambda conn: conn.execute("DELETE FROM refs WHERE user_id = ?", (user_id,))
+        )
+        self._maybe_collect()
+
+    @staticmethod
+    def _size(conn: sqlite3.Connection) -> Dict[str, int]:
+        count, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM assets"
+        ).fetchone()
+        (refs,) = conn.execute("SELECT COUNT(*) FROM refs").fetchone()
+        return {"assets": count, "bytes": size, "refs": refs}
+
+    async def size(self) -> Dict[str, int]:
+        return await self._run(self._size)
+
+    def _collect(self, conn: sqlite3.Connection) -> List[str]:
+        now = time.time()
+        if settings.state_ttl_seconds > 0:
+            conn.execute(
+                "DELETE FROM refs WHERE touched_at < ?",
+                (now - settings.state_ttl_seconds,),
+            )
+        rows = conn.execute(
+            "SELECT digest, path, size FROM assets WHERE created_at < ? "
+            "AND digest NOT IN (SELECT digest FROM refs) ORDER BY created_at",
+            (now - settings.asset_gc_grace_seconds,),
+        ).fetchall()
+        removed = []
+        for digest, path, size in rows:
+            try:
+                # The original and its variants.
+                for file in glob.glob(glob.escape(os.path.splitext(path)[0]) + ".*"):
+                    try:
+                        os.remove(file)
+                    except FileNotFoundError:
+                        pass
+            except OSError as exc:
+                logger.warning("[Assets] Could not remove %s: %s", path, exc)
+                continue
+            conn.execute("DELETE FROM assets WHERE digest = ?", (digest,))
+            self.stats.gc_freed_bytes += size
+            removed.append(path)
+        return removed
+
+    async def collect_garbage(self) -> List[str]:
+        """Delete unreferenced assets past the grace period; returns their paths."""
+        started = time.monotonic()
+        removed = await self._run(self._collect)
+        elapsed = time.monotonic() - started
+        self._last_gc = time.monotonic()
+        self.stats.gc_runs += 1
+        self.stats.gc_removed += len(removed)
+        self.stats.gc_seconds += elapsed
+        self.stats.last_gc_seconds = elapsed
+        size = await self.size()
+        logger.info(
+            "[Assets] GC removed %d assets in %.3fs; %d assets, %.1f MB, "
+            "dedupe ratio %.0f%%",
+            len(removed),
+            elapsed,
+            size["assets"],
+            size["bytes"] / 2**20,
+            self.stats.dedupe_ratio * 100,
+        )
+        if size["bytes"] > settings.asset_quota_mb * 2**20:
+            logger.warning(
+                "[Assets] Store is over its %d MB quota with referenced assets only",
+                settings.asset_quota_mb,
+            )
+        return removed
+
+    def _maybe_collect(self) -> None:
+        """Start a background GC pass when one is due; one runs at a time."""
+        if self._gc_task is not None and not self._gc_task.done():
+            return
+        due = time.monotonic() - self._last_gc >= settings.asset_gc_interval_seconds
+
+        async def run() -> None:
+            try:
+                size = await self.size()
+                if due or size["bytes"] > settings.asset_quota_mb * 2**20:
+                    await self.collect_garbage()
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("[Assets] GC failed: %s", exc)
+
+        self._gc_task = asyncio.ensure_future(run())
+
+    async def report(self) -> Dict[str, Any]:
+        """Store size, dedupe ratio and GC timings."""
+        return {
+            **await self.size(),
+            "dedupe_ratio": self.stats.dedupe_ratio,
+            "gc_runs": self.stats.gc_runs,
+            "gc_removed": self.stats.gc_removed,
+            "gc_freed_bytes": self.stats.gc_freed_bytes,
+            "last_gc_seconds": self.stats.last_gc_seconds,
+        }
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+
+_store: Optional[AssetStore] = None
+
+
+def get_asset_store() -> AssetStore:
+    global _store
+    if _store is None:
+        _store = AssetStore()
+    return _store
+
+
+def set_asset_store(store: Optional[AssetStore]) -> None:
+    """Replace the shared store; ``None`` recreates it from settings."""
+    global _store
+    _store = store
@@ -1,18 +1,14 @@
-from google import genai
 from google.genai import types
-import os
-from PIL import Image
-from io import BytesIO
-from datetime import datetime
+from agent.hedging import get_hedger
+from agent.key_pool import genai_client
 from config import settings
+from images.image_memory import get_image_memory
+from images.variants import store_image
 import logging
-import asyncio
 import gradio as gr
 
 logger = logging.getLogger(__name__)
 
-client = genai.Client(api_key=settings.gemini_api_key.get_secret_value()).aio
-
 safety_settings = [
     types.SafetySetting(
         category="HARM_CATEGORY_HARASSMENT",
@@ -33,44 +29,44 @@ safety_settings = [
 ]
 
 
-async def generate_image(prompt: str) -> tuple[str, str] | None:
+async def generate_image(
+    prompt: str, user_hash: str | None = None
+) -> tuple[str, str] | None:
     """
-    Generate an image using Google's Gemini model and save it to generated/images directory.
+    Generate an image using Google's Gemini model and save it to the asset store.
 
     Args:
         prompt (str): The text prompt to generate the image from
+        user_hash (str): User the image is for; kept in memory for later edits
 
     Returns:
         str: Path to the generated image file, or None if generation failed
     """
-    # Ensure the generated/images directory exists
-    output_dir = "generated/images"
-    os.makedirs(output_dir, exist_ok=True)
-
     logger.info(f"Generating image with prompt: {prompt}")
 
     try:
-        response = await client.models.generate_content(
-            model="gemini-2.0-flash-preview-image-generation",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_modalities=["TEXT", "IMAGE"],
-                safety_settings=safety_settings,
+        response = await get_hedger().call(
+            "image_generate",
+            lambda key: genai_client(key).aio.models.generate_content(
+                model="gemini-2.0-flash-preview-image-generation",
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    response_modalities=["TEXT", "IMAGE"],
+                    safety_settings=safety_settings,
+                ),
             ),
+            settings.image_deadline_seconds,
         )
 
         # Process the response parts
         image_saved = False
         for part in response.candidates[0].content.parts:
             if part.inline_data is not None:
-                # Create a filename with timestamp
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"gemini_{timestamp}.png"
-                filepath = os.path.join(output_dir, filename)
-
-                # Save the image
-                image = Image.open(BytesIO(part.inline_data.data))
-                await asyncio.to_thread(image.save, filepath, "PNG")
+                # Save the image as returned, plus its smaller variants
+                filepath = await store_image(part.inline_data.data)
+                await get_image_memory().remember(
+                    user_hash, filepath, part.inline_data.data
+                )
                 logger.info(f"Image saved to: {filepath}")
                 image_saved = True
 
@@ -86,58 +82,59 @@ async def generate_image(prompt: str) -> tuple[str, str] | None:
         return None, None
 
 
-async def modify_image(image_path: str, modification_prompt: str) -> str | None:
+async def modify_image(
+    image_path: str, modification_prompt: str, user_hash: str | None = None
+) -> str | None:
     """
     Modify an existing image using Google's Gemini model based on a text prompt.
 
+    The input image is taken from the user's recent images in memory when it
+    is there, and read from disk otherwise. Either way it is sent within the
+    upload budget.
+
     Args:
         image_path (str): Path to the existing image file
         modification_prompt (str): The text prompt describing how to modify the image
+        user_hash (str): User whose scene image is modified
 
     Returns:
         str: Path to the modified image file, or None if modification failed
     """
-    # Ensure the generated/images directory exists
-    output_dir = "generated/images"
-    os.makedirs(output_dir, exist_ok=True)
-
     logger.info(f"Modifying current scene image with prompt: {modification_prompt}")
 
-    # Check if the input image exists
-    if not os.path.exists(image_path):
+    try:
+        data, mime_type = await get_image_memory().upload(user_hash, image_path)
+    except FileNotFoundError:
         logger.error(f"Error: Image file not found at {image_path}")
-        return None
-
-    key = settings.gemini_api_key.get_secret_value()
-
-    client = genai.Client(api_key=key).aio
+        return None, None
 
     try:
-        # Load the input image
-        input_image = Image.open(image_path)
+        # Encoded once, not by the SDK for every attempt
+        input_image = types.Part.from_bytes(data=data, mime_type=mime_type)
 
         # Make the API call with both text and image
-        response = await client.models.generate_content(
-            model="gemini-2.0-flash-preview-image-generation",
-            contents=[modification_prompt, input_image],
-            config=types.GenerateContentConfig(
-                response_modalities=["TEXT", "IMAGE"],
-                safety_settings=safety_settings,
+        response = await get_hedger().call(
+            "image_modify",
+            lambda key: genai_client(key).aio.models.generate_content(
+                model="gemini-2.0-flash-preview-image-generation",
+                contents=[modification_prompt, input_image],
+                config=types.GenerateContentConfig(
+                    response_modalities=["TEXT", "IMAGE"],
+                    safety_settings=safety_settings,
+                ),
             ),
+            settings.image_deadline_seconds,
         )
 
         # Process the response parts
         image_saved = False
         for part in response.candidates[0].content.parts:
             if part.inline_data is not None:
-                # Create a filename with timestamp
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"gemini_modified_{timestamp}.png"
-                filepath = os.path.join(output_dir, filename)
-
-                # Save the modified image
-                modified_image = Image.open(BytesIO(part.inline_data.data))
-                await asyncio.to_thread(modified_image.save, filepath, "PNG")
+                # Save the modified image as returned, plus its smaller variants
+                filepath = await store_image(part.inline_data.data)
+                await get_image_memory().remember(
+                    user_hash, filepath, part.inline_data.data
+                )
                 logger.info(f"Modified image saved to: {filepath}")
                 image_saved = True
 
@@ -0,0 +1,173 @@
+"""Recent scene images of each user, ready to send back to the model.
+
+``modify_image`` edits the previous picture of a scene. It used to check
+the file on disk and open it with PIL. The SDK then encoded it again as a
+full-size PNG for every attempt, on the event loop. Now each image that
+is generated or modified is turned into an upload by
+:func:`prepare_upload` right away, and kept in an :class:`ImageMemory`
+under its user and path. An edit chain therefore finds the previous image
+in memory. Only after a restart, or for an image made by another process,
+is it read from disk once.
+
+Uploads are limited to ``image_upload_max_side`` pixels and
+``image_upload_max_kb`` KB. Images within both limits are sent as they
+are. Larger ones are downscaled and saved as JPEG, lowering the quality
+until they fit.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from config import settings
+from images.variants import image_suffix
+
+_MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".webp": "image/webp"}
+_QUALITIES = (85, 75, 65, 55, 45)
+
+# Upload bytes and their MIME type.
+Upload = Tuple[bytes, str]
+
+
+@dataclass
+class ImageMemoryStats:
+    """Hits, disk reads and the bytes uploaded instead of the originals."""
+
+    hits: int = 0
+    disk_reads: int = 0
+    prepared: int = 0
+    prepare_seconds: float = 0.0
+    original_bytes: int = 0
+    upload_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.disk_reads
+        return self.hits / lookups if lookups else 0.0
+
+
+_stats = ImageMemoryStats()
+
+
+def get_image_memory_stats() -> ImageMemoryStats:
+    return _stats
+
+
+def _fit(image: Image.Image, max_side: int) -> Image.Image:
+    if max(image.size) <= max_side:
+        return image
+    scale = max_side / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS)
+
+
+def prepare_upload(data: bytes) -> Upload:
+    """Shrink encoded image bytes to the upload budget."""
+    started = time.perf_counter()
+    budget = settings.image_upload_max_kb * 1024
+    suffix = image_suffix(data)
+    image = Image.open(BytesIO(data))
+    if suffix in _MIME_TYPES and (
+        len(data) <= budget and max(image.size) <= settings.image_upload_max_side
+    ):
+        upload = data, _MIME_TYPES[suffix]
+    else:
+        image = _fit(image.convert("RGB"), settings.image_upload_max_side)
+        while True:
+            for quality in _QUALITIES:
+                buffer = BytesIO()
+                image.save(buffer, "JPEG", quality=quality)
+                if buffer.tell() <= budget:
+                    break
+            if buffer.tell() <= budget or max(image.size) <= 64:
+                break
+            image = _fit(image, max(image.size) // 2)
+        upload = buffer.getvalue(), "image/jpeg"
+    _stats.prepared += 1
+    _stats.prepare_seconds += time.perf_counter() - started
+    return upload
+
+
+def _read_upload(path: str) -> Tuple[Upload, int]:
+    with open(path, "rb") as f:
+        data = f.read()
+    return prepare_upload(data), len(data)
+
+
+class ImageMemory:
+    """Per-user LRU of the uploads of the latest images."""
+
+    def __init__(
+        self, users: Optional[int] = None, per_user: Optional[int] = None
+    ) -> None:
+        self.users = users or settings.image_memory_users
+        self.per_user = per_user or settings.image_memory_per_user
+        # user -> path -> (upload, size of the original)
+        self._uploads: "OrderedDict[str, OrderedDict[str, Tuple[Upload, int]]]" = (
+            OrderedDict()
+        )
+
+    def _put(self, user_hash: str, path: str, entry: Tuple[Upload, int]) -> None:
+        uploads = self._uploads.pop(user_hash, None) or OrderedDict()
+        uploads.pop(path, None)
+        uploads[path] = entry
+        while len(uploads) > self.per_user:
+            uploads.popitem(last=False)
+        self._uploads[user_hash] = uploads
+        while len(self._uploads) > self.users:
+            self._uploads.popitem(last=False)
+
+    async def remember(self, user_hash: Optional[str], path: str, data: bytes) -> None:
+        """Keep the upload of a new image of ``user_hash``."""
+        if user_hash is None:
+            return
+        upload = await asyncio.to_thread(prepare_upload, data)
+        self._put(user_hash, path, (upload, len(data)))
+
+    async def upload(self, user_hash: Optional[str], path: str) -> Upload:
+        """Upload of the image at ``path``, from memory or else from disk.
+
+        Raises FileNotFoundError when the image is in neither.
+        """
+        uploads = self._uploads.get(user_hash) if user_hash else None
+        entry = uploads.get(path) if uploads else None
+        if entry is not None:
+            _stats.hits += 1
+        else:
+            _stats.disk_reads += 1
+            entry = await asyncio.to_thread(_read_upload, path)
+        if user_hash:
+            self._put(user_hash, path, entry)
+        upload, original = entry
+        _stats.original_bytes += original
+        _stats.upload_bytes += len(upload[0])
+        return upload
+
+    def forget(self, user_hash: str) -> None:
+        self._uploads.pop(user_hash, None)
+
+    def __len__(self) -> int:
+        return sum(len(uploads) for uploads in self._uploads.values())
+
+
+_memory: Optional[ImageMemory] = None
+
+
+def get_image_memory() -> ImageMemory:
+    global _memory
+    if _memory is None:
+        _memory = ImageMemory()
+    return _memory
+
+
+def set_image_memory(memory: Optional[ImageMemory]) -> None:
+    """Replace the shared memory; ``None`` recreates it from settings."""
+    global _memory
+    _memory = memory
@@ -0,0 +1,275 @@
+"""Original image bytes plus smaller WebP/JPEG variants for serving.
+
+The image model returns PNG or JPEG bytes. :func:`store_image` writes
+them to the asset store as they are, without decoding the image and
+encoding it again as PNG. Only bytes in a format we do not recognise are
+re-encoded.
+
+Each image also gets the ``image_variants`` from the settings: by default
+a desktop and a mobile WebP and a JPEG thumbnail, none wider than the
+original. They are encoded in the background by a :class:`VariantPool`
+of ``image_variant_workers`` threads, so the step returns as soon as the
+original is stored. Each image is decoded once for all of its variants. If
+``image_variant_queue`` images are already waiting, the new image keeps
+only its original. Identical images already have their variants and are
+not encoded again.
+
+The stored path is always the original, since that is what
+``modify_image`` sends back to the model. The UI calls
+:func:`pick_variant` when it shows an image, to get the smallest stored
+file that still covers the client's screen.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Dict, Mapping, Optional, Set, Tuple
+
+from PIL import Image
+
+from config import ImageVariant, settings
+from images.asset_store import get_asset_store
+
+logger = logging.getLogger(__name__)
+
+# Viewport widths assumed for clients that do not report one.
+DESKTOP_WIDTH = 1920
+MOBILE_WIDTH = 960
+
+_SUFFIXES = {"webp": ".webp", "jpeg": ".jpg"}
+
+
+@dataclass
+class VariantStats:
+    """Encoding work and the bytes served instead of the originals."""
+
+    passthrough: int = 0
+    reencoded: int = 0
+    skipped: int = 0
+    encoded: Dict[str, int] = field(default_factory=dict)
+    encode_seconds: Dict[str, float] = field(default_factory=dict)
+    variant_bytes: Dict[str, int] = field(default_factory=dict)
+    served: int = 0
+    served_bytes: int = 0
+    original_bytes: int = 0
+
+    def record(self, name: str, size: int, seconds: float) -> None:
+        self.encoded[name] = self.encoded.get(name, 0) + 1
+        self.encode_seconds[name] = self.encode_seconds.get(name, 0.0) + seconds
+        self.variant_bytes[name] = self.variant_bytes.get(name, 0) + size
+
+    @property
+    def bytes_saved(self) -> float:
+        """Share of the original bytes not sent thanks to variants."""
+        if not self.original_bytes:
+            return 0.0
+        return 1 - self.served_bytes / self.original_bytes
+
+
+_stats = VariantStats()
+
+
+def get_variant_stats() -> VariantStats:
+    return _stats
+
+
+def image_suffix(data: bytes) -> Optional[str]:
+    """File suffix of encoded image bytes, or None for unknown formats."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def _png_bytes(data: bytes) -> bytes:
+    buffer = BytesIO()
+    Image.open(BytesIO(data)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def encode_variants(
+    data: bytes, variants: Mapping[str, ImageVariant]
+) -> Dict[str, Tuple[bytes, float]]:
+    """Encode ``variants`` of an image; returns their bytes and encode time."""
+    source = Image.open(BytesIO(data))
+    source.load()
+    if source.mode not in ("RGB", "RGBA"):
+        source = source.convert("RGBA" if "transparency" in source.info else "RGB")
+    encoded = {}
+    # Largest first, so each variant is resized from the previous one.
+    ordered = sorted(variants.items(), key=lambda item: -item[1].max_width)
+    image = source
+    for name, variant in ordered:
+        started = time.perf_counter()
+        if image.width > variant.max_width:
+            height = max(1, round(image.height * variant.max_width / image.width))
+            image = image.resize((variant.max_width, height), Image.LANCZOS)
+        out = image.convert("RGB") if variant.format == "jpeg" else image
+        buffer = BytesIO()
+        out.save(
+            buffer,
+            variant.format.upper(),
+            quality=variant.quality,
+            method=variant.method,
+        )
+        encoded[name] = (buffer.getvalue(), time.perf_counter() - started)
+    return encoded
+
+
+class VariantPool:
+    """Bounded thread pool that encodes and stores image variants."""
+
+    def __init__(
+        self, workers: Optional[int] = None, queue: Optional[int] = None
+    ) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or settings.image_variant_workers,
+            thread_name_prefix="image-variants",
+        )
+        self._queue = queue if queue is not None else settings.image_variant_queue
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _missing(path: str) -> Dict[str, ImageVariant]:
+        store = get_asset_store()
+        return {
+            name: variant
+            for name, variant in settings.image_variants.items()
+            if not os.path.exists(
+                store.variant_path(path, name, _SUFFIXES[variant.format])
+            )
+        }
+
+    async def make_variants(self, path: str, data: bytes) -> Dict[str, str]:
+        """Store the missing variants of the asset at ``path``; returns their paths."""
+        missing = self._missing(path)
+        if not missing:
+            return {}
+        loop = asyncio.get_running_loop()
+        encoded = await loop.run_in_executor(
+            self._executor, encode_variants, data, missing
+        )
+        store = get_asset_store()
+        paths = {}
+        for name, (blob, seconds) in encoded.items():
+            suffix = _SUFFIXES[missing[name].format]
+            paths[name] = await store.put_variant(path, name, blob, suffix)
+            _stats.record(name, len(blob), seconds)
+        return paths
+
+    def submit(self, path: str, data: bytes) -> Optional[asyncio.Task]:
+        """Make the variants of the asset at ``path`` in the background.
+
+        Returns None when they all exist already, or when ``queue`` images
+        are already waiting and this one is served as is.
+        """
+        if not self._missing(path):
+            return None
+        if len(self._tasks) >= self._queue:
+            _stats.skipped += 1
+            logger.warning(
+                "[Images] %d images waiting for variants; serving %s as is",
+                len(self._tasks),
+                path,
+            )
+            return None
+        task = asyncio.get_running_loop().create_task(self.make_variants(path, data))
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._done(path, done))
+        return task
+
+    def _done(self, path: str, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(
+                "[Images] Could not encode variants of %s: %s", path, task.exception()
+            )
+
+    async def join(self) -> None:
+        """Wait until the variants submitted so far are stored."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+_pool: Optional[VariantPool] = None
+
+
+def get_variant_pool() -> VariantPool:
+    global _pool
+    if _pool is None:
+        _pool = VariantPool()
+    return _pool
+
+
+def set_variant_pool(pool: Optional[VariantPool]) -> None:
+    """Replace the shared pool; ``None`` recreates it from settings."""
+    global _pool
+    _pool = pool
+
+
+async def store_image(data: bytes) -> str:
+    """Store image bytes from the model; returns the path of the original.
+
+    The variants are made in the background, and :func:`pick_variant`
+    serves the original until they are stored.
+    """
+    suffix = image_suffix(data)
+    if suffix is None:
+        data, suffix = await asyncio.to_thread(_png_bytes, data), ".png"
+        _stats.reencoded += 1
+    else:
+        _stats.passthrough += 1
+    path = await get_asset_store().put(data, suffix)
+    get_variant_pool().submit(path, data)
+    return path
+
+
+def client_width(headers: Optional[Mapping[str, str]]) -> int:
+    """Viewport width to serve for a client, guessed from its user agent."""
+    agent = (headers or {}).get("user-agent", "")
+    if "Mobi" in agent or "Android" in agent:
+        return MOBILE_WIDTH
+    return DESKTOP_WIDTH
+
+
+def pick_variant(path: Optional[str], width: int = DESKTOP_WIDTH) -> Optional[str]:
+    """Smallest stored file of an image that is at least ``width`` wide.
+
+    Falls back to the widest variant for wider clients, and to the original
+    when it has no variants or is smaller than the chosen one.
+    """
+    if not path or not os.path.exists(path):
+        return path
+    store = get_asset_store()
+    stored = []
+    for name, variant in settings.image_variants.items():
+        target = store.variant_path(path, name, _SUFFIXES[variant.format])
+        if os.path.exists(target):
+            stored.append((variant.max_width, target))
+    stored.sort()
+    wide_enough = [target for max_width, target in stored if max_width >= width]
+    chosen = path
+    if wide_enough:
+        chosen = wide_enough[0]
+    elif stored:
+        chosen = stored[-1][1]
+    original = os.path.getsize(path)
+    size = os.path.getsize(chosen)
+    if size > original:
+        chosen, size = path, original
+    _stats.served += 1
+    _stats.served_bytes += size
+    _stats.original_bytes += original
+    return chosen
@@ -7,7 +7,9 @@ from audio.audio_generator import (
 import logging
 from agent.llm_agent import process_user_input
 from images.image_generator import modify_image
-from agent.runner import process_step
+from agent.image_delivery import wait_for_image
+from images.variants import client_width, pick_variant
+from agent.runner import stream_step
 import uuid
 from game_constructor import (
     SETTING_SUGGESTIONS,
@@ -26,9 +28,17 @@ logger = logging.getLogger(__name__)
 
 async def return_to_constructor(user_hash: str):
     """Return to the constructor and reset user state and audio."""
+    from agent.image_delivery import cancel_image_jobs
     from agent.redis_state import reset_user_state
+    from agent.speculation import speculator
+    from images.asset_store import get_asset_store
+    from images.image_memory import get_image_memory
 
+    speculator.cancel(user_hash)
+    cancel_image_jobs(user_hash)
     await reset_user_state(user_hash)
+    await get_asset_store().drop_user(user_hash)
+    get_image_memory().forget(user_hash)
     await cleanup_music_session(user_hash)
     # Generate a new hash to avoid stale state
     new_hash = str(uuid.uuid4())
@@ -41,34 +51,43 @@ async def return_to_constructor(user_hash: str):
     )
 
 
-async def update_scene(user_hash: str, choice):
+async def update_scene(user_hash: str, choice, request: gr.Request = None):
     logger.info(f"Updating scene with choice: {choice}")
+    width = client_width(request.headers if request else None)
     if not isinstance(choice, str):
-        return gr.update(), gr.update(), gr.update(), gr.update()
+        yield gr.update(), gr.update(), gr.update(), gr.update()
+        return
 
-    result = await process_step(
+    async for event in stream_step(
         user_hash=user_hash,
         step="choose",
         choice_text=choice,
-    )
+    ):
+        if "text" in event:
+            yield gr.update(value=event["text"]), gr.update(), gr.update(), gr.update()
+        else:
+            result = event["response"]
 
     if result.get("game_over"):
         ending = result["ending"]
         ending_text = (
             ending.get("description") or ending.get("condition", "")
         ) + "\n[THE END]"
-        ending_image = result.get("image")
-        return (
+        ending_image = pick_variant(result.get("image"), width)
+        yield (
             gr.update(value=ending_text),
             gr.update(value=ending_image),
             gr.Radio(choices=[], label="", value=None, visible=False),
             gr.update(value="", visible=False),
         )
+        return
 
     scene = result["scene"]
-    return (
+    image = scene.get("image")
+    yield (
         scene["description"],
-        scene.get("image", ""),
+        # A deferred image follows below; the old picture stays until then.
+        pick_variant(image, width) if image else gr.update(),
         gr.Radio(
             choices=[ch["text"] for ch in scene.get("choices", [])],
             label="What do you choose? (select an option or write your own)",
@@ -77,6 +96,11 @@ async def update_scene(user_hash: str, choice):
         ),
         gr.update(value=""),
     )
+    if not image:
+        image = await wait_for_image(user_hash, scene["scene_id"])
+        if image:
+            image = pick_variant(image, width)
+            yield gr.update(), gr.update(value=image), gr.update(), gr.update()
 
 
 def update_preview(setting, name, age, background, personality, genre):
@@ -102,6 +126,7 @@ async def start_game_with_music(
     char_background: str,
     char_personality: str,
     genre: str,
+    request: gr.Request = None,
 ):
     """Start the game with custom settings and initialize music"""
     yield (
@@ -115,8 +140,7 @@ async def start_game_with_music(
         gr.update(),  # custom choice unchanged
     )
 
-    # First, get the game interface updates
-    result = await start_game_with_settings(
+    async for update in start_game_with_settings(
         user_hash,
         setting_desc,
         char_name,
@@ -124,8 +148,9 @@ async def start_game_with_music(
         char_background,
         char_personality,
         genre,
-    )
-    yield result
+        width=client_width(request.headers if request else None),
+    ):
+        yield update
 
 
 with gr.Blocks(
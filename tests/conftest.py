@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# ``config.AppSettings`` requires the API keys; tests never reach Gemini.
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("GEMINI_API_KEYS", "test-key")
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from agent import redis_state  # noqa: E402
+from agent.memory_state import MemoryStateBackend  # noqa: E402
+
+
+@pytest.fixture
+def backend():
+    """Process-local state backend installed for the duration of a test."""
+    previous = redis_state.get_state_backend()
+    backend = MemoryStateBackend()
+    redis_state.set_state_backend(backend)
+    yield backend
+    redis_state.set_state_backend(previous)
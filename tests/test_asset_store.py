@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from images.asset_store import AssetStore, digest_of
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "asset_gc_grace_seconds", 0)
+    store = AssetStore(str(tmp_path / "images"))
+    yield store
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_identical_images_are_stored_once(store):
+    first = await store.put(b"image one")
+    again = await store.put(b"image one")
+    other = await store.put(b"image two")
+
+    assert first == again != other
+    assert digest_of(first) is not None
+    with open(first, "rb") as f:
+        assert f.read() == b"image one"
+    assert (await store.size())["assets"] == 2
+    assert store.stats.dedupe_ratio == pytest.approx(1 / 3)
+
+
+@pytest.mark.asyncio
+async def test_gc_keeps_referenced_assets(store):
+    kept = await store.put(b"kept")
+    shared = await store.put(b"shared")
+    orphan = await store.put(b"orphan")
+    await store.add_ref("alice", "s1", kept)
+    await store.add_ref("alice", "s2", shared)
+    await store.add_ref("bob", "s1", shared)
+    assert await store.add_ref("bob", "s2", "generated/images/old.png") is None
+
+    assert await store.collect_garbage() == [orphan]
+    assert not os.path.exists(orphan)
+
+    await store.drop_user("alice")
+    assert await store.collect_garbage() == [kept]
+    assert os.path.exists(shared)
+
+    report = await store.report()
+    assert report["assets"] == 1 and report["refs"] == 1
+    assert report["gc_removed"] == 2 and report["gc_runs"] >= 2
+
+
+@pytest.mark.asyncio
+async def test_recent_unreferenced_assets_survive_gc(store, monkeypatch):
+    monkeypatch.setattr(settings, "asset_gc_grace_seconds", 60)
+    path = await store.put(b"just generated")
+    assert await store.collect_garbage() == []
+    assert os.path.exists(path)
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from agent import ending_policy, redis_state
+from agent.models import Ending, Milestone, StoryFrame, UserChoice
+
+FRAME = StoryFrame(
+    lore="lore",
+    goal="goal",
+    milestones=[
+        Milestone(id="map", description="Find the map"),
+        Milestone(id="key", description="Find the key"),
+    ],
+    endings=[Ending(id="escape", type="good", condition="map and key")],
+    setting="s",
+    character={},
+    genre="g",
+)
+
+
+@pytest.fixture
+def backend(backend, monkeypatch):
+    monkeypatch.setattr(settings, "ending_check_min_steps", 3)
+    monkeypatch.setattr(settings, "ending_check_min_coverage", 1.0)
+    monkeypatch.setattr(settings, "ending_check_every", 4)
+    monkeypatch.setattr(ending_policy, "_stats", ending_policy.EndingCheckStats())
+    return backend
+
+
+async def _play(scene_milestones, ending_at):
+    """Play steps with a scripted LLM until it reports an ending.
+
+    ``scene_milestones`` maps step numbers to the milestones the scene
+    reports; ``ending_at(state)`` is the scripted ending check.
+    """
+    await redis_state.set_story_frame("u", FRAME)
+    checked = []
+    for step in range(1, 30):
+        async with redis_state.step_state("u"):
+            await redis_state.append_user_choice(
+                "u", UserChoice(scene_id=str(step), choice_text="go")
+            )
+
+            async def check():
+                checked.append(step)
+                state = await redis_state.get_user_state("u")
+                return {"ending_reached": ending_at(state)}
+
+            result = await ending_policy.check_ending_if_plausible("u", check)
+            if result["ending_reached"]:
+                return step, checked
+            await ending_policy.record_milestones("u", scene_milestones.get(step, []))
+    raise AssertionError("no ending reached")
+
+
+@pytest.mark.asyncio
+async def test_checks_start_once_milestones_are_covered(backend):
+    step, checked = await _play(
+        {2: ["map", "unknown"], 5: ["key"]},
+        lambda state: state.milestones_achieved == {"map", "key"},
+    )
+    assert step == 6
+    assert checked == [4, 6]
+    assert (await backend.get("u")).milestones_achieved == {"map", "key"}
+    stats = ending_policy.get_ending_check_stats()
+    assert stats.checks == 2 and stats.skipped == 4
+    assert stats.skip_share == pytest.approx(4 / 6)
+
+
+@pytest.mark.asyncio
+async def test_endings_without_milestones_are_found_periodically(backend):
+    # A sudden ending from step 5 on, with no milestone progress at all.
+    step, checked = await _play({}, lambda state: len(state.user_choices) >= 5)
+    assert step == 8
+    assert checked == [4, 8]
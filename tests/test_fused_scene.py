@@ -0,0 +1,142 @@
+import json
+import os
+import sys
+from typing import List
+
+import pytest
+from langchain_core.messages import AIMessage
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from agent import image_agent, redis_state, repair
+from agent.models import ChangeScene, FusedSceneLLM
+from audio import audio_generator
+from config import settings
+
+CHOICES = [
+    {"text": "Open the door", "next_scene_short_desc": "Hall"},
+    {"text": "Climb the stairs", "next_scene_short_desc": "Tower"},
+]
+FUSED = {
+    "description": "I stand in front of a heavy oak door.",
+    "choices": CHOICES,
+    "change_scene": {
+        "change_scene": "change_completely",
+        "scene_description": "FPS view. A heavy oak door in a torch-lit corridor.",
+    },
+    "music": "slow dark ambient, low strings, distant drums",
+}
+
+
+class ScriptedLLM:
+    """Stands in for ``task_llm``; answers every call from a script."""
+
+    def __init__(self, answers: List):
+        self.answers = answers
+        self.tasks: List[str] = []
+
+    def __call__(self, task, schema=None, temperature=None, include_raw=False):
+        self.tasks.append(task)
+        return self
+
+    async def ainvoke(self, prompt):
+        return self.answers.pop(0)
+
+
+def raw_answer(content, parsed=None):
+    return {"raw": AIMessage(content=content), "parsed": parsed}
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(repair, "_stats", {})
+    monkeypatch.setattr(settings, "llm_repair_backoff", 0.01)
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    def install(*answers):
+        llm = ScriptedLLM(list(answers))
+        monkeypatch.setattr(repair, "task_llm", llm)
+        return llm
+
+    return install
+
+
+@pytest.mark.asyncio
+async def test_fused_answer_is_parsed_in_one_call(scripted, backend):
+    content = json.dumps(FUSED)
+    llm = scripted(raw_answer(content, FusedSceneLLM.model_validate_json(content)))
+    resp = await repair.structured_call("generate_scene", "scene", FusedSceneLLM, "p")
+    assert llm.tasks == ["scene"]
+    assert resp.change_scene.change_scene == "change_completely"
+    assert repair.get_repair_stats()["generate_scene"].valid == 1
+
+    scene = resp.to_scene("s1")
+    assert [c.text for c in scene.choices] == ["Open the door", "Climb the stairs"]
+    await redis_state.add_scene("u", scene)
+    stored = (await redis_state.get_user_state("u")).scenes["s1"]
+    assert stored.music == FUSED["music"]
+
+
+@pytest.mark.asyncio
+async def test_malformed_fused_answer_is_completed(scripted):
+    # The model answered like a plain scene and was cut off.
+    truncated = json.dumps({"description": FUSED["description"], "choices": CHOICES})
+    fields = repair._repair_model(FusedSceneLLM, ("change_scene", "music"))
+    llm = scripted(
+        raw_answer(truncated[:-2]),
+        fields(change_scene=ChangeScene(change_scene="no_change"), music="calm harp"),
+    )
+    resp = await repair.structured_call("generate_scene", "scene", FusedSceneLLM, "p")
+    # Only the missing fields were asked for, on the repair route.
+    assert llm.tasks == ["scene", "repair"]
+    assert resp.music == "calm harp" and len(resp.choices) == 2
+    assert resp.change_scene.change_scene == "no_change"
+    assert repair.get_repair_stats()["generate_scene"].completed == 1
+
+
+@pytest.mark.asyncio
+async def test_scene_image_prompt_takes_the_fused_decision(monkeypatch):
+    async def agent(description, request_id):
+        raise AssertionError("image agent not expected")
+
+    monkeypatch.setattr(image_agent, "generate_image_prompt", agent)
+    scene = {"description": FUSED["description"], "change_scene": FUSED["change_scene"]}
+    change = await image_agent.scene_image_prompt(scene, "r")
+    assert change.scene_description == FUSED["change_scene"]["scene_description"]
+    assert "change_scene" not in scene
+
+
+@pytest.mark.asyncio
+async def test_fused_change_without_prompt_falls_back_to_the_agent(monkeypatch):
+    calls = []
+
+    async def agent(description, request_id):
+        calls.append(description)
+        return ChangeScene(change_scene="modify", scene_description="door")
+
+    monkeypatch.setattr(image_agent, "generate_image_prompt", agent)
+    scene = {
+        "description": FUSED["description"],
+        "change_scene": {"change_scene": "modify", "scene_description": None},
+    }
+    change = await image_agent.scene_image_prompt(scene, "r")
+    assert change.scene_description == "door"
+    assert calls == [FUSED["description"]] and "change_scene" not in scene
+
+
+@pytest.mark.asyncio
+async def test_change_music_tone_skips_an_empty_tone(monkeypatch):
+    tones = []
+
+    class Session:
+        async def set_weighted_prompts(self, prompts):
+            tones.extend(p.text for p in prompts)
+
+    monkeypatch.setitem(audio_generator.sessions, "u", {"session": Session()})
+    await audio_generator.change_music_tone("u", None)
+    await audio_generator.change_music_tone("u", "")
+    assert tones == []
+    await audio_generator.change_music_tone("u", FUSED["music"])
+    assert tones == [FUSED["music"]]
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from agent.hedging import Hedger
+from agent.key_pool import KeyPool, set_key_pool
+
+
+@pytest.fixture
+def pool():
+    pool = KeyPool(["a", "b"])
+    set_key_pool(pool)
+    yield pool
+    set_key_pool(None)
+
+
+def stalling_call(calls, cancelled):
+    """The first attempt stalls, later ones answer quickly."""
+
+    async def fn(key):
+        calls.append(key)
+        try:
+            await asyncio.sleep(5 if len(calls) == 1 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(key)
+            raise
+        return key
+
+    return fn
+
+
+def seeded_hedger(**kwargs):
+    hedger = Hedger(min_samples=5, **kwargs)
+    for _ in range(5):
+        hedger.observe("scene", 0.05)
+    return hedger
+
+
+@pytest.mark.asyncio
+async def test_slow_call_is_hedged_on_another_key(pool):
+    calls, cancelled = [], []
+    hedger = seeded_hedger()
+
+    answer = await hedger.call("scene", stalling_call(calls, cancelled), 2)
+    assert len(calls) == 2 and calls[0] != calls[1]
+    assert answer == calls[1]
+    await asyncio.sleep(0)
+    assert cancelled == [calls[0]]
+    stats = hedger.stats["scene"]
+    assert stats.hedged == 1 and stats.hedge_wins == 1
+
+
+@pytest.mark.asyncio
+async def test_budget_caps_hedges(pool):
+    calls, cancelled = [], []
+    hedger = seeded_hedger(budget=0.0, burst=1)
+
+    await hedger.call("scene", stalling_call(calls, cancelled), 2)
+    # The single hedge is spent; the next slow call has to wait or time out.
+    with pytest.raises(TimeoutError):
+        await hedger.call("scene", lambda key: asyncio.sleep(5), 0.2)
+    stats = hedger.stats["scene"]
+    assert stats.hedged == 1 and stats.over_budget == 1
+
+
+@pytest.mark.asyncio
+async def test_deadline_cancels_the_call(pool):
+    calls, cancelled = [], []
+    hedger = Hedger()
+
+    with pytest.raises(TimeoutError):
+        await hedger.call("image", stalling_call(calls, cancelled), 0.1)
+    await asyncio.sleep(0)
+    assert cancelled == calls
+    assert hedger.stats["image"].deadline_exceeded == 1
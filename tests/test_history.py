@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from agent import history, redis_state
+from agent.models import HistorySummary, UserChoice, UserState
+from agent.state_context import StateChanges
+
+
+@pytest.fixture
+def backend(backend, monkeypatch):
+    monkeypatch.setattr(settings, "history_recent_choices", 3)
+    monkeypatch.setattr(settings, "history_summary_batch", 4)
+    return backend
+
+
+async def _choose(n: int, start: int = 0) -> None:
+    for i in range(start, start + n):
+        await redis_state.append_user_choice(
+            "u", UserChoice(scene_id=f"scene-{i}", choice_text=f"c{i}")
+        )
+
+
+async def _summarize(summary, choices):
+    return " ".join(filter(None, [summary, "+".join(c.choice_text for c in choices)]))
+
+
+@pytest.mark.asyncio
+async def test_older_choices_are_folded_into_the_summary(backend):
+    await _choose(6)
+    # Only three choices wait beyond the recent ones; not a full batch yet.
+    assert history.schedule_summary("u", await backend.get("u"), _summarize) is None
+    assert await history.build_history("u") == "c0; c1; c2; c3; c4; c5"
+
+    await _choose(4, start=6)
+    task = history.schedule_summary("u", await backend.get("u"), _summarize)
+    assert await task
+    state = await backend.get("u")
+    assert state.history.summary == "c0+c1+c2+c3+c4+c5+c6"
+    assert state.history.covered == 7
+    assert len(state.user_choices) == 10
+    assert await history.build_history("u") == "c0+c1+c2+c3+c4+c5+c6 Then: c7; c8; c9"
+
+
+@pytest.mark.asyncio
+async def test_summary_is_dropped_when_history_changed_meanwhile(backend):
+    await _choose(8)
+
+    async def slow_summarize(summary, choices):
+        await backend.apply(
+            "u",
+            StateChanges(fields={"history": HistorySummary(summary="x", covered=2)}),
+        )
+        return "late"
+
+    assert not await history.summarize_history("u", slow_summarize)
+    assert (await backend.get("u")).history.summary == "x"
+
+
+def test_prompt_history_stays_bounded():
+    state = UserState()
+    sizes = []
+    for i in range(60):
+        state.user_choices.append(UserChoice(scene_id=str(i), choice_text="walk on"))
+        folded = history._to_fold(state)
+        if folded:
+            state.history = HistorySummary(
+                summary="s" * 400, covered=state.history.covered + len(folded)
+            )
+        sizes.append(history.estimate_tokens(history.format_history(state)))
+    assert max(sizes[30:]) == max(sizes[10:30])
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from agent import image_delivery, redis_state
+from agent.models import Scene
+
+
+@pytest.fixture
+def backend(backend, monkeypatch):
+    monkeypatch.setattr(settings, "image_poll_interval", 0.01)
+    return backend
+
+
+async def add_scene(backend, scene_id="s1"):
+    scene = Scene(scene_id=scene_id, description="Cave", choices=[])
+    await backend.add_scene("u", scene)
+
+
+def painter(calls, delay=0.0):
+    async def make():
+        await asyncio.sleep(delay)
+        calls.append(redis_state.current_step_state("u"))
+        await redis_state.update_scene_image("u", "s1", "cave.png")
+
+    return make
+
+
+@pytest.mark.asyncio
+async def test_image_waits_until_the_step_is_committed(backend):
+    await add_scene(backend)
+    calls = []
+    started = time.monotonic()
+    async with redis_state.step_state("u"):
+        with image_delivery.defer_images() as jobs:
+            await image_delivery.deliver_image("u", "s1", painter(calls, 0.05))
+        assert calls == [] and len(jobs) == 1
+
+    stats = image_delivery.get_delivery_stats()
+    images_before = stats.images
+    image_delivery.record_text(started)
+    tasks = image_delivery.start_image_jobs("u", jobs, started)
+    assert (await backend.get_scene("u", "s1")).image is None
+    assert await image_delivery.wait_for_image("u", "s1") == "cave.png"
+    await asyncio.wait(tasks)
+    # The job ran outside of any step and wrote straight to the store.
+    assert calls == [None]
+    assert stats.images == images_before + 1
+    assert stats.mean_time_to_image >= 0.05 > stats.mean_time_to_text
+
+
+@pytest.mark.asyncio
+async def test_images_are_awaited_outside_deferred_steps(backend):
+    await add_scene(backend)
+    calls = []
+    await image_delivery.deliver_image("u", "s1", painter(calls))
+    assert len(calls) == 1
+    assert await image_delivery.pending_image("u", "s1") == "cave.png"
+
+
+@pytest.mark.asyncio
+async def test_waiting_without_a_job_polls_the_store(backend):
+    await add_scene(backend, "s2")
+    assert await image_delivery.wait_for_image("u", "s2", timeout=0.05) is None
+
+    async def later():
+        await asyncio.sleep(0.05)
+        await backend.update_scene_image("u", "s2", "late.png")
+
+    writer = asyncio.create_task(later())
+    assert await image_delivery.wait_for_image("u", "s2", timeout=2) == "late.png"
+    await writer
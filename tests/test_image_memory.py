@@ -0,0 +1,78 @@
+import os
+import sys
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from images.image_memory import ImageMemory, get_image_memory_stats, prepare_upload
+
+
+def encoded(size, noise=False):
+    if noise:
+        pixels = np.random.default_rng(1).integers(0, 255, (size, size, 3))
+        image = Image.fromarray(pixels.astype(np.uint8))
+    else:
+        image = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_small_images_are_uploaded_as_they_are():
+    data = encoded(256)
+    assert prepare_upload(data) == (data, "image/png")
+
+
+def test_large_images_are_shrunk_to_the_budget(monkeypatch):
+    monkeypatch.setattr(settings, "image_upload_max_side", 512)
+    monkeypatch.setattr(settings, "image_upload_max_kb", 64)
+    upload, mime_type = prepare_upload(encoded(1024, noise=True))
+    assert mime_type == "image/jpeg"
+    assert len(upload) <= 64 * 1024
+    with Image.open(BytesIO(upload)) as image:
+        assert max(image.size) <= 512
+
+
+@pytest.mark.asyncio
+async def test_edit_chain_does_not_read_from_disk(tmp_path):
+    memory = ImageMemory(users=2, per_user=2)
+    stats = get_image_memory_stats()
+    data = encoded(64)
+    await memory.remember("u", "gone.png", data)
+    hits = stats.hits
+    assert await memory.upload("u", "gone.png") == (data, "image/png")
+    assert stats.hits == hits + 1
+
+    path = tmp_path / "on_disk.png"
+    path.write_bytes(data)
+    reads = stats.disk_reads
+    assert (await memory.upload("u", str(path)))[0] == data
+    path.unlink()
+    assert (await memory.upload("u", str(path)))[0] == data
+    assert stats.disk_reads == reads + 1
+
+    with pytest.raises(FileNotFoundError):
+        await memory.upload("other", "gone.png")
+
+
+@pytest.mark.asyncio
+async def test_memory_is_bounded_per_user_and_in_users():
+    memory = ImageMemory(users=2, per_user=2)
+    data = encoded(32)
+    for path in ("a.png", "b.png", "c.png"):
+        await memory.remember("u1", path, data)
+    assert len(memory) == 2
+    await memory.remember("u2", "a.png", data)
+    await memory.remember("u3", "a.png", data)
+    # u1 was least recently used, so it went first.
+    assert len(memory) == 2
+    with pytest.raises(FileNotFoundError):
+        await memory.upload("u1", "c.png")
+
+    memory.forget("u3")
+    assert len(memory) == 1
@@ -0,0 +1,91 @@
+import os
+import sys
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from images import variants
+from images.asset_store import AssetStore, digest_of, set_asset_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "asset_gc_grace_seconds", 0)
+    store = AssetStore(str(tmp_path / "images"))
+    set_asset_store(store)
+    pool = variants.VariantPool(workers=1)
+    variants.set_variant_pool(pool)
+    yield store
+    variants.set_variant_pool(None)
+    pool.close()
+    set_asset_store(None)
+    store.close()
+
+
+def encoded(fmt="PNG", size=(1200, 800)):
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_model_bytes_are_stored_as_returned(store):
+    data = encoded()
+    path = await variants.store_image(data)
+    assert path.endswith(".png")
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+    gif = await variants.store_image(encoded("GIF", (64, 64)))
+    assert gif.endswith(".png") and Image.open(gif).format == "PNG"
+    await variants.get_variant_pool().join()
+
+
+@pytest.mark.asyncio
+async def test_variants_are_resized_and_never_upscaled(store):
+    path = await variants.store_image(encoded())
+    # The original is served until the variants are stored.
+    assert variants.pick_variant(path, variants.MOBILE_WIDTH) == path
+    await variants.get_variant_pool().join()
+    sizes = {}
+    for name, variant in settings.image_variants.items():
+        suffix = ".jpg" if variant.format == "jpeg" else ".webp"
+        target = store.variant_path(path, name, suffix)
+        assert digest_of(target) == digest_of(path)
+        with Image.open(target) as image:
+            assert image.format == variant.format.upper()
+            sizes[name] = image.size
+    assert sizes == {"desktop": (1200, 800), "mobile": (960, 640), "thumbnail": (320, 213)}
+
+    assert variants.pick_variant(path, variants.MOBILE_WIDTH).endswith(".mobile.webp")
+    assert variants.pick_variant(path, 4000).endswith(".desktop.webp")
+    assert variants.pick_variant(path, 200).endswith(".thumbnail.jpg")
+
+
+@pytest.mark.asyncio
+async def test_saturated_pool_keeps_only_the_original(store):
+    variants.set_variant_pool(variants.VariantPool(workers=1, queue=0))
+    path = await variants.store_image(encoded())
+    assert variants.pick_variant(path, variants.MOBILE_WIDTH) == path
+    assert variants.get_variant_stats().skipped >= 1
+
+
+@pytest.mark.asyncio
+async def test_gc_removes_variants_with_their_original(store):
+    path = await variants.store_image(encoded())
+    await variants.get_variant_pool().join()
+    directory = os.path.dirname(path)
+    assert len(os.listdir(directory)) == 4
+    assert await store.collect_garbage() == [path]
+    assert os.listdir(directory) == []
+
+
+def test_mobile_clients_get_the_mobile_width():
+    phone = {"user-agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0) Mobile/15E148"}
+    assert variants.client_width(phone) == variants.MOBILE_WIDTH
+    assert variants.client_width(None) == variants.DESKTOP_WIDTH
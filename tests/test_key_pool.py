@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from agent.key_pool import KeyPool, KeyPoolExhausted, genai_client
+
+
+class FakeGemini(BaseHTTPRequestHandler):
+    """Returns 429 for the ``throttled`` key and a text answer otherwise."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    calls: list = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        key = self.headers.get("x-goog-api-key")
+        self.calls.append(key)
+        if key == "throttled":
+            status = 429
+            body = {"error": {"code": 429, "message": "Quota", "status": "RESOURCE_EXHAUSTED"}}
+        else:
+            status = 200
+            body = {
+                "candidates": [
+                    {"content": {"role": "model", "parts": [{"text": key}]}}
+                ]
+            }
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGemini)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(
+        settings, "llm_api_endpoint", f"http://127.0.0.1:{server.server_port}"
+    )
+    FakeGemini.calls = []
+    yield FakeGemini
+    server.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_throttled_key_cools_down_and_calls_move_on(fake_gemini):
+    pool = KeyPool(["throttled", "healthy"], cooldown=30)
+
+    async def generate(key):
+        response = await genai_client(key).aio.models.generate_content(
+            model="gemini-test", contents="hi"
+        )
+        return response.text
+
+    answers = await asyncio.gather(*(pool.call(generate) for _ in range(6)))
+    assert answers == ["healthy"] * 6
+    throttled_calls = fake_gemini.calls.count("throttled")
+    assert throttled_calls >= 1
+
+    # While it cools down the throttled key gets no more traffic.
+    answers = await asyncio.gather(*(pool.call(generate) for _ in range(4)))
+    assert answers == ["healthy"] * 4
+    assert fake_gemini.calls.count("throttled") == throttled_calls
+
+    stats = pool.stats()
+    throttled, healthy = stats["0:...tled"], stats["1:...lthy"]
+    assert throttled.throttled == throttled_calls
+    assert throttled.cooldown_remaining > 0
+    assert healthy.successes == 10 and healthy.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_quota_limits_and_exhaustion():
+    pool = KeyPool(["a", "b"], requests_per_minute=60, burst=1, acquire_timeout=0.1)
+
+    async with pool.lease() as first, pool.lease() as second:
+        assert {first, second} == {"a", "b"}
+        # Both buckets are empty and refill after a second.
+        with pytest.raises(KeyPoolExhausted):
+            await pool.acquire()
+    assert sum(s.requests for s in pool.stats().values()) == 2
+
+
+def test_errors_steer_calls_to_healthier_keys():
+    pool = KeyPool(["a", "b"])
+
+    def flaky(key):
+        if key == "a":
+            raise ValueError("broken")
+        return key
+
+    with pytest.raises(ValueError):
+        pool.call_sync(flaky)
+    assert [pool.call_sync(flaky) for _ in range(3)] == ["b"] * 3
+    assert pool.stats()["0:...a"].errors == 1
+
+
+@pytest.mark.asyncio
+async def test_music_session_does_not_hold_a_key(monkeypatch):
+    from agent import key_pool
+    from audio import audio_generator
+
+    pool = KeyPool(["a", "b"])
+    monkeypatch.setattr(key_pool, "_pool", pool)
+    closed = []
+
+    class FakeSession:
+        async def set_weighted_prompts(self, prompts):
+            pass
+
+        async def set_music_generation_config(self, config):
+            pass
+
+        async def play(self):
+            pass
+
+    class FakeConnection:
+        async def __aenter__(self):
+            return FakeSession()
+
+        async def __aexit__(self, *exc):
+            closed.append(True)
+
+    class FakeClient:
+        class aio:
+            class live:
+                class music:
+                    @staticmethod
+                    def connect(model):
+                        return FakeConnection()
+
+    monkeypatch.setattr(audio_generator, "genai_client", lambda key, **_: FakeClient)
+    in_flight = []
+
+    async def receive_audio(session, user_hash):
+        in_flight.append(sum(s.in_flight for s in pool.stats().values()))
+
+    await audio_generator.generate_music("u", "calm", receive_audio)
+    audio_generator.sessions.pop("u")
+    assert in_flight == [0] and closed == [True]
+    assert sum(s.successes for s in pool.stats().values()) == 1
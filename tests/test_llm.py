@@ -0,0 +1,106 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import LLMRoute
+from agent import llm
+from agent.key_pool import KeyPool, set_key_pool
+from agent.model_router import ModelRouter, set_model_router
+from agent.models import EndingCheckResult, SceneLLM
+from agent.narration import Narration, narrate, stream_json_field
+
+
+def test_structured_llm_reuses_runnables_per_key():
+    set_key_pool(KeyPool(["key-a", "key-b"]))
+    llm.clear_llm_cache()
+    try:
+        scene = llm.structured_llm(SceneLLM)
+        assert llm.structured_llm(SceneLLM) is scene
+        assert llm.structured_llm(SceneLLM, temperature=0) is not scene
+
+        # One cached runnable per key; other schemas reuse the key's client.
+        assert scene.for_key("key-a") is scene.for_key("key-a")
+        assert scene.for_key("key-a") is not scene.for_key("key-b")
+        ending = llm.structured_llm(EndingCheckResult).for_key("key-a")
+        assert ending.first.bound is scene.for_key("key-a").first.bound
+        assert len(llm._llms) == 2
+    finally:
+        llm.clear_llm_cache()
+        set_key_pool(None)
+
+
+@pytest.mark.asyncio
+async def test_json_llm_streams_description_to_narration(monkeypatch):
+    answer = (
+        '{"description": "The corridor stretches out in front of me.", '
+        '"choices": [{"text": "Open the door", "next_scene_short_desc": "Room"}, '
+        '{"text": "Turn back", "next_scene_short_desc": "Hall"}]}'
+    )
+    monkeypatch.setattr(
+        llm,
+        "_get_llm",
+        lambda *args: GenericFakeChatModel(messages=iter([AIMessage(content=answer)])),
+    )
+    set_key_pool(KeyPool(["key-a"]))
+    llm.clear_llm_cache()
+    seen = []
+    narration = Narration()
+    monkeypatch.setattr(narration, "publish", seen.append)
+    try:
+        with narrate(narration):
+            data = await stream_json_field(llm.json_llm(), "prompt", "description")
+    finally:
+        llm.clear_llm_cache()
+        set_key_pool(None)
+
+    assert SceneLLM.model_validate(data).choices[1].text == "Turn back"
+    # The description arrives word by word, before the choices are complete.
+    assert len(seen) > 3
+    assert seen[0] == "The"
+    assert seen[-1] == data["description"]
+
+
+class SlowChatModel(GenericFakeChatModel):
+    """Answers after ``delay`` seconds, also when streaming."""
+
+    delay: float = 0.5
+
+    def _generate(self, *args, **kwargs):
+        time.sleep(self.delay)
+        return super()._generate(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        async for chunk in super()._astream(*args, **kwargs):
+            await asyncio.sleep(self.delay)
+            yield chunk
+
+
+@pytest.mark.asyncio
+async def test_streaming_and_sync_calls_keep_the_route_deadline(monkeypatch):
+    routes = {"scene": LLMRoute(model="big", deadline_seconds=0.1)}
+    monkeypatch.setattr(
+        llm,
+        "_get_llm",
+        lambda *args: SlowChatModel(messages=iter([AIMessage(content='{"a": 1}')] * 2)),
+    )
+    set_model_router(ModelRouter(routes))
+    set_key_pool(KeyPool(["key-a"]))
+    llm.clear_llm_cache()
+    try:
+        runnable = llm.task_llm("scene")
+        with pytest.raises(TimeoutError):
+            async for _ in runnable.astream("prompt"):
+                pass
+        with pytest.raises(TimeoutError):
+            await asyncio.to_thread(runnable.invoke, "prompt")
+    finally:
+        llm.clear_llm_cache()
+        set_key_pool(None)
+        set_model_router(None)
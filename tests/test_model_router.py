@@ -0,0 +1,79 @@
+import os
+import sys
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import LLMRoute, settings
+from agent import llm
+from agent.key_pool import KeyPool, set_key_pool
+from agent.model_router import ModelRouter, get_model_router, set_model_router
+
+ROUTES = {
+    "scene": LLMRoute(
+        model="big",
+        thinking_budget=1024,
+        max_output_tokens=2048,
+        slo_seconds=1.0,
+        fallback_model="small",
+    )
+}
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(settings, "llm_route_window", 10)
+    monkeypatch.setattr(settings, "llm_route_min_samples", 5)
+    router = ModelRouter(ROUTES)
+    set_model_router(router)
+    yield router
+    set_model_router(None)
+
+
+def test_slow_task_falls_back_and_recovers(router, monkeypatch):
+    route = router.route("scene")
+    assert (route.model, route.thinking_budget, route.max_output_tokens) == (
+        "big",
+        1024,
+        2048,
+    )
+    for seconds in (0.4, 0.5, 0.6, 0.5):
+        router.observe(route, seconds)
+    router.observe(route, 2.5)
+    # p95 of the last five calls is over the one second SLO.
+    fallback = router.route("scene")
+    assert fallback.model == "small" and fallback.thinking_budget is None
+    assert fallback.max_output_tokens == 2048
+    router.observe(fallback, 0.3)
+
+    report = router.report()["scene"]
+    assert report["big"]["calls"] == 5 and report["big"]["p95"] == 3
+    assert report["small"]["buckets"]["<=0.5s"] == 1
+
+    router._fallback_until["scene"] = 0
+    assert router.route("scene").model == "big"
+
+
+@pytest.mark.asyncio
+async def test_task_llm_uses_the_routed_model(router, monkeypatch):
+    clients = []
+
+    def fake_llm(*params):
+        clients.append(params)
+        return GenericFakeChatModel(messages=iter([AIMessage(content='{"a": 1}')]))
+
+    monkeypatch.setattr(llm, "_get_llm", fake_llm)
+    set_key_pool(KeyPool(["key-a"]))
+    llm.clear_llm_cache()
+    try:
+        assert await llm.task_llm("scene").ainvoke("prompt") == {"a": 1}
+    finally:
+        llm.clear_llm_cache()
+        set_key_pool(None)
+
+    api_key, model, _, _, thinking_budget, max_output_tokens = clients[0]
+    assert (model, thinking_budget, max_output_tokens) == ("big", 1024, 2048)
+    assert get_model_router().report()["scene"]["big"]["calls"] == 1
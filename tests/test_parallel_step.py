@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from agent import redis_state
+from agent.models import Ending, Scene, SceneChoice
+from agent.parallel_step import StepTimings, check_ending_and_generate_scene
+
+ENDING_DELAY = 0.2
+SCENE_DELAY = 0.3
+
+
+def _fake_llm(ending_reached: bool):
+    """Tool stand-ins that write to the state after a fixed delay."""
+    calls = {"scene_finished": False}
+
+    async def check_ending():
+        await asyncio.sleep(ENDING_DELAY)
+        if not ending_reached:
+            return {"ending_reached": False}
+        ending = Ending(id="end", type="good", condition="c", description="Home")
+        await redis_state.set_ending("u", ending)
+        return {"ending_reached": True, "ending": ending.model_dump()}
+
+    async def generate_scene():
+        await asyncio.sleep(SCENE_DELAY)
+        scene = Scene(
+            scene_id="next",
+            description="A new room",
+            choices=[SceneChoice(text="Go", next_scene_short_desc="On")],
+        )
+        await redis_state.add_scene("u", scene)
+        calls["scene_finished"] = True
+        return scene.model_dump()
+
+    return check_ending, generate_scene, calls
+
+
+@pytest.mark.asyncio
+async def test_scene_overlaps_ending_check(backend):
+    check_ending, generate_scene, _ = _fake_llm(ending_reached=False)
+    timings = StepTimings()
+    started = time.monotonic()
+    async with redis_state.step_state("u"):
+        ending, scene = await check_ending_and_generate_scene(
+            "u", check_ending, generate_scene, timings
+        )
+        assert (await redis_state.get_current_scene("u")).scene_id == "next"
+    elapsed = time.monotonic() - started
+
+    assert ending == {"ending_reached": False}
+    assert scene["scene_id"] == "next"
+    # The critical path is the slower call, not the sum of both.
+    assert elapsed < ENDING_DELAY + SCENE_DELAY - 0.1
+    assert set(timings.phases) == {"ending", "scene", "scene wait"}
+    state = await backend.get("u")
+    assert state.current_scene_id == "next" and list(state.scenes) == ["next"]
+
+
+@pytest.mark.asyncio
+async def test_ending_cancels_scene_and_discards_its_writes(backend):
+    check_ending, generate_scene, calls = _fake_llm(ending_reached=True)
+    started = time.monotonic()
+    async with redis_state.step_state("u"):
+        ending, scene = await check_ending_and_generate_scene(
+            "u", check_ending, generate_scene
+        )
+    assert time.monotonic() - started < SCENE_DELAY
+
+    assert ending["ending_reached"] and scene is None
+    assert not calls["scene_finished"]
+    state = await backend.get("u")
+    assert state.ending.id == "end"
+    assert state.scenes == {} and state.current_scene_id is None
+
+
+@pytest.mark.asyncio
+async def test_without_step_calls_run_in_order(backend):
+    check_ending, generate_scene, calls = _fake_llm(ending_reached=True)
+    ending, scene = await check_ending_and_generate_scene(
+        "u", check_ending, generate_scene
+    )
+    assert scene is None and not calls["scene_finished"]
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import sys
+
+import fakeredis
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from agent.models import ChangeScene
+from agent.prompt_cache import PromptCache, cache_key
+
+
+def counting(calls, delay=0.0):
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return ChangeScene(change_scene="modify", scene_description=f"v{len(calls)}")
+
+    return compute
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_call():
+    cache = PromptCache("test", ChangeScene, shared=None)
+    calls = []
+    key = cache_key("model", "system", "A dark  cave.\n")
+    assert key == cache_key("model", "system", " A dark cave.")
+    assert key != cache_key("other-model", "system", "A dark cave.")
+
+    answers = await asyncio.gather(
+        *(cache.get_or_compute(key, counting(calls, 0.05)) for _ in range(5))
+    )
+    assert len(calls) == 1
+    assert {a.scene_description for a in answers} == {"v1"}
+    assert (await cache.get_or_compute(key, counting(calls))).scene_description == "v1"
+    assert cache.stats.misses == 1
+    assert cache.stats.coalesced == 4 and cache.stats.local_hits == 1
+    assert cache.stats.hit_rate == pytest.approx(5 / 6)
+
+
+@pytest.mark.asyncio
+async def test_shared_tier_is_used_across_workers(monkeypatch):
+    monkeypatch.setattr(settings, "prompt_cache_shared_max_entries", 2)
+    fake = fakeredis.FakeAsyncRedis()
+    first = PromptCache("test", ChangeScene, shared=lambda: fake)
+    second = PromptCache("test", ChangeScene, shared=lambda: fake)
+    calls = []
+
+    await first.get_or_compute("a", counting(calls))
+    answer = await second.get_or_compute("a", counting(calls))
+    assert answer.scene_description == "v1" and len(calls) == 1
+    assert second.stats.shared_hits == 1
+    assert 0 < await fake.ttl(first._redis_key("a")) <= settings.prompt_cache_ttl
+
+    await first.get_or_compute("b", counting(calls))
+    await first.get_or_compute("c", counting(calls))
+    # Only the two newest entries are kept in Redis.
+    assert await fake.zcard(first._index_key()) == 2
+    assert await fake.get(first._redis_key("a")) is None
+
+
+@pytest.mark.asyncio
+async def test_redis_errors_fall_back_to_the_model():
+    class Broken:
+        async def get(self, key):
+            raise ConnectionError("down")
+
+        def pipeline(self, transaction=True):
+            raise ConnectionError("down")
+
+    cache = PromptCache("test", ChangeScene, shared=Broken)
+    calls = []
+    answer = await cache.get_or_compute("a", counting(calls))
+    assert answer.scene_description == "v1"
+    assert cache.stats.errors == 2
@@ -1,13 +1,20 @@
+import asyncio
+import json
 import os
 import sys
 
 import pytest
 import fakeredis
+import msgpack
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
 
-from agent import redis_state
-from agent.models import UserState
+from config import settings
+from agent import redis_report, redis_state, state_codec
+from agent.models import ChangeScene, Scene, SceneChoice, UserChoice, UserState
+from agent.prompt_cache import PromptCache
+from agent.state_cache import StateCache
+from agent.state_context import StateChanges
 
 
 @pytest.mark.asyncio
@@ -27,3 +34,280 @@ async def test_user_repository_get_set_reset(monkeypatch):
     await redis_state.reset_user_state(user_id)
     reset_state = await redis_state.get_user_state(user_id)
     assert reset_state.current_scene_id is None
+
+
+@pytest.mark.asyncio
+async def test_user_repository_partial_updates():
+    fake = fakeredis.FakeAsyncRedis()
+    repo = redis_state.UserRepository()
+    repo.redis = fake
+
+    user_id = "user123"
+    scene = Scene(
+        scene_id="scene1",
+        description="A dark hall",
+        choices=[SceneChoice(text="Go", next_scene_short_desc="Corridor")],
+    )
+    await repo.add_scene(user_id, scene)
+    await repo.append_user_choice(
+        user_id, UserChoice(scene_id="scene1", choice_text="Go")
+    )
+    assert await repo.update_scene_image(user_id, "scene1", "img.png")
+    assert not await repo.update_scene_image(user_id, "missing", "img.png")
+
+    current = await repo.get_current_scene(user_id)
+    assert current.image == "img.png"
+    # Only the touched scene field is rewritten, the other keys stay intact.
+    assert await fake.hkeys(f"llmgamehub:{{{user_id}}}:scenes") == [b"scene1"]
+
+    state = await repo.get(user_id)
+    assert state.current_scene_id == "scene1"
+    assert state.scenes["scene1"].image == "img.png"
+    assert [c.choice_text for c in state.user_choices] == ["Go"]
+
+    version = await repo.set(user_id, state)
+    stored = await repo.get(user_id)
+    assert stored.version == version == state.version + 1
+    assert stored.model_dump(exclude={"version"}) == state.model_dump(
+        exclude={"version"}
+    )
+
+
+@pytest.mark.asyncio
+async def test_step_state_batches_redis_operations(monkeypatch):
+    fake = fakeredis.FakeAsyncRedis()
+    repo = redis_state.UserRepository()
+    repo.redis = fake
+    monkeypatch.setattr(redis_state, "_repo", repo)
+
+    user_id = "user123"
+    scene = Scene(scene_id="scene1", description="A dark hall", choices=[])
+    await redis_state.add_scene(user_id, scene)
+
+    async with redis_state.step_state(user_id) as step:
+        current = await redis_state.get_current_scene(user_id)
+        await redis_state.append_user_choice(
+            user_id, UserChoice(scene_id=current.scene_id, choice_text="Go")
+        )
+        assert len(await redis_state.get_user_choices(user_id)) == 1
+        next_scene = Scene(scene_id="scene2", description="A corridor", choices=[])
+        await redis_state.add_scene(user_id, next_scene)
+        await redis_state.update_scene_image(user_id, "scene2", "img.png")
+        assert (await redis_state.get_current_scene(user_id)).image == "img.png"
+        # Nothing is written until the step finishes.
+        assert await fake.llen(f"llmgamehub:{{{user_id}}}:choices") == 0
+
+    assert step.stats.round_trips == 2
+    state = await redis_state.get_user_state(user_id)
+    assert state.current_scene_id == "scene2"
+    assert state.scenes["scene2"].image == "img.png"
+    assert [c.choice_text for c in state.user_choices] == ["Go"]
+
+
+def test_state_codec_roundtrip_and_legacy_payloads():
+    state = UserState(
+        current_scene_id="scene1",
+        scenes={"scene1": Scene(scene_id="scene1", description="Hall", choices=[])},
+        milestones_achieved={"m2", "m1"},
+        user_choices=[UserChoice(scene_id="scene1", choice_text="Go")],
+    )
+    data = state_codec.encode_state(state)
+    assert data[0] == state_codec.SCHEMA_VERSION
+    assert state_codec.decode_state(data) == state
+
+    legacy = msgpack.packb(json.loads(state.json()))
+    assert state_codec.decode_state(legacy) == state
+
+    with pytest.raises(state_codec.CodecError):
+        state_codec.decode_raw(bytes([state_codec.SCHEMA_VERSION + 1]))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writers_do_not_lose_updates(monkeypatch):
+    monkeypatch.setattr(settings, "hot_scene_limit", 100)
+    fake = fakeredis.FakeAsyncRedis()
+    repo = redis_state.UserRepository()
+    repo.redis = fake
+    user_id = "user123"
+    writers = 25
+    await repo.set(
+        user_id,
+        UserState(
+            scenes={
+                f"scene{i}": Scene(scene_id=f"scene{i}", description="", choices=[])
+                for i in range(writers)
+            }
+        ),
+    )
+
+    def add_asset(i):
+        def mutate(state):
+            return StateChanges(fields={"assets": {**state.assets, f"a{i}": "x"}})
+
+        return mutate
+
+    async def writer(i):
+        await asyncio.sleep(0)
+        await repo.update(user_id, add_asset(i))
+        await repo.append_user_choice(
+            user_id, UserChoice(scene_id=f"scene{i}", choice_text=str(i))
+        )
+        await repo.update_scene_image(user_id, f"scene{i}", f"{i}.png")
+
+    await asyncio.gather(*(writer(i) for i in range(writers)))
+
+    state = await repo.get(user_id)
+    assert set(state.assets) == {f"a{i}" for i in range(writers)}
+    assert sorted(int(c.choice_text) for c in state.user_choices) == list(
+        range(writers)
+    )
+    assert all(state.scenes[f"scene{i}"].image == f"{i}.png" for i in range(writers))
+    assert state.version == 1 + 3 * writers
+    assert repo.stats.conflicts > 0
+
+
+@pytest.mark.asyncio
+async def test_step_commit_keeps_concurrent_writes(monkeypatch):
+    fake = fakeredis.FakeAsyncRedis()
+    repo = redis_state.UserRepository()
+    repo.redis = fake
+    monkeypatch.setattr(redis_state, "_repo", repo)
+    user_id = "user123"
+    for scene_id in ("scene1", "scene2"):
+        await repo.add_scene(
+            user_id, Scene(scene_id=scene_id, description="", choices=[])
+        )
+
+    async with redis_state.step_state(user_id):
+        await redis_state.get_user_state(user_id)
+        # Another request updates the state after this step has loaded it.
+        await asyncio.create_task(repo.update_scene_image(user_id, "scene1", "a.png"))
+        await redis_state.update_scene_image(user_id, "scene2", "b.png")
+
+    state = await repo.get(user_id)
+    assert state.scenes["scene1"].image == "a.png"
+    assert state.scenes["scene2"].image == "b.png"
+
+
+@pytest.mark.asyncio
+async def test_legacy_blob_is_migrated_to_hash_tagged_keys():
+    fake = fakeredis.FakeAsyncRedis()
+    repo = redis_state.UserRepository()
+    repo.redis = fake
+    user_id = "user123"
+    legacy = UserState(current_scene_id="scene1")
+    await fake.hset(
+        f"llmgamehub:{user_id}",
+        mapping={"data": msgpack.packb(json.loads(legacy.json()))},
+    )
+
+    state = await repo.get(user_id)
+    assert state.current_scene_id == "scene1"
+    assert not await fake.exists(f"llmgamehub:{user_id}")
+    assert await fake.hexists(f"llmgamehub:{{{user_id}}}", "current_scene_id")
+
+
+@pytest.mark.asyncio
+async def test_reset_removes_a_legacy_blob():
+    fake = fakeredis.FakeAsyncRedis()
+    repo = redis_state.UserRepository()
+    repo.redis = fake
+    user_id = "user123"
+    legacy = UserState(current_scene_id="scene1")
+    await fake.hset(
+        f"llmgamehub:{user_id}",
+        mapping={"data": msgpack.packb(json.loads(legacy.json()))},
+    )
+
+    await repo.reset(user_id)
+    assert not await fake.exists(f"llmgamehub:{user_id}")
+    assert (await repo.get(user_id)).current_scene_id is None
+
+
+async def _answer():
+    return ChangeScene(change_scene="no_change")
+
+
+@pytest.mark.asyncio
+async def test_report_counts_prompt_cache_apart_from_user_state():
+    fake = fakeredis.FakeAsyncRedis()
+    repo = redis_state.UserRepository()
+    repo.redis = fake
+    await repo.set("user123", UserState(current_scene_id="scene1"))
+    await fake.hset("llmgamehub:legacy-user", mapping={"data": b"blob"})
+    cache = PromptCache("image_prompt", ChangeScene, shared=lambda: fake)
+    for text in ("a", "b"):
+        await cache.get_or_compute(text, _answer)
+
+    reports = await redis_report.collect(fake)
+    assert len(reports["prompt_cache"].sizes) == 3  # two entries and the index
+    assert len(reports["legacy"].sizes) == 1
+    assert len(reports["state"].sizes) == 1
+    assert "users: 1" in redis_report.format_report(reports)
+
+
+@pytest.mark.asyncio
+async def test_state_cache_write_through_and_invalidation():
+    server = fakeredis.FakeServer()
+    workers = []
+    for _ in range(2):
+        repo = redis_state.UserRepository(cache=StateCache(max_size=1, ttl=60))
+        repo.redis = fakeredis.FakeAsyncRedis(server=server)
+        workers.append(repo)
+    first, second = workers
+    user_id = "user123"
+    scene = Scene(scene_id="scene1", description="Hall", choices=[])
+
+    async def wait_until(predicate):
+        for _ in range(100):
+            if predicate():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("condition not reached")
+
+    await first.get(user_id)
+    await second.get(user_id)
+    await wait_until(lambda: first._cache_live and second._cache_live)
+
+    await first.add_scene(user_id, scene)
+    await second.get(user_id)
+    # Written through on the first worker, loaded once on the second.
+    assert (await first.get(user_id)).current_scene_id == "scene1"
+    assert (await second.get(user_id)).current_scene_id == "scene1"
+    assert first.cache.stats.hits == 1
+    assert second.cache.stats.hits == 1
+
+    await first.update_scene_image(user_id, "scene1", "img.png")
+    await wait_until(lambda: len(second.cache) == 0)
+    assert (await second.get_current_scene(user_id)).image == "img.png"
+
+    await second.get(user_id)
+    await second.get("other-user")
+    assert second.cache.stats.evictions == 1
+
+    for repo in workers:
+        repo._listener.cancel()
+
+
+@pytest.mark.asyncio
+async def test_old_scenes_are_archived_and_keys_expire(monkeypatch):
+    monkeypatch.setattr(settings, "hot_scene_limit", 4)
+    monkeypatch.setattr(settings, "state_ttl_seconds", 3600)
+    fake = fakeredis.FakeAsyncRedis()
+    repo = redis_state.UserRepository()
+    repo.redis = fake
+    user_id = "user123"
+
+    for i in range(5):
+        await repo.add_scene(
+            user_id, Scene(scene_id=f"scene{i}", description="", choices=[])
+        )
+    await asyncio.gather(*repo._archiving.values())
+
+    state = await repo.get(user_id)
+    assert set(state.scenes) == {"scene3", "scene4"}
+    assert state.current_scene_id == "scene4"
+    archived = await repo.get_archived_scenes(user_id)
+    assert [s.scene_id for s in archived] == ["scene0", "scene1", "scene2"]
+    assert 0 < await fake.ttl(f"llmgamehub:{{{user_id}}}:archive") <= 3600
+    assert 0 < await fake.ttl(f"llmgamehub:{{{user_id}}}") <= 3600
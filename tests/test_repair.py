@@ -0,0 +1,121 @@
+import os
+import sys
+from typing import List
+
+import pytest
+from langchain_core.messages import AIMessage
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from agent import repair
+from agent.models import SceneChoice, SceneLLM
+
+CHOICE = {"text": "Open the door", "next_scene_short_desc": "Room"}
+
+
+def two_choices(resp):
+    return None if len(resp.choices) >= 2 else ("choices", "two choices needed")
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(repair, "_stats", {})
+    monkeypatch.setattr(settings, "llm_repair_backoff", 0.01)
+
+
+def raw_answer(content="", args=None):
+    tool_calls = [{"name": "SceneLLM", "args": args, "id": "1"}] if args else []
+    return {"raw": AIMessage(content=content, tool_calls=tool_calls), "parsed": None}
+
+
+async def no_completion(model, prompt):
+    raise AssertionError("no completion call expected")
+
+
+@pytest.mark.asyncio
+async def test_invalid_items_and_truncated_json_are_salvaged_locally():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        # Truncated mid-answer, with one broken choice.
+        return raw_answer(
+            '{"description": "A hall", "choices": [{"text": "Left", '
+            '"next_scene_short_desc": "L"}, {"text": "Broken"}, '
+            '{"text": "Right", "next_scene_short_desc": "R"'
+        )
+
+    resp = await repair.repair_structured(
+        "scene", SceneLLM, call, two_choices, complete_fields=no_completion
+    )
+    assert [c.text for c in resp.choices] == ["Left", "Right"]
+    stats = repair.get_repair_stats()["scene"]
+    assert (stats.salvaged, stats.retries, len(calls)) == (1, 0, 1)
+
+
+@pytest.mark.asyncio
+async def test_missing_field_is_completed_with_a_small_call():
+    prompts = []
+
+    async def call():
+        return raw_answer(args={"description": "A hall", "choices": [CHOICE]})
+
+    async def complete_fields(model, prompt):
+        prompts.append(prompt)
+        assert list(model.model_fields) == ["choices"]
+        return model(choices=[SceneChoice(**CHOICE), SceneChoice(**CHOICE)])
+
+    resp = await repair.repair_structured(
+        "scene", SceneLLM, call, two_choices, complete_fields=complete_fields
+    )
+    assert resp.description == "A hall" and len(resp.choices) == 2
+    assert "two choices needed" in prompts[0] and "A hall" in prompts[0]
+    assert repair.get_repair_stats()["scene"].completed == 1
+
+
+@pytest.mark.asyncio
+async def test_full_retry_is_the_capped_last_resort(monkeypatch):
+    monkeypatch.setattr(settings, "llm_repair_max_retries", 2)
+    answers: List = [raw_answer("not json"), raw_answer("still not json")]
+
+    async def call():
+        if answers:
+            return answers.pop(0)
+        return SceneLLM(description="A hall", choices=[CHOICE, CHOICE])
+
+    async def give_up(model, prompt):
+        return None
+
+    resp = await repair.repair_structured(
+        "scene", SceneLLM, call, two_choices, complete_fields=give_up
+    )
+    assert len(resp.choices) == 2
+    stats = repair.get_repair_stats()["scene"]
+    assert (stats.retries, stats.valid, stats.failed) == (2, 1, 0)
+    assert stats.added_seconds > 0
+
+    answers.extend([raw_answer("x")] * 3)
+    with pytest.raises(repair.StructuredOutputError):
+        await repair.repair_structured("scene", SceneLLM, call, complete_fields=give_up)
+    assert repair.get_repair_stats()["scene"].failed == 1
+
+
+@pytest.mark.asyncio
+async def test_valid_answer_after_a_failed_stream_is_counted():
+    async def stream():
+        # A cut off stream that cannot be salvaged.
+        return {"description": "A hall"}
+
+    async def call():
+        return SceneLLM(description="A hall", choices=[CHOICE, CHOICE])
+
+    async def give_up(model, prompt):
+        return None
+
+    resp = await repair.repair_structured(
+        "scene", SceneLLM, call, two_choices, first=stream, complete_fields=give_up
+    )
+    assert len(resp.choices) == 2
+    stats = repair.get_repair_stats()["scene"]
+    assert (stats.valid, stats.salvaged, stats.retries) == (1, 0, 0)
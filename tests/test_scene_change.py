@@ -0,0 +1,97 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from agent import image_agent
+from agent.models import ChangeScene
+from agent.scene_change import classify, get_scene_change_stats
+
+TAVERN = (
+    "The tavern is loud and warm. Sailors sing by the fireplace while the "
+    "barkeep polishes mugs behind the counter."
+)
+
+
+def test_obvious_cases_are_decided_locally():
+    same = classify(
+        TAVERN,
+        "The barkeep sets down a mug and leans across the counter. Behind him "
+        "the sailors keep singing by the fireplace in the warm tavern.",
+        "Ask the barkeep about the ship",
+    )
+    assert same.decision == "no_change"
+
+    moved = classify(
+        TAVERN,
+        "I climb down into a deep ravine. Wet stone walls rise on both sides "
+        "and a cold river roars past my boots.",
+        "Leave the tavern",
+    )
+    assert moved.decision == "change_completely"
+    assert "ravine" in moved.new_locations
+
+
+def test_ambiguous_change_is_left_to_the_llm():
+    change = classify(
+        TAVERN,
+        "The tavern falls silent as a hooded stranger steps through the door. "
+        "Sailors stop singing and stare while snow blows in behind him.",
+        "Watch the stranger",
+    )
+    assert change.decision is None
+
+
+@pytest.mark.asyncio
+async def test_scene_image_prompt_skips_the_agent(monkeypatch):
+    calls = []
+
+    async def agent(description, request_id):
+        calls.append(description)
+        return ChangeScene(change_scene="modify", scene_description="stranger")
+
+    monkeypatch.setattr(image_agent, "generate_image_prompt", agent)
+    stats = get_scene_change_stats()
+    llm_before = stats.llm
+
+    scene = {"description": "I walk into the temple. Monks chant under a dome."}
+    change = await image_agent.scene_image_prompt(scene, "u", TAVERN, "Enter the temple")
+    assert change.change_scene == "change_completely"
+    assert "Monks chant" in change.scene_description
+    assert calls == []
+
+    scene = {"description": "A hooded stranger stands in the doorway."}
+    change = await image_agent.scene_image_prompt(scene, "u", TAVERN, "Look up")
+    assert change.change_scene == "modify"
+    assert calls == [scene["description"]]
+    assert stats.llm == llm_before + 1
+
+
+@pytest.mark.asyncio
+async def test_scenes_in_other_languages_go_to_the_agent(monkeypatch, tmp_path):
+    taberna = (
+        "La taberna es ruidosa y cálida. Los marineros cantan junto a la "
+        "chimenea mientras el tabernero limpia las jarras."
+    )
+    barranco = (
+        "Bajo a un barranco profundo. Muros de piedra mojada se alzan a ambos "
+        "lados y un río frío ruge junto a mis botas."
+    )
+    local = classify(taberna, barranco, "Salir de la taberna")
+    assert local.decision is None and not local.english
+
+    calls = []
+
+    async def agent(description, request_id):
+        calls.append(description)
+        return ChangeScene(change_scene="change_completely", scene_description="ravine")
+
+    corpus = tmp_path / "corpus.jsonl"
+    monkeypatch.setattr(image_agent, "generate_image_prompt", agent)
+    monkeypatch.setattr(image_agent.settings, "scene_change_corpus_path", str(corpus))
+    scene = {"description": barranco}
+    change = await image_agent.scene_image_prompt(scene, "u", taberna, "Salir")
+    assert change.scene_description == "ravine" and calls == [barranco]
+    assert '"local": null' in corpus.read_text(encoding="utf-8")
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from agent import redis_state
+from agent.assets import record_asset
+from agent.models import HistorySummary, Scene, SceneChoice, UserChoice
+from agent.speculation import Speculator, speculating
+from agent.state_context import StateChanges
+from images.asset_store import AssetStore, set_asset_store
+
+
+def _fake_step(delay: float = 0.01):
+    """Stand-in for running the graph: records a choice and a new scene."""
+
+    async def run(choice_text: str) -> dict:
+        assert speculating()
+        await asyncio.sleep(delay)
+        scene = Scene(
+            scene_id=f"after {choice_text}",
+            description=f"You chose {choice_text}",
+            choices=[SceneChoice(text="Next", next_scene_short_desc="More")],
+        )
+        await redis_state.append_user_choice(
+            "u",
+            UserChoice(scene_id="start", choice_text=choice_text, timestamp="then"),
+        )
+        await redis_state.add_scene("u", scene)
+        return {"scene": scene.model_dump(), "game_over": False}
+
+    return run
+
+
+@pytest.mark.asyncio
+async def test_claimed_branch_is_committed_and_others_discarded(backend):
+    speculator = Speculator(max_branches=2, max_concurrent=8, timeout=5)
+    assert speculator.schedule("u", ["left", "right", "back"], _fake_step()) == 2
+    assert speculator.stats.skipped == 1
+    await asyncio.sleep(0.05)
+    # Branches never write to the store on their own.
+    assert (await backend.get("u")).scenes == {}
+
+    async with redis_state.step_state("u") as step:
+        response = await speculator.claim(step, "left")
+    assert response["scene"]["scene_id"] == "after left"
+
+    state = await backend.get("u")
+    assert list(state.scenes) == ["after left"]
+    assert state.current_scene_id == "after left"
+    assert [c.choice_text for c in state.user_choices] == ["left"]
+    assert speculator.stats.hits == 1 and speculator.stats.hit_rate == 1.0
+
+
+@pytest.mark.asyncio
+async def test_free_text_and_stale_branches_fall_back(backend):
+    speculator = Speculator(max_branches=2, max_concurrent=8, timeout=5)
+
+    speculator.schedule("u", ["left", "right"], _fake_step(delay=1))
+    async with redis_state.step_state("u") as step:
+        assert await speculator.claim(step, "dance") is None
+    assert speculator.stats.misses == 1
+    assert speculator.stats.cancelled == 2
+    assert speculator.running() == 0
+
+    speculator.schedule("u", ["left"], _fake_step())
+    await asyncio.sleep(0.05)
+    await backend.apply("u", StateChanges(fields={"current_scene_id": "other"}))
+    async with redis_state.step_state("u") as step:
+        assert await speculator.claim(step, "left") is None
+    assert speculator.stats.stale == 1
+    assert (await backend.get("u")).scenes == {}
+    assert speculator.stats.hit_rate == 0.0
+
+
+@pytest.mark.asyncio
+async def test_archiving_does_not_make_branches_stale(backend, monkeypatch):
+    for i in range(4):
+        scene = Scene(scene_id=f"s{i}", description="", choices=[])
+        await backend.add_scene("u", scene)
+        choice = UserChoice(scene_id=scene.scene_id, choice_text="c")
+        await backend.append_user_choice("u", choice)
+    summary = HistorySummary(summary="summary", covered=3)
+    await backend.apply("u", StateChanges(fields={"history": summary}))
+    speculator = Speculator(max_branches=1, max_concurrent=8, timeout=5)
+
+    speculator.schedule("u", ["left"], _fake_step())
+    await asyncio.sleep(0.05)
+    # Background archiving bumps the version while the player reads.
+    assert await backend.archive_scenes("u", keep=1) == 3
+    assert await backend.archive_choices("u", keep=1) == 3
+    async with redis_state.step_state("u") as step:
+        assert await speculator.claim(step, "left") is not None
+    assert speculator.stats.hits == 1 and speculator.stats.stale == 0
+
+    state = await backend.get("u")
+    assert state.current_scene_id == "after left" and state.choice_count == 5
+    # The choice is timed when it is claimed, not when it was played out.
+    assert state.user_choices[-1].timestamp not in (None, "then")
+
+
+@pytest.mark.asyncio
+async def test_discarded_branch_leaves_no_asset_ref(backend, tmp_path):
+    store = AssetStore(str(tmp_path / "images"))
+    set_asset_store(store)
+
+    async def run(choice_text: str) -> dict:
+        path = await store.put(choice_text.encode())
+        await record_asset("u", f"after {choice_text}", path)
+        return {"image": path}
+
+    try:
+        speculator = Speculator(max_branches=2, max_concurrent=8, timeout=5)
+        speculator.schedule("u", ["left", "right"], run)
+        await asyncio.sleep(0.05)
+        # Finished branches have not referenced their images yet.
+        assert (await store.size())["refs"] == 0
+
+        async with redis_state.step_state("u") as step:
+            response = await speculator.claim(step, "left")
+        assert (await store.size()) == {"assets": 2, "bytes": 9, "refs": 1}
+        state = await backend.get("u")
+        assert list(state.assets) == ["after left"]
+        assert state.assets["after left"] in response["image"]
+    finally:
+        set_asset_store(None)
+        store.close()
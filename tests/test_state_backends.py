@@ -0,0 +1,189 @@
+import asyncio
+import os
+import sys
+
+import pytest
+import fakeredis
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import settings
+from agent import history, redis_state
+from agent.memory_state import MemoryStateBackend
+from agent.models import (
+    HistorySummary,
+    Scene,
+    SceneChoice,
+    StoryFrame,
+    UserChoice,
+    UserState,
+)
+from agent.sqlite_state import SQLiteStateBackend
+from agent.state_backend import StateBackend
+from agent.state_context import StateChanges
+
+
+def _scene(scene_id: str) -> Scene:
+    return Scene(
+        scene_id=scene_id,
+        description=f"Scene {scene_id}",
+        choices=[SceneChoice(text="Go", next_scene_short_desc="Next")],
+    )
+
+
+@pytest.fixture(params=["redis", "memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "redis":
+        repo = redis_state.UserRepository()
+        repo.redis = fakeredis.FakeAsyncRedis()
+        yield repo
+    elif request.param == "memory":
+        yield MemoryStateBackend()
+    else:
+        repo = SQLiteStateBackend(str(tmp_path / "state.db"))
+        yield repo
+        repo.close()
+
+
+@pytest.mark.asyncio
+async def test_backend_roundtrip(backend):
+    assert isinstance(backend, StateBackend)
+    assert await backend.get("u") == UserState()
+
+    frame = StoryFrame(
+        lore="lore",
+        goal="goal",
+        milestones=[],
+        endings=[],
+        setting="castle",
+        character={"name": "Ann"},
+        genre="fantasy",
+    )
+    state = UserState(
+        story_frame=frame,
+        current_scene_id="s1",
+        scenes={"s1": _scene("s1")},
+        milestones_achieved={"m1"},
+        user_choices=[UserChoice(scene_id="s1", choice_text="Go")],
+    )
+    version = await backend.set("u", state)
+    fetched = await backend.get("u")
+    assert fetched.version == version
+    assert fetched.model_dump(exclude={"version"}) == state.model_dump(
+        exclude={"version"}
+    )
+    assert await backend.get_story_frame("u") == frame
+
+    await backend.reset("u")
+    assert await backend.get("u") == UserState()
+
+
+@pytest.mark.asyncio
+async def test_backend_partial_operations(backend):
+    await backend.add_scene("u", _scene("s1"))
+    await backend.add_scene("u", _scene("s2"), make_current=False)
+    await backend.append_user_choice("u", UserChoice(scene_id="s1", choice_text="a"))
+    await backend.append_user_choice("u", UserChoice(scene_id="s1", choice_text="b"))
+    assert await backend.update_scene_image("u", "s2", "img.png")
+    assert not await backend.update_scene_image("u", "missing", "img.png")
+
+    assert (await backend.get_current_scene("u")).scene_id == "s1"
+    assert (await backend.get_scene("u", "s2")).image == "img.png"
+    choices = await backend.get_user_choices("u")
+    assert [c.choice_text for c in choices] == ["a", "b"]
+
+    # Reads hand out copies.
+    (await backend.get_scene("u", "s2")).image = None
+    assert (await backend.get("u")).scenes["s2"].image == "img.png"
+
+
+@pytest.mark.asyncio
+async def test_backend_versions_and_concurrent_updates(backend, monkeypatch):
+    monkeypatch.setattr(settings, "hot_scene_limit", 100)
+    first = await backend.apply("u", StateChanges(fields={"current_scene_id": "a"}))
+    second = await backend.apply("u", StateChanges(fields={"current_scene_id": "b"}))
+    assert second == first + 1
+    assert await backend.apply("u", StateChanges()) is None
+
+    def add_scene(state: UserState) -> StateChanges:
+        scene_id = f"s{len(state.scenes)}"
+        return StateChanges(scenes={scene_id: _scene(scene_id)})
+
+    await asyncio.gather(*(backend.update("u", add_scene) for _ in range(20)))
+    state = await backend.get("u")
+    assert sorted(state.scenes) == sorted(f"s{i}" for i in range(20))
+    assert state.version == second + 20
+
+
+@pytest.mark.asyncio
+async def test_backend_image_update_keeps_stored_scene(backend):
+    await backend.add_scene("u", _scene("s1"))
+    stale = await backend.get_scene("u", "s1")
+    await backend.apply(
+        "u",
+        StateChanges(scenes={"s1": stale.model_copy(update={"description": "New"})}),
+    )
+
+    # Image updates are applied to the stored scene, not to a stale copy.
+    await backend.apply("u", StateChanges(scene_images={"s1": "img.png"}))
+    scene = await backend.get_scene("u", "s1")
+    assert (scene.description, scene.image) == ("New", "img.png")
+
+
+@pytest.mark.asyncio
+async def test_backend_archive(backend, monkeypatch):
+    monkeypatch.setattr(settings, "hot_scene_limit", 100)
+    for i in range(6):
+        await backend.add_scene("u", _scene(f"s{i}"), make_current=i == 0)
+
+    assert await backend.archive_scenes("u", keep=2) == 3
+    state = await backend.get("u")
+    assert sorted(state.scenes) == ["s0", "s4", "s5"]
+    archived = await backend.get_archived_scenes("u")
+    assert [s.scene_id for s in archived] == ["s1", "s2", "s3"]
+    assert await backend.archive_scenes("u", keep=2) == 0
+
+
+@pytest.mark.asyncio
+async def test_replaced_state_drops_the_old_archives(backend, monkeypatch):
+    monkeypatch.setattr(settings, "hot_scene_limit", 100)
+    for i in range(4):
+        await backend.add_scene("u", _scene(f"s{i}"), make_current=i == 3)
+        choice = UserChoice(scene_id=f"s{i}", choice_text="c")
+        await backend.append_user_choice("u", choice)
+    summary = HistorySummary(summary="summary", covered=3)
+    await backend.apply("u", StateChanges(fields={"history": summary}))
+    assert await backend.archive_scenes("u", keep=1) == 3
+    assert await backend.archive_choices("u", keep=1) == 3
+
+    # A new game replaces the whole state.
+    await backend.set("u", UserState(current_scene_id="new"))
+    assert await backend.get_archived_scenes("u") == []
+    assert await backend.get_archived_choices("u") == []
+    state = await backend.get("u")
+    assert (state.scenes, state.user_choices, state.archived_choices) == ({}, [], 0)
+
+
+@pytest.mark.asyncio
+async def test_long_session_archives_summarized_choices(backend, monkeypatch):
+    monkeypatch.setattr(settings, "hot_choice_limit", 10)
+    hot = []
+    for i in range(60):
+        choice = UserChoice(scene_id=f"s{i}", choice_text=f"c{i}")
+        await backend.append_user_choice("u", choice)
+        if i % 10 == 9:
+            # The summary folds all but the three most recent choices.
+            summary = HistorySummary(summary="summary", covered=i - 2)
+            await backend.apply("u", StateChanges(fields={"history": summary}))
+        # Redis archives in the background.
+        await asyncio.gather(*getattr(backend, "_archiving", {}).values())
+        hot.append(len(await backend.get_user_choices("u")))
+
+    state = await backend.get("u")
+    assert max(hot) < 20 and len(state.user_choices) <= 10
+    assert state.choice_count == 60
+    assert state.archived_choices <= state.history.covered
+    archived = await backend.get_archived_choices("u")
+    texts = [c.choice_text for c in archived + state.user_choices]
+    assert texts == [f"c{i}" for i in range(60)]
+    assert history.format_history(state) == "summary Then: c57; c58; c59"